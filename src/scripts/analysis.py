@@ -1,25 +1,36 @@
 '''
 Main analysis script
+
+matplotlib, seaborn, scipy and IPython are imported by the functions that use
+them, and the sunlight style is set on the first plot.
 '''
-from matplotlib.colors import ListedColormap
-from IPython.display import display_html
-import matplotlib.ticker as ticker
-import matplotlib.pyplot as plt
-from scipy import stats
-import seaborn as sns
+from scripts.utils import compact_dtype
 import pandas as pd
 import numpy as np
-import matplotlib
 import pickle
 import math
+import os
 import re
 
 # setting sunlight foundation colors for graphs
-sns.set(font='Arial', style="whitegrid")
 sunlight = ["#d9b80d", "#ce4500", "#2e565a", "#323235", "#fafaf5"]
 color_codes_wanted = ['yellow', 'red', 'blue', 'black', 'cream']
 c = lambda x: sunlight[color_codes_wanted.index(x)]
-sns.set_palette(sunlight)
+_styled = False
+
+def _pyplot():
+    '''
+    Imports pyplot and seaborn, setting the sunlight style the first time
+    '''
+    global _styled
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if not _styled:
+        sns.set(font='Arial', style="whitegrid")
+        sns.set_palette(sunlight)
+        _styled = True
+
+    return plt, sns
 
 def fetch_additional_data(txt_name, multi_word_terms, one_word_terms):
     '''
@@ -93,7 +104,116 @@ def clean_matrix(csv_name, col_names):
 
     return df_clean
 
-def get_final_df(department_file, multi_word_terms, one_word_terms, output_file):
+def read_counts(csv_name, col_names):
+    '''
+    Reads a counts matrix into the smallest integer dtype that holds it.
+
+    Inputs:
+        - csv_name (str): name of the csv file containing the raw matrix
+        - col_names (lst): list of terms
+
+    Outputs:
+        - df (df): counts of the urls whose content was succesfully
+            extracted (no empty row), indexed by id (position in the csv,
+            starting at 1, the same as the id of the Snapshot)
+    '''
+    values = pd.read_csv(csv_name, names=col_names, header=None,
+                         dtype=np.float64).to_numpy()
+    ids = np.arange(1, len(values) + 1)
+    valid = ~np.isnan(values).any(axis=1)
+    values = values[valid]
+    values = values.astype(compact_dtype(values))
+
+    return pd.DataFrame(values, index=pd.Index(ids[valid], name='id'),
+                        columns=col_names)
+
+def read_snapshot_data(txt_name, text=False, data_name=None):
+    '''
+    Gets the word counts, dates and urls (and optionally the visible text and
+    results) of the Snapshot objects in a pickle file, indexed by id. Without
+    text, they are read from the data csv written by get_output if it exists,
+    which is much faster than unpickling the snapshots.
+
+    Inputs:
+        - txt_name (str): name of pickle file
+        - text (bool): whether to also get the visible text and results
+        - data_name (str): name of the data csv file
+
+    Outputs:
+        - data_pre (df): "ttal", "dates" and "url" of the "pre" snapshots
+        - data_post (df): the same for the "post" snapshots
+    '''
+    fields = {'ttal': 'word_count', 'dates': 'date', 'url': 'url'}
+    if not text and data_name and os.path.exists(data_name):
+        data = pd.read_csv(data_name, index_col='id')
+        return [data[[column + '_' + name for column in fields]].rename(
+                columns=lambda column: column.rsplit('_', 1)[0])
+                for name in ['pre', 'post']]
+    with open(txt_name, 'rb') as fp:
+        snapshots = [snapshot for snapshot in pickle.load(fp)
+                     if snapshot is not None]
+    ids = pd.Index([snapshot.id for snapshot in snapshots], name='id')
+    if text:
+        fields.update({'text': 'text', 'results': 'results'})
+    frames = []
+    for name in ['pre', 'post']:
+        objs = [getattr(snapshot, name) for snapshot in snapshots]
+        frames.append(pd.DataFrame({column: [obj[key] for obj in objs]
+                                    for column, key in fields.items()},
+                                   index=ids))
+
+    return frames[0], frames[1]
+
+def load_final_df(department_file, multi_word_terms, one_word_terms,
+                  output_file, text=False):
+    '''
+    Loads the results of get_output into typed dataframes: counts and word
+    totals as compact integers, department as a categorical, all aligned on
+    the id index (no merges).
+
+    Inputs:
+        - department_file (str): path to file with department names and ids,
+            None for no department column
+        - multi_word_terms (lst): multiword list of terms
+        - one_word_terms (lst): list of one word terms
+        - output_file (str): "root name" of the outputs of get_output
+        - text (bool): whether to also load the visible text and results
+            lists, which make loading much slower
+
+    Outputs:
+        - df_pre (df): counts, "id", "ttal", "dates", "url" (and "text",
+            "results") and "department" of every succesful url, pre period
+        - df_post (df): the same for the post period
+        - col_names (lst): list of term names
+    '''
+    col_names = one_word_terms + [' '.join(map(str, term))
+                                  for term in multi_word_terms]
+    data_pre, data_post = read_snapshot_data(
+        'outputs/snapshots_{}.txt'.format(output_file), text,
+        'outputs/{}_data.csv'.format(output_file))
+    departments = None
+    if department_file:
+        departments = pd.read_csv(department_file, index_col='id',
+                                  dtype={'department': 'category'})
+    frames = []
+    for name, data in [('pre', data_pre), ('post', data_post)]:
+        counts = read_counts('outputs/{}_{}.csv'.format(output_file, name),
+                             col_names)
+        ids = counts.index
+        parts = [counts, pd.DataFrame({'id': ids.to_numpy()}, index=ids),
+                 data.reindex(ids)]
+        if departments is not None:
+            parts.append(departments.reindex(ids))
+        df = pd.concat(parts, axis=1)
+        ttal = df['ttal'].to_numpy(dtype=np.float64)
+        if not np.isnan(ttal).any():
+            df['ttal'] = ttal.astype(compact_dtype(ttal))
+        df.index.name = None
+        frames.append(df)
+
+    return frames[0], frames[1], col_names
+
+def get_final_df(department_file, multi_word_terms, one_word_terms, output_file, with_cube=False):
     '''
     Constructs the final dataframe that is used in further analysis.
 
@@ -102,68 +222,61 @@ def get_final_df(department_file, multi_word_terms, one_word_terms, output_file)
         - multi_word_terms (lst): multiword list of terms
         - one_word_terms (lst): list of one word terms
         - output_file (str): path for output file
+        - with_cube (bool): whether to also return the aggregate cube of the
+            dataframes, to be passed to the analysis functions
 
     Outputs:
         - df_pre (df): a pandas pre dataframe with all the collected data
         - df_post (df): a pandas post dataframe with all the collected data
         - col_names (lst): list of names with proper format
+        - cube (AggregateCube): only if with_cube is True
+
+    The dataframes keep a 0-based RangeIndex and an object "department"
+    column, as they always had; load_final_df gives the id indexed,
+    categorical frames.
     '''
-    pickle_file = 'outputs/snapshots_{}.txt'.format(output_file)
-    df_pre_additional, df_post_additional, col_names = fetch_additional_data(
-                                                       pickle_file,
-                                                       multi_word_terms,
-                                                       one_word_terms)
-    #print(len(df_pre_additional), len(df_post_additional))
-    df_pre_clean = clean_matrix('outputs/{}_pre.csv'.format(output_file), col_names)
-    df_post_clean = clean_matrix('outputs/{}_post.csv'.format(output_file), col_names)
-    #print(len(df_pre_clean), len(df_post_clean))
-    # merge additional data to matrix
-    df_pre = df_pre_clean.merge(df_pre_additional, how='left',
-                                       left_on='id', right_on='id')
-    df_post = df_post_clean.merge(df_post_additional, how='left',
-                                        left_on='id', right_on='id')
-    #print(len(df_pre), len(df_post))
-    # merge department data
+    df_pre, df_post, col_names = load_final_df(department_file,
+                                               multi_word_terms,
+                                               one_word_terms, output_file,
+                                               text=True)
+    df_pre, df_post = [df.reset_index(drop=True) for df in [df_pre, df_post]]
     if department_file:
-        df_departments = pd.read_csv(department_file)
-        df_pre = df_pre.merge(df_departments, how='left', left_on='id', right_on='id')
-        df_post = df_post.merge(df_departments, how='left', left_on='id', right_on='id')
+        for df in [df_pre, df_post]:
+            df['department'] = df['department'].astype(object)
+    if with_cube:
+        return df_pre, df_post, col_names, get_cube(df_pre, df_post, col_names)
 
     return df_pre, df_post, col_names
 
-def get_changes(df_pre, df_post, id_col, term_cols, ttal_col, ctrl_terms, department_name=None, pctg=True):
+def get_changes(df_pre, df_post, id_col, term_cols, ttal_col, ctrl_terms, department_name=None, pctg=True, cube=None):
     '''
     Gets changes in total values or as the change in the prevalence (term /
-    total words) of all terms
+    total words) of all terms. Counts are read from cube (see
+    get_cube), which is built from df_pre and df_post if not given.
     '''
-
+    cube = get_cube(df_pre, df_post, term_cols, ttal_col, cube)
     if department_name:
         print(department_name)
-        df_pre = df_pre[df_pre.department == department_name]
-        df_post = df_post[df_post.department == department_name]
+    counts, ttal = cube.slice(department_name, terms=term_cols)
+    counts_pre = pd.Series(counts[:, 0], index=term_cols)
+    counts_post = pd.Series(counts[:, 1], index=term_cols)
+    ctrl = counts_pre.index.isin(ctrl_terms)
 
     if pctg:
         pd.set_option('display.float_format', lambda y: '%.2f' % y)
         # total number of words across all urls
-        ttal_pre = df_pre[ttal_col].sum(axis=0)
-        ttal_post = df_post[ttal_col].sum(axis=0)
+        ttal_pre, ttal_post = ttal
         # total number of times word as percentage of all words (per term)
-        pct_pre = (df_pre[term_cols].sum(axis=0) / ttal_pre)
-        pct_post = (df_post[term_cols].sum(axis=0) / ttal_post)
-
-        grand_ttal_pre = df_pre[term_cols].sum().sum() / ttal_pre
-        grand_ttal_post = df_post[term_cols].sum().sum() / ttal_post
-        ttal_ctrl_pre = 0
-        ttal_ctrl_post = 0
-        for term in ctrl_terms:
-            ttal_ctrl_pre += df_pre[term].sum().sum() / ttal_pre
-            ttal_ctrl_post += df_post[term].sum().sum() / ttal_post
-
-        delta = (((grand_ttal_post - ttal_ctrl_post) / (grand_ttal_pre - ttal_ctrl_pre)) - 1) * 100
+        pct_pre = counts_pre / ttal_pre
+        pct_post = counts_post / ttal_post
+        # total without the control terms
+        grand_ttal_pre = pct_pre[~ctrl].sum()
+        grand_ttal_post = pct_post[~ctrl].sum()
+        delta = ((grand_ttal_post / grand_ttal_pre) - 1) * 100
         print("The relative number of terms changed {} %, from {} to {}, excluding {}".format(
             '%.2f'%(delta),
-            '%.4f'%(grand_ttal_pre - ttal_ctrl_pre),
-            '%.4f'%(grand_ttal_post - ttal_ctrl_post),
+            '%.4f'%(grand_ttal_pre),
+            '%.4f'%(grand_ttal_post),
             ctrl_terms
             ))
         #test_significance(df_pre[term_cols], df_post[term_cols], column, significance, normality)
@@ -175,33 +288,102 @@ def get_changes(df_pre, df_post, id_col, term_cols, ttal_col, ctrl_terms, depart
 
         return changes_df, pct_pre * 100, pct_post * 100
     else:
-        # slice data with term columns and take post - pre difference
-        changes = df_post[term_cols] - df_pre[term_cols]
-        # sum totals by column
-        changes_df = changes.sum(axis=0).sort_values().reset_index().rename(columns={'index': 'term', 0: 'change'})
+        # post - pre difference of the totals by term
+        changes = counts_post - counts_pre
+        changes_df = changes.sort_values().reset_index().rename(columns={'index': 'term', 0: 'change'})
         # filter out zeros
         changes_df = changes_df[changes_df.change != 0]
-        grand_ttal_pre = df_pre[term_cols].sum().sum()
-        grand_ttal_post = df_post[term_cols].sum().sum()
-        ttal_ctrl_pre = 0
-        ttal_ctrl_post = 0
-        for term in ctrl_terms:
-            ttal_ctrl_pre += df_pre[term].sum().sum()
-            ttal_ctrl_post += df_post[term].sum().sum()
-        delta = (((grand_ttal_post - ttal_ctrl_post) / (grand_ttal_pre - ttal_ctrl_pre)) - 1) * 100
+        grand_ttal_pre = counts_pre[~ctrl].sum()
+        grand_ttal_post = counts_post[~ctrl].sum()
+        delta = (((grand_ttal_post) / (grand_ttal_pre)) - 1) * 100
         print("The absolute number of terms changed {} %, from {} to {}, excluding {}".format(
             '%.2f'%(delta),
-            '%.0f'%(grand_ttal_pre - ttal_ctrl_pre),
-            '%.0f'%(grand_ttal_post - ttal_ctrl_post),
+            '%.0f'%(grand_ttal_pre),
+            '%.0f'%(grand_ttal_post),
             ctrl_terms
             ))
 
         return changes_df
 
-def plot_bars(df, x_col, y_col):
+def get_cube(df_pre, df_post, term_cols, ttal_col='ttal', cube=None):
     '''
-    Bar plot function
+    Gets the aggregate cube of the final dataframes: cube itself if given,
+    otherwise a new one built from df_pre and df_post. Build it once with
+    cube.AggregateCube.from_frames and pass it to the analysis functions to
+    avoid re-aggregating the per-url matrices on every call.
+    '''
+    if cube is None:
+        from scripts.cube import AggregateCube
+        cube = AggregateCube.from_frames(df_pre, df_post, term_cols, ttal_col)
+
+    return cube
+
+def department_changes(df_pre, df_post, term_cols, ttal_col, ctrl_terms,
+                       cube=None):
     '''
+    Gets the changes of get_changes (absolute and relative) for every
+    department at once, from the department slices of the aggregate cube and
+    array operations over the department x term matrices.
+
+    Inputs:
+        - df_pre (df): pre dataframe, as returned by get_final_df
+        - df_post (df): post dataframe, as returned by get_final_df
+        - term_cols (lst): list of term columns
+        - ttal_col (str): column with the total number of words
+        - ctrl_terms (lst): control terms, left out of the totals
+        - cube (AggregateCube): cube of df_pre and df_post (see get_cube)
+
+    Outputs:
+        - terms (df): one row per department and term with the counts ("pre",
+            "post"), the absolute "change", the prevalence as percentage of
+            all words ("pct_pre", "pct_post") and the relative change of the
+            prevalence ("rel_change", %)
+        - totals (df): one row per department with the counts of all the
+            terms except the control terms ("pre", "post"), their percentage
+            change ("change"), their prevalence ("pct_pre", "pct_post") and
+            its relative change ("rel_change", %)
+    '''
+    cube = get_cube(df_pre, df_post, term_cols, ttal_col, cube)
+    departments, counts, ttal = cube.aggregate('department', term_cols)
+    if departments and departments[-1] is None: # urls without department
+        departments, counts, ttal = departments[:-1], counts[:-1], ttal[:-1]
+    departments = np.asarray(departments, dtype=object)
+    counts_pre, counts_post = counts[:, :, 0], counts[:, :, 1]
+    ttal_pre, ttal_post = ttal[:, 0], ttal[:, 1]
+    ctrl = np.isin(np.asarray(term_cols, dtype=object), list(ctrl_terms))
+    grand_pre = counts_pre[:, ~ctrl].sum(axis=1)
+    grand_post = counts_post[:, ~ctrl].sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_pre = counts_pre / ttal_pre[:, None] * 100
+        pct_post = counts_post / ttal_post[:, None] * 100
+        grand_pct_pre = grand_pre / ttal_pre * 100
+        grand_pct_post = grand_post / ttal_post * 100
+        terms = pd.DataFrame({
+            'department': np.repeat(departments, len(term_cols)),
+            'term': np.tile(np.asarray(term_cols, dtype=object), len(departments)),
+            'pre': counts_pre.ravel(),
+            'post': counts_post.ravel(),
+            'change': (counts_post - counts_pre).ravel(),
+            'pct_pre': pct_pre.ravel(),
+            'pct_post': pct_post.ravel(),
+            'rel_change': ((pct_post / pct_pre - 1) * 100).ravel()})
+        totals = pd.DataFrame({
+            'department': departments,
+            'pre': grand_pre,
+            'post': grand_post,
+            'change': (grand_post / grand_pre - 1) * 100,
+            'pct_pre': grand_pct_pre,
+            'pct_post': grand_pct_post,
+            'rel_change': (grand_pct_post / grand_pct_pre - 1) * 100})
+
+    return terms, totals
+
+def plot_bars(df, x_col, y_col, save_name=None):
+    '''
+    Bar plot function, the figure is saved to save_name if given
+    '''
+    plt, sns = _pyplot()
     sns_plot = sns.catplot(x=x_col, y=y_col, data=df,
                 kind='bar', legend=False,
                 height=5, aspect=6/5,
@@ -209,11 +391,42 @@ def plot_bars(df, x_col, y_col):
                 #palette=sns.light_palette(c('blue'), n_colors=50)
     sns_plot.set_xticklabels(rotation=90, fontsize=9)
     sns_plot.ax.set(xlabel='Term', ylabel='Change')
+    if save_name:
+        sns_plot.savefig(save_name)
+
+def plot_changes_dept(df_pre_merged, df_post_merged, col_names, ctrl_terms, department_list, cube=None, save_name=None):
+    '''
+    Plot changes by department. The figure is saved to save_name if given,
+    shown otherwise. Returns the changes of each department (see
+    draw_changes_dept).
+    '''
+    terms, totals = department_changes(df_pre_merged, df_post_merged,
+                                       col_names, 'ttal', ctrl_terms, cube)
+    terms = terms[terms.change != 0].sort_values('change', kind='mergesort')
+    totals = totals.set_index('department')
+    changes = {}
+    for department_name in department_list:
+        print(department_name)
+        total = totals.loc[department_name]
+        print("The absolute number of terms changed {} %, from {} to {}, excluding {}".format(
+            '%.2f'%(total.change), '%.0f'%(total.pre), '%.0f'%(total.post),
+            ctrl_terms))
+        changes[department_name] = terms[terms.department == department_name][['term', 'change']]
+    draw_changes_dept(changes, department_list, save_name)
+
+    return changes
 
-def plot_changes_dept(df_pre_merged, df_post_merged, col_names, ctrl_terms, department_list):
+def draw_changes_dept(changes, department_list, save_name=None):
     '''
-    Plot changes by department
+    Draws the bar plots of plot_changes_dept.
+
+    Inputs:
+        - changes (dict): department name -> dataframe with "term" and
+            "change" columns
+        - department_list (lst): departments to plot, in order
+        - save_name (str): path of the image file, the figure is shown if None
     '''
+    plt, sns = _pyplot()
     n_cols = 2
     n_rows = math.ceil(len(department_list) / n_cols)
     #print('number of rows', n_rows)
@@ -223,9 +436,7 @@ def plot_changes_dept(df_pre_merged, df_post_merged, col_names, ctrl_terms, depa
         fig, axs = plt.subplots(n_rows, n_cols, figsize=(7.5, 9.5))
 
     for i, department_name in enumerate(department_list):
-        df = get_changes(df_pre_merged, df_post_merged, 'id',
-             col_names, 'ttal', ctrl_terms, department_name, pctg=False)
-        #df.to_csv('images/fig5_{}.csv'.format(re.sub(r"[^a-zA-Z0-9]+", '', department_name)))
+        df = changes[department_name]
         plt.subplot(n_rows, n_cols, i + 1)
         plt.xlabel("Terms", fontsize=9, fontfamily='Arial')
         plt.ylabel("Change", fontsize=9, fontfamily='Arial')
@@ -239,45 +450,35 @@ def plot_changes_dept(df_pre_merged, df_post_merged, col_names, ctrl_terms, depa
     if len(department_list) % 2 != 0:
         plt.delaxes(axs[n_cols - 1, n_rows - 1])
     plt.tight_layout()
-    plt.show()
-
-    #plt.savefig(save_name)
-    '''
-    for department_name in department_list:
-        try:
-            #rel_changes = a.get_changes(df_pre_merged, df_post_merged, 'id', col_names, 'ttal', department_name, pctg=True)
-            abs_changes = get_changes(df_pre_merged, df_post_merged, 'id', col_names, 'ttal', department_name, pctg=False)
-            plot_bars(abs_changes, 'term', 'change', department_name)
-        except:
-            pass
-    '''
+    if save_name:
+        plt.savefig(save_name)
+    else:
+        plt.show()
 
-def plot_dpt_changes(df_pre, df_post, cols, control_terms, exclude=None):
+def plot_dpt_changes(df_pre, df_post, cols, control_terms, exclude=None, cube=None, save_name=None):
     '''
-    Plots discontinuous lollipop graph
+    Plots discontinuous lollipop graph, saved to save_name if given
     Reference: https://python-graph-gallery.com/184-lollipop-plot-with-2-groups/
     '''
-    # handle data
-    col_names = cols[:]
-    for c_term in control_terms:
-        col_names.remove(c_term)
-    df_dpt_pre = df_pre.groupby(['department']).sum(axis=0)[col_names] # sum columns by department
-    df_dpt_pre = df_dpt_pre.sum(axis=1).reset_index() # sum totals
-    df_dpt_pre.columns = ['department', 'counts']
-    # dpt_ttal_pre = df_dpt_pre.sum()
-    df_dpt_post = df_post.groupby(['department']).sum(axis=0)[col_names] # sum columns by department
-    df_dpt_post = df_dpt_post.sum(axis=1).reset_index() # sum totals
-    df_dpt_post.columns = ['department', 'counts']
-
-    df = pd.DataFrame({'department': df_dpt_pre.department,
-                   'pre': df_dpt_pre.counts,
-                   'post': df_dpt_post.counts})
-
-    df['change'] = ((df.post / df.pre) - 1) * 100
+    # handle data: totals by department, without the control terms
+    _, df = department_changes(df_pre, df_post, cols, 'ttal', control_terms,
+                               cube)
 
     if exclude:
         df = df[df.department != exclude]
-    ordered_df = df.sort_values(by='pre')
+    ordered_df = df.sort_values(by='pre')[['department', 'pre', 'post', 'change']]
+    draw_dpt_changes(ordered_df, save_name)
+
+    return ordered_df #.sort_values(by='change').set_index('department').rename_axis(None)
+
+def draw_dpt_changes(ordered_df, save_name=None):
+    '''
+    Draws the lollipop graph of plot_dpt_changes from the "department",
+    "pre", "post" and "change" columns of ordered_df
+    '''
+    import matplotlib.ticker as ticker
+    plt, sns = _pyplot()
+    df = ordered_df
     # now plot it
     # left part of the plot
     my_range = range(1, len(df.index) + 1)
@@ -335,31 +536,43 @@ def plot_dpt_changes(df_pre, df_post, cols, control_terms, exclude=None):
     plt.yticks(my_range, ordered_df['department'])
     f.text(0.5, 0.04, 'Total term count', ha='center', va='center', fontsize=11)
     f.set_size_inches(6, 5)
-    #plt.savefig(save_name)
-    return ordered_df #.sort_values(by='change').set_index('department').rename_axis(None)
+    if save_name:
+        f.savefig(save_name)
 
-def plot_boxplot(df_pre, df_post):
+def plot_boxplot(df_pre, df_post, save_name=None):
     '''
-    Plot boxplot
+    Plot boxplot, saved to save_name if given
     '''
     df_boxplot = df_pre
     df_boxplot['time'] = 'pre'
     df_post['time'] = 'post'
-    df_boxplot = df_boxplot.append(df_post, ignore_index=True)
+    df_boxplot = pd.concat([df_boxplot, df_post], ignore_index=True)
+    draw_boxplot(df_boxplot, save_name)
+
+    return df_boxplot
+
+def draw_boxplot(df_boxplot, save_name=None):
+    '''
+    Draws the boxplot of plot_boxplot from the "department", "subjectivity"
+    and "time" columns of df_boxplot
+    '''
+    plt, sns = _pyplot()
     f, ax = plt.subplots()
     sns.boxplot(x="department", y="subjectivity", hue="time",
                   data=df_boxplot, ax=ax)
     ax.set_xticklabels(ax.get_xticklabels(), rotation=90, fontsize=9)
     ax.set(xlabel='Department', ylabel='Subjectivity')
     f.set_size_inches(6, 5)
-
-    return df_boxplot
+    if save_name:
+        f.savefig(save_name)
 
 def plot_normal(df_pre, df_post, column):
     '''
     Plot distribution
     Reference: https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.shapiro.html
     '''
+    from scipy import stats
+    plt, sns = _pyplot()
     df_pre = df_pre[[column, 'id']]
     df_post = df_post[[column, 'id']]
     df = df_pre.merge(df_post, how='left', left_on='id', right_on='id')
@@ -392,8 +605,9 @@ def test_significance(df_pre, df_post, column, significance, normality):
     Wilcoxon signed-rank Test
     Reference: https://docs.scipy.org/doc/scipy-0.14.0/reference/generated/scipy.stats.wilcoxon.html
     '''
+    from scipy import stats
     if normality:
-        statistic, p_value = stats.ttes_rel(df_pre[column], df_post[column])
+        statistic, p_value = stats.ttest_rel(df_pre[column], df_post[column])
     else:
         statistic, p_value = stats.wilcoxon(df_pre[column], df_post[column])
     #print('The p-value is: ', p_value)
@@ -404,12 +618,188 @@ def test_significance(df_pre, df_post, column, significance, normality):
         print('The change in {} is not statistically significant at the {} %'.format(
               column, significance))
 
+def adjust_p_values(p_values, method='fdr_bh'):
+    '''
+    Corrects p-values for multiple comparisons. NaN p-values (tests that
+    could not be run) are left out of the correction.
+
+    Inputs:
+        - p_values (array): p-values of every test
+        - method (str): 'bonferroni', 'holm', 'fdr_bh' (Benjamini-Hochberg)
+            or None for no correction
+
+    Outputs:
+        - adjusted (array): adjusted p-values, in the order of p_values
+    '''
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = p_values.copy()
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    m = len(p)
+    if method is None or m == 0:
+        return adjusted
+    order = np.argsort(p)
+    ranked = p[order]
+    if method == 'bonferroni':
+        corrected = ranked * m
+    elif method == 'holm':
+        corrected = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    elif method == 'fdr_bh':
+        corrected = ranked * m / np.arange(1, m + 1)
+        corrected = np.minimum.accumulate(corrected[::-1])[::-1]
+    else:
+        raise ValueError('Unknown correction method: {}'.format(method))
+    result = np.empty(m)
+    result[order] = np.minimum(corrected, 1)
+    adjusted[valid] = result
+
+    return adjusted
+
+def paired_resampling_tests(diffs, n_resamples=10000, seed=0,
+                            chunk_bytes=64 * 2 ** 20):
+    '''
+    Paired permutation (random sign flips) and bootstrap tests of the mean
+    post - pre difference of every column at once. The resamples are drawn
+    as matrices and applied to all columns with one matrix product per chunk.
+
+    Inputs:
+        - diffs (array): urls x terms matrix of post - pre differences
+        - n_resamples (int): number of permutations and of bootstrap samples
+        - seed (int): seed of the random number generators
+        - chunk_bytes (int): memory budget of the resamples x urls matrices
+            of a chunk, the number of resamples drawn at a time shrinks as
+            the number of urls grows. The results do not depend on it.
+
+    Outputs:
+        - permutation_p (array): two-sided permutation p-value per column
+        - bootstrap_low (array): 2.5 percentile of the bootstrap mean
+        - bootstrap_high (array): 97.5 percentile of the bootstrap mean
+        - bootstrap_p (array): two-sided bootstrap p-value per column
+    '''
+    # separate streams, so that the draws are the same for any chunk size
+    sign_rng = np.random.RandomState(seed)
+    boot_rng = np.random.RandomState(seed + 1)
+    diffs = np.asarray(diffs, dtype=float)
+    n, n_terms = diffs.shape
+    observed = np.abs(diffs.mean(axis=0))
+    extreme = np.zeros(n_terms)
+    boot_means = np.empty((n_resamples, n_terms))
+    # signs, draws, their offsets and the weights (int and float), 8 bytes each
+    chunk_size = max(1, chunk_bytes // (5 * 8 * n))
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        signs = sign_rng.randint(0, 2, size=(size, n)) * 2.0 - 1
+        permuted = np.abs(signs @ diffs / n)
+        extreme += (permuted >= observed - 1e-12).sum(axis=0)
+        # number of times each url is drawn in each bootstrap sample
+        draws = boot_rng.randint(0, n, size=(size, n)) + n * np.arange(size)[:, None]
+        weights = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n)
+        boot_means[start:start + size] = weights.astype(float) @ diffs / n
+    permutation_p = (extreme + 1) / (n_resamples + 1)
+    bootstrap_low, bootstrap_high = np.percentile(boot_means, [2.5, 97.5], axis=0)
+    below = (boot_means <= 0).mean(axis=0)
+    above = (boot_means >= 0).mean(axis=0)
+    bootstrap_p = np.minimum(2 * np.minimum(below, above), 1)
+
+    return permutation_p, bootstrap_low, bootstrap_high, bootstrap_p
+
+def test_significance_batch(df_pre, df_post, columns, significance=5,
+                            by='department', n_resamples=10000,
+                            correction='fdr_bh', seed=0):
+    '''
+    Tests the significance of the change of every column pre and post, for
+    all urls and for every department, in one call. Urls are paired by id.
+    For each test: Shapiro-Wilk normality of the differences, paired t test,
+    Wilcoxon signed-rank test, paired permutation test and bootstrap of the
+    mean difference. As in test_significance, the t test is used when the
+    differences are normal and the Wilcoxon test otherwise; its p-values are
+    corrected for multiple comparisons over the whole table.
+
+    Inputs:
+        - df_pre (df): pre dataframe, as returned by get_final_df
+        - df_post (df): post dataframe, as returned by get_final_df
+        - columns (lst): columns to test (terms, ttal, sentiment scores...)
+        - significance (int): significance level in % (1, 5, 10)
+        - by (str): column to group the urls by, None for all urls only
+        - n_resamples (int): number of permutations and bootstrap samples
+        - correction (str): multiple comparison correction (see
+            adjust_p_values)
+        - seed (int): seed of the permutations and bootstrap samples
+
+    Outputs:
+        - results (df): one row per group ('all' for every url) and column
+            with "n", "mean_pre", "mean_post", "mean_diff", "shapiro_p",
+            "normal", "t_statistic", "t_p", "wilcoxon_statistic",
+            "wilcoxon_p", "permutation_p", "bootstrap_low", "bootstrap_high",
+            "bootstrap_p", "test", "p_value", "p_adjusted" and "significant"
+    '''
+    from scipy import stats
+    columns = list(columns)
+    keys = ['id'] if by is None else ['id', by]
+    pre = df_pre[keys + columns]
+    post = df_post[['id'] + columns]
+    paired = pre.merge(post, on='id', suffixes=('_pre', '_post')).dropna(
+             subset=[column + suffix for column in columns
+                     for suffix in ['_pre', '_post']])
+    matrix_pre = paired[[column + '_pre' for column in columns]].to_numpy(dtype=float)
+    matrix_post = paired[[column + '_post' for column in columns]].to_numpy(dtype=float)
+    groups = [('all', np.ones(len(paired), dtype=bool))]
+    if by is not None:
+        groups += [(name, (paired[by] == name).to_numpy())
+                   for name in sorted(paired[by].dropna().unique())]
+
+    tables = []
+    for name, mask in groups:
+        x, y = matrix_pre[mask], matrix_post[mask]
+        diffs = y - x
+        n = len(diffs)
+        table = pd.DataFrame({'group': name, 'column': columns, 'n': n,
+                              'mean_pre': x.mean(axis=0) if n else np.nan,
+                              'mean_post': y.mean(axis=0) if n else np.nan})
+        table['mean_diff'] = table.mean_post - table.mean_pre
+        shapiro_p = np.full(len(columns), np.nan)
+        wilcoxon = np.full((len(columns), 2), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_statistic, t_p = stats.ttest_rel(x, y, axis=0) if n > 1 else (np.nan, np.nan)
+        for j in range(len(columns)):
+            if n >= 3 and np.ptp(diffs[:, j]) > 0:
+                shapiro_p[j] = stats.shapiro(diffs[:, j])[1]
+            if np.any(diffs[:, j] != 0):
+                try:
+                    wilcoxon[j] = stats.wilcoxon(x[:, j], y[:, j])
+                except ValueError:
+                    pass
+        table['shapiro_p'] = shapiro_p
+        table['normal'] = shapiro_p > significance / 100
+        table['t_statistic'] = t_statistic
+        table['t_p'] = t_p
+        table['wilcoxon_statistic'] = wilcoxon[:, 0]
+        table['wilcoxon_p'] = wilcoxon[:, 1]
+        if n > 0 and n_resamples:
+            (table['permutation_p'], table['bootstrap_low'],
+             table['bootstrap_high'], table['bootstrap_p']) = \
+                paired_resampling_tests(diffs, n_resamples, seed)
+        else:
+            for column in ['permutation_p', 'bootstrap_low', 'bootstrap_high',
+                           'bootstrap_p']:
+                table[column] = np.nan
+        tables.append(table)
+
+    results = pd.concat(tables, ignore_index=True)
+    results['test'] = np.where(results.normal, 'ttest_rel', 'wilcoxon')
+    results['p_value'] = np.where(results.normal, results.t_p, results.wilcoxon_p)
+    results['p_adjusted'] = adjust_p_values(results.p_value, correction)
+    results['significant'] = results.p_adjusted <= significance / 100
+
+    return results
+
 
 def display_side_by_side(*args):
     '''
     Display two pandas dataframes side by side
     Attribution: https://stackoverflow.com/questions/38783027/jupyter-notebook-display-two-pandas-tables-side-by-side
     '''
+    from IPython.display import display_html
     html_str=''
     for df in args:
         html_str+=df.to_html()
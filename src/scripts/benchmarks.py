@@ -0,0 +1,950 @@
+'''
+Benchmark script
+
+Run from the src folder, e.g.:
+    python -m scripts.benchmarks tokenizer outputs/snapshots_counts_final.txt
+    python -m scripts.benchmarks imports
+    python -m scripts.benchmarks pipeline --urls 200 --latency 0.01
+    python -m scripts.benchmarks suite --sizes 100 1000 --output bench.json
+    python -m scripts.benchmarks departments --departments 300 --terms 2000
+    python -m scripts.benchmarks significance --resamples 10000
+    python -m scripts.benchmarks loader --pages 100000
+    python -m scripts.benchmarks windows --urls 50 --year-from 2016
+    python -m scripts.benchmarks trajectories --urls 50 --captures 40
+    python -m scripts.benchmarks sections --pages 100 --versions 20
+    python -m scripts.benchmarks shards --urls 60 --shards 3
+    python -m scripts.benchmarks jobs --urls 60 --workers 4
+
+Benchmarks only time the pipeline, its correctness is checked by the tests
+(python -m pytest tests).
+'''
+from contextlib import redirect_stdout
+from scripts.synthetic import (TERMS, DATES_PRE, DATES_POST, synthetic_page,
+                               synthetic_corpus, window_corpus,
+                               history_corpus, section_versions,
+                               department_frames, result_files)
+from scripts import tokenizer
+import subprocess
+import argparse
+import tracemalloc
+import tempfile
+import random
+import pickle
+import json
+import time
+import sys
+import os
+
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# maximum import time (seconds) of the modules used by worker processes
+IMPORT_BUDGETS = {'scripts.tokenizer': 0.2,
+                  'scripts.counting': 0.5,
+                  'scripts.sentiment_analysis': 0.5,
+                  'scripts.get_content': 1.0,
+                  'scripts.analysis': 1.5}
+# dependencies that should only be loaded by the features that need them
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'scipy', 'IPython', 'selenium',
+                 'savepagenow', 'bs4', 'pysentiment', 'nltk', 'lxml', 'tqdm']
+
+IMPORT_CODE = '''
+import time, sys, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps([elapsed, heavy]))
+'''
+
+def load_texts(txt_name):
+    '''
+    Gets the stored "pre" and "post" visible texts from a pickle file with
+    Snapshot objects
+    '''
+    with open(txt_name, 'rb') as fp:
+        snapshots = pickle.load(fp)
+    texts = [snapshot.pre['text'] for snapshot in snapshots]
+    texts += [snapshot.post['text'] for snapshot in snapshots]
+
+    return [text for text in texts if text is not None]
+
+def tokenizer_throughput(texts, repeat=3):
+    '''
+    Measures the throughput of every tokenizer on a corpus.
+
+    Inputs:
+        - texts (lst): list of visible texts (list of strings)
+        - repeat (int): number of runs, the best one is reported
+
+    Outputs:
+        - results (dict): tokenizer name -> dict with "seconds", "pages_per_s"
+            and "tokens_per_s"
+    '''
+    results = {}
+    for name, tokenize in tokenizer.TOKENIZERS.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            n_tokens = 0
+            for visible_text in texts:
+                for section in visible_text:
+                    n_tokens += len(tokenize(section))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {'seconds': best,
+                         'pages_per_s': len(texts) / best if best else None,
+                         'tokens_per_s': n_tokens / best if best else None}
+
+    return results
+
+def import_time(module, repeat=5):
+    '''
+    Measures the time it takes to import a module in a fresh interpreter, as
+    a worker process would.
+
+    Inputs:
+        - module (str): name of the module, e.g. 'scripts.counting'
+        - repeat (int): number of fresh interpreters, the best time is kept
+
+    Outputs:
+        - seconds (float): best import time
+        - heavy (lst): heavy dependencies loaded by the import
+    '''
+    best = None
+    heavy = []
+    code = IMPORT_CODE.format(module=module, heavy=HEAVY_MODULES)
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=SRC_PATH,
+                             check=True, stdout=subprocess.PIPE).stdout
+        elapsed, heavy = json.loads(out.decode().strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, heavy
+
+def check_imports(budgets=IMPORT_BUDGETS, repeat=5):
+    '''
+    Checks that every module imports within its budget and without loading
+    heavy dependencies.
+
+    Outputs:
+        - ok (bool): True if all modules are within budget
+        - results (dict): module -> dict with "seconds", "budget" and "heavy"
+    '''
+    ok = True
+    results = {}
+    for module, budget in budgets.items():
+        seconds, heavy = import_time(module, repeat)
+        results[module] = {'seconds': seconds, 'budget': budget,
+                           'heavy': heavy}
+        if seconds > budget or heavy:
+            ok = False
+
+    return ok, results
+
+################################################################################
+# Pipeline against the local fake archive ######################################
+################################################################################
+
+def pipeline_benchmark(n_urls=100, cdx_error_rate=0, memento_error_rate=0,
+                       latency=0, page_size=None, seed=0, method=None,
+                       bulk_cdx=False):
+    '''
+    Runs get_output against the local fake archive (without captures) and
+    measures throughput.
+    method selects the tokenizer ('nltk' or 'regex'), by default the current
+    default tokenizer is used. bulk_cdx is passed on to get_output.
+
+    Outputs:
+        - result (dict): "urls", "seconds", "urls_per_s" and the request
+            counters of the fake archive
+    '''
+    from scripts.fake_archive import FakeArchive
+    from scripts import get_content
+    from scripts import internetarchive
+    urls, corpus = synthetic_corpus(n_urls, seed)
+    default_method = tokenizer.get_default()
+    tokenizer.set_default(method or default_method)
+    cwd = os.getcwd()
+    env = os.environ.get(internetarchive.ARCHIVE_ROOT_ENV)
+    with tempfile.TemporaryDirectory() as work, \
+         FakeArchive(corpus, cdx_error_rate=cdx_error_rate,
+                     memento_error_rate=memento_error_rate, latency=latency,
+                     page_size=page_size, seed=seed) as archive:
+        os.makedirs(os.path.join(work, 'outputs'))
+        with open(os.path.join(work, 'input.csv'), 'w') as f:
+            f.write(''.join(url + '\n' for url in urls))
+        os.environ[internetarchive.ARCHIVE_ROOT_ENV] = archive.url
+        os.chdir(work)
+        try:
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                get_content.get_output('input.csv', 'bench', TERMS,
+                                       DATES_PRE, DATES_POST,
+                                       bulk_cdx=bulk_cdx)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+            tokenizer.set_default(default_method)
+            if env is None:
+                del os.environ[internetarchive.ARCHIVE_ROOT_ENV]
+            else:
+                os.environ[internetarchive.ARCHIVE_ROOT_ENV] = env
+        stats = dict(archive.stats)
+
+    return dict({'urls': n_urls, 'seconds': elapsed,
+                 'urls_per_s': n_urls / elapsed}, **stats)
+
+################################################################################
+# Stages on a synthetic corpus #################################################
+################################################################################
+
+STAGES = ['cdx', 'visible_text', 'term_counter', 'sentiment', 'final_df']
+SUITE_SIZES = [100, 1000, 10000, 100000]
+
+def measure(stage, n_items, function, memory=True):
+    '''
+    Times a stage, then runs it again under tracemalloc to get its peak memory
+    (tracing slows the code down, so both are measured separately).
+
+    Inputs:
+        - stage (str): name of the stage
+        - n_items (int): number of pages (or CDX records) processed
+        - function (function): runs the stage, without arguments
+        - memory (bool): whether to measure peak memory
+
+    Outputs:
+        - output: the return value of function
+        - result (dict): "stage", "items", "seconds", "items_per_s" and
+            "peak_bytes" (None if memory is False)
+    '''
+    start = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return output, {'stage': stage, 'items': n_items, 'seconds': elapsed,
+                    'items_per_s': n_items / elapsed if elapsed else None,
+                    'peak_bytes': peak}
+
+def _cdx_stage(n_pages):
+    '''
+    Lists n_pages CDX records of a prefix search against the local fake
+    archive, so that the time is spent in parsing the response.
+    '''
+    from scripts.fake_archive import FakeArchive
+    from scripts import internetarchive
+    corpus = [{'url': 'https://www.hhs.gov/programs/page-{}/'.format(i),
+               'timestamp': '2017{:02d}01120000'.format(i % 12 + 1)}
+              for i in range(n_pages)]
+    archive = FakeArchive(corpus).start()
+
+    def run():
+        with internetarchive.WaybackClient(archive_root=archive.url) as client:
+            return sum(1 for _ in client.search('hhs.gov/programs/',
+                                                matchType='prefix'))
+    try:
+        yield run
+    finally:
+        archive.stop()
+
+def _final_df_files(texts, terms, counts, ttal):
+    '''
+    Writes the pickle file, count matrices and department file that
+    analysis.get_final_df reads, in the current directory.
+    '''
+    from scripts.get_content import Snapshot, save_csv
+    snapshots = []
+    matrix = []
+    for i, visible_text in enumerate(texts):
+        snapshot = Snapshot(i + 1, 'https://www.hhs.gov/page-{}/'.format(i),
+                            'https://web.archive.org/web/20160601120000id_/'
+                            'https://www.hhs.gov/page-{}/'.format(i),
+                            terms, True)
+        for name in ['pre', 'post']:
+            obj = getattr(snapshot, name)
+            obj['text'] = visible_text
+            obj['results'] = counts[i]
+            obj['word_count'] = ttal[i]
+            obj['date'] = '2016-06-01 12:00:00'
+        snapshot.status = 'succesful'
+        snapshots.append(snapshot)
+        matrix.append(counts[i])
+    with open('outputs/snapshots_bench.txt', 'wb') as fp:
+        pickle.dump(snapshots, fp)
+    save_csv(matrix, 'bench', '_pre')
+    save_csv(matrix, 'bench', '_post')
+    with open('departments.csv', 'w') as f:
+        f.write('id,department\n')
+        f.write(''.join('{},dept-{}\n'.format(i + 1, i % 15)
+                        for i in range(len(texts))))
+
+def stage_benchmark(n_pages, stages=STAGES, seed=0, memory=True, method=None):
+    '''
+    Measures every stage of the pipeline separately on a synthetic corpus of
+    federal-style pages.
+
+    Inputs:
+        - n_pages (int): number of pages in the corpus
+        - stages (lst): stages to run, a subset of STAGES. visible_text always
+            runs, the other stages use its output
+        - seed (int): seed of the synthetic corpus
+        - memory (bool): whether to measure peak memory of each stage
+        - method (str): tokenizer used by term_counter ('nltk' or 'regex'),
+            defaults to the current default tokenizer
+
+    Outputs:
+        - results (lst): list of dicts as returned by measure, plus "pages"
+    '''
+    from scripts import get_content
+    rng = random.Random(seed)
+    pages = [synthetic_page(rng) for _ in range(n_pages)]
+    results = []
+    if 'cdx' in stages:
+        for run in _cdx_stage(n_pages):
+            _, result = measure('cdx', n_pages, run, memory)
+            results.append(result)
+
+    # imports and lexicon loading are not part of the timings
+    get_content.extract_visible_txt(synthetic_page(random.Random(seed)))
+    texts, result = measure('visible_text', n_pages, lambda: [
+        get_content.extract_visible_txt(page) for page in pages], memory)
+    results.append(result)
+    del pages
+
+    default_method = tokenizer.get_default()
+    tokenizer.set_default(method or default_method)
+    try:
+        if 'term_counter' in stages or 'final_df' in stages:
+            get_content.term_counter(TERMS[0], ['warm up'])
+            def count():
+                counts = []
+                ttal = []
+                for visible_text in texts:
+                    row = []
+                    for term in TERMS:
+                        tally, total = get_content.term_counter(term, visible_text)
+                        row.append(tally)
+                    counts.append(row)
+                    ttal.append(total)
+                return counts, ttal
+            (counts, ttal), result = measure('term_counter', n_pages, count,
+                                             memory and 'term_counter' in stages)
+            if 'term_counter' in stages:
+                results.append(result)
+    finally:
+        tokenizer.set_default(default_method)
+
+    if 'sentiment' in stages:
+        from scripts import sentiment_analysis
+        sentiment_analysis.score_batch([['warm up']], processes=1)
+        _, result = measure('sentiment', n_pages, lambda: sentiment_analysis.score_batch(
+            texts, processes=1), memory)
+        results.append(result)
+
+    if 'final_df' in stages:
+        from scripts import analysis
+        one_word = [t for t in TERMS if not isinstance(t, list)]
+        multi_word = [t for t in TERMS if isinstance(t, list)]
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as work:
+            os.chdir(work)
+            try:
+                os.makedirs('outputs')
+                _final_df_files(texts, TERMS, counts, ttal)
+                _, result = measure('final_df', n_pages, lambda: analysis.get_final_df(
+                    'departments.csv', multi_word, one_word, 'bench'), memory)
+                results.append(result)
+            finally:
+                os.chdir(cwd)
+
+    for result in results:
+        result['pages'] = n_pages
+
+    return results
+
+def find_regressions(results, baseline, tolerance=0.2):
+    '''
+    Compares suite results against a previous run.
+
+    Inputs:
+        - results (lst): list of dicts as returned by stage_benchmark
+        - baseline (lst): the same list from an earlier run
+        - tolerance (float): allowed relative drop in throughput (or growth in
+            peak memory)
+
+    Outputs:
+        - regressions (lst): list of strings describing each regression
+    '''
+    previous = {(r['pages'], r['stage']): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['pages'], result['stage']))
+        if before is None:
+            continue
+        if before['items_per_s'] and result['items_per_s'] < \
+           before['items_per_s'] * (1 - tolerance):
+            regressions.append('{} at {} pages: {:.0f} items/s, was {:.0f}'.format(
+                result['stage'], result['pages'], result['items_per_s'],
+                before['items_per_s']))
+        if before['peak_bytes'] and result['peak_bytes'] and \
+           result['peak_bytes'] > before['peak_bytes'] * (1 + tolerance):
+            regressions.append('{} at {} pages: peak {} bytes, was {}'.format(
+                result['stage'], result['pages'], result['peak_bytes'],
+                before['peak_bytes']))
+
+    return regressions
+
+def _mask_changes(df_pre, df_post, term_cols, department):
+    '''
+    Absolute change of every term of a department with boolean masks over
+    the per-url frames, the way the analysis used to compute it
+    '''
+    pre = df_pre[df_pre.department == department][term_cols].sum(axis=0)
+    post = df_post[df_post.department == department][term_cols].sum(axis=0)
+    changes = post - pre
+
+    return dict(changes[changes != 0])
+
+def department_benchmark(n_pages=5000, n_departments=20, n_terms=200,
+                         n_ctrl=2, seed=0, loop=True):
+    '''
+    Times building the aggregate cube, analysis.department_changes on it,
+    and replacing every url of the cube one at a time. With loop=True also
+    times the per-department boolean mask sums it replaces.
+
+    Outputs:
+        - result (dict): "departments", "terms", "pages", "cube_seconds",
+            "seconds", "update_seconds" and "loop_seconds" (None without loop)
+    '''
+    from scripts.cube import AggregateCube
+    from scripts import analysis
+    df_pre, df_post, term_cols = department_frames(n_pages, n_departments,
+                                                   n_terms, seed)
+    ctrl_terms = term_cols[:n_ctrl]
+    start = time.perf_counter()
+    cube = AggregateCube.from_frames(df_pre, df_post, term_cols)
+    cube_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    terms, totals = analysis.department_changes(df_pre, df_post, term_cols,
+                                                'ttal', ctrl_terms, cube)
+    elapsed = time.perf_counter() - start
+    # new counts arrive for every url: the post counts of pre
+    new_counts = df_pre[term_cols].to_numpy()
+    start = time.perf_counter()
+    for id, row, ttal, department in zip(df_pre['id'], new_counts,
+                                         df_pre['ttal'], df_pre['department']):
+        cube.add(id, 'post', row, ttal, department)
+    update_seconds = time.perf_counter() - start
+    result = {'departments': n_departments, 'terms': n_terms,
+              'pages': n_pages, 'cube_seconds': cube_seconds,
+              'seconds': elapsed, 'update_seconds': update_seconds,
+              'loop_seconds': None}
+    if loop:
+        start = time.perf_counter()
+        for department in totals.department:
+            _mask_changes(df_pre, df_post, term_cols, department)
+        result['loop_seconds'] = time.perf_counter() - start
+
+    return result
+
+def significance_benchmark(n_pages=2000, n_departments=5, n_terms=50,
+                           n_resamples=10000, seed=0):
+    '''
+    Times analysis.test_significance_batch on synthetic frames where the post
+    counts of one term in ten are raised, and counts how many of those terms
+    (and of the unchanged ones) come out significant for all urls.
+
+    Outputs:
+        - result (dict): "tests", "resamples", "seconds", "detected" (changed
+            terms found significant, of "changed") and "false_positives"
+    '''
+    from scripts import analysis
+    import numpy as np
+    df_pre, df_post, term_cols = department_frames(n_pages, n_departments,
+                                                   n_terms, seed)
+    changed = term_cols[::10]
+    rng = np.random.RandomState(seed)
+    for term in changed:
+        df_post[term] += rng.poisson(0.1, n_pages)
+    start = time.perf_counter()
+    results = analysis.test_significance_batch(df_pre, df_post, term_cols,
+                                               n_resamples=n_resamples,
+                                               seed=seed)
+    elapsed = time.perf_counter() - start
+    overall = results[results.group == 'all'].set_index('column')
+
+    return {'tests': len(results), 'resamples': n_resamples,
+            'seconds': elapsed, 'changed': len(changed),
+            'detected': int(overall.significant[changed].sum()),
+            'false_positives': int(overall.significant.drop(changed).sum())}
+
+def loader_benchmark(n_pages=100000, seed=0):
+    '''
+    Times analysis.load_final_df against the merges of the earlier loader
+    (fetch_additional_data, clean_matrix and four merges) on a result set
+    without visible text.
+
+    Outputs:
+        - result (dict): "pages", "seconds", "merge_seconds", "bytes" and
+            "merge_bytes" (memory of the two dataframes)
+    '''
+    from scripts import analysis
+    import pandas as pd
+    one_word = [t for t in TERMS if not isinstance(t, list)]
+    multi_word = [t for t in TERMS if isinstance(t, list)]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work:
+        os.chdir(work)
+        try:
+            os.makedirs('outputs')
+            result_files(n_pages, one_word + multi_word, seed=seed)
+            start = time.perf_counter()
+            df_pre, df_post, col_names = analysis.load_final_df(
+                'departments.csv', multi_word, one_word, 'bench')
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            merged = []
+            data = analysis.fetch_additional_data('outputs/snapshots_bench.txt',
+                                                  multi_word, one_word)
+            departments = pd.read_csv('departments.csv')
+            for name, additional in zip(['pre', 'post'], data[:2]):
+                df = analysis.clean_matrix('outputs/bench_{}.csv'.format(name),
+                                           col_names)
+                df = df.merge(additional, how='left', left_on='id', right_on='id')
+                merged.append(df.merge(departments, how='left', left_on='id',
+                                       right_on='id'))
+            merge_seconds = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    size = lambda frames: int(sum(df.memory_usage(deep=True).sum()
+                                  for df in frames))
+
+    return {'pages': n_pages, 'seconds': elapsed,
+            'merge_seconds': merge_seconds, 'bytes': size([df_pre, df_post]),
+            'merge_bytes': size(merged)}
+
+def windows_benchmark(n_urls=50, year_from=2016, year_to=2026, seed=0):
+    '''
+    Runs get_output_windows with yearly windows against the local fake
+    archive, and the same lookups with one CDX search and fetch per url and
+    window (find_versions and latest_viable, as get_output does for its two
+    windows).
+
+    Outputs:
+        - result (dict): "urls", "windows", "seconds", "cdx", "mementos"
+            (requests to the fake archive) and the same for the per window
+            lookups ("window_seconds", ...)
+    '''
+    from scripts.fake_archive import FakeArchive
+    from scripts import get_content
+    from scripts import internetarchive
+    from scripts import instrumentation
+    urls, corpus = window_corpus(n_urls, year_from, year_to, seed)
+    windows = get_content.yearly_windows(year_from, year_to)
+    default_method = tokenizer.get_default()
+    tokenizer.set_default('regex')
+    cwd = os.getcwd()
+    env = os.environ.get(internetarchive.ARCHIVE_ROOT_ENV)
+    with tempfile.TemporaryDirectory() as work, FakeArchive(corpus) as archive:
+        os.makedirs(os.path.join(work, 'outputs'))
+        with open(os.path.join(work, 'input.csv'), 'w') as f:
+            f.write(''.join(url + '\n' for url in urls))
+        os.environ[internetarchive.ARCHIVE_ROOT_ENV] = archive.url
+        os.chdir(work)
+        try:
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                get_content.get_output_windows('input.csv', 'bench', TERMS,
+                                               windows)
+            elapsed = time.perf_counter() - start
+            result = {'urls': n_urls, 'windows': len(windows),
+                      'seconds': elapsed, 'cdx': archive.stats['cdx'],
+                      'mementos': archive.stats['memento']}
+            archive.stats.update(cdx=0, memento=0)
+            start = time.perf_counter()
+            stats = instrumentation.StageStats()
+            with internetarchive.WaybackClient() as client:
+                for url in urls:
+                    for dates in windows:
+                        try:
+                            version = get_content.latest_viable(
+                                get_content.find_versions(client, url, dates))
+                        except ValueError: # no versions in the window
+                            continue
+                        if version is not None:
+                            try:
+                                get_content.count_memento(version.raw_url,
+                                                          TERMS, stats)
+                            except internetarchive.MementoPlaybackError:
+                                pass
+            result.update(window_seconds=time.perf_counter() - start,
+                          window_cdx=archive.stats['cdx'],
+                          window_mementos=archive.stats['memento'])
+        finally:
+            os.chdir(cwd)
+            tokenizer.set_default(default_method)
+            if env is None:
+                del os.environ[internetarchive.ARCHIVE_ROOT_ENV]
+            else:
+                os.environ[internetarchive.ARCHIVE_ROOT_ENV] = env
+
+    return result
+
+def trajectory_benchmark(n_urls=50, n_captures=40, seed=0):
+    '''
+    Runs trajectory.get_trajectories twice against the local fake archive
+    (the second run resumes from the first).
+
+    Outputs:
+        - result (dict): "urls", "versions", "contents", "seconds" and
+            "mementos" of the first run, "resume_seconds" and
+            "resume_mementos" of the second and "bytes" of the trajectories
+            file
+    '''
+    from scripts.fake_archive import FakeArchive
+    from scripts import internetarchive
+    from scripts import trajectory
+    urls, corpus = history_corpus(n_urls, n_captures, seed=seed)
+    default_method = tokenizer.get_default()
+    tokenizer.set_default('regex')
+    cwd = os.getcwd()
+    env = os.environ.get(internetarchive.ARCHIVE_ROOT_ENV)
+    with tempfile.TemporaryDirectory() as work, FakeArchive(corpus) as archive:
+        os.makedirs(os.path.join(work, 'outputs'))
+        with open(os.path.join(work, 'input.csv'), 'w') as f:
+            f.write(''.join(url + '\n' for url in urls))
+        os.environ[internetarchive.ARCHIVE_ROOT_ENV] = archive.url
+        os.chdir(work)
+        try:
+            result = {'urls': n_urls}
+            for run in ['', 'resume_']:
+                archive.stats.update(memento=0)
+                start = time.perf_counter()
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    trajectory.get_trajectories('input.csv', 'bench',
+                                                TERMS)
+                result[run + 'seconds'] = time.perf_counter() - start
+                result[run + 'mementos'] = archive.stats['memento']
+            data = trajectory.load_trajectories('bench')
+            result.update(versions=len(data['timestamps']),
+                          contents=len(data['digests']),
+                          bytes=os.path.getsize(
+                              trajectory.TRAJECTORIES_FILE.format('bench')))
+        finally:
+            os.chdir(cwd)
+            tokenizer.set_default(default_method)
+            if env is None:
+                del os.environ[internetarchive.ARCHIVE_ROOT_ENV]
+            else:
+                os.environ[internetarchive.ARCHIVE_ROOT_ENV] = env
+
+    return result
+
+def sections_benchmark(n_pages=100, n_versions=20, n_sections=60, changed=2,
+                       seed=0):
+    '''
+    Times counting.SectionCounter against count_terms on every version of
+    synthetic pages.
+
+    Outputs:
+        - result (dict): "versions", "seconds", "full_seconds", "sections" and
+            "counted" (sections tokenized by the incremental counter)
+    '''
+    from scripts import counting
+    pages = section_versions(n_pages, n_versions, n_sections, changed, seed)
+    tokenizer.set_default('regex')
+    start = time.perf_counter()
+    for versions in pages:
+        for text in versions:
+            counting.count_terms(text, TERMS)
+    full_seconds = time.perf_counter() - start
+    counter = counting.SectionCounter(TERMS)
+    start = time.perf_counter()
+    for i, versions in enumerate(pages):
+        for text in versions:
+            counter.count(i, text)
+        counter.forget(i)
+    elapsed = time.perf_counter() - start
+
+    return {'versions': n_pages * n_versions, 'seconds': elapsed,
+            'full_seconds': full_seconds,
+            'sections': counter.stats['sections'],
+            'counted': counter.stats['counted']}
+
+def shards_benchmark(n_urls=60, n_shards=3, seed=0):
+    '''
+    Runs get_output against the local fake archive on one node and on
+    n_shards shards merged with shards.merge. Every tenth input url is a
+    variant (http, no www.) of an earlier one.
+
+    Outputs:
+        - result (dict): "urls", "shard_urls" (urls crawled by each shard),
+            "seconds", "shard_seconds" (sum over the shards) and
+            "merge_seconds"
+    '''
+    from scripts.fake_archive import FakeArchive
+    from scripts import get_content
+    from scripts import internetarchive
+    from scripts import shards
+    urls, corpus = synthetic_corpus(n_urls, seed)
+    urls += [url.replace('https://www.', 'http://') for url in urls[::10]]
+    default_method = tokenizer.get_default()
+    tokenizer.set_default('regex')
+    cwd = os.getcwd()
+    env = os.environ.get(internetarchive.ARCHIVE_ROOT_ENV)
+    result = {'urls': len(urls), 'shard_urls': []}
+    with tempfile.TemporaryDirectory() as work, FakeArchive(corpus) as archive:
+        os.makedirs(os.path.join(work, 'outputs'))
+        with open(os.path.join(work, 'input.csv'), 'w') as f:
+            f.write(''.join(url + '\n' for url in urls))
+        os.environ[internetarchive.ARCHIVE_ROOT_ENV] = archive.url
+        os.chdir(work)
+        try:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                start = time.perf_counter()
+                get_content.get_output('input.csv', 'single', TERMS,
+                                       DATES_PRE, DATES_POST,
+                                       dedupe=True)
+                result['seconds'] = time.perf_counter() - start
+                start = time.perf_counter()
+                for shard in range(n_shards):
+                    get_content.get_output('input.csv', 'merged', TERMS,
+                                           DATES_PRE, DATES_POST,
+                                           dedupe=True, shard=(shard, n_shards))
+                    with open('outputs/{}_data.csv'.format(shards.shard_name(
+                              'merged', shard, n_shards))) as f:
+                        result['shard_urls'].append(len(f.readlines()) - 1)
+                result['shard_seconds'] = time.perf_counter() - start
+                start = time.perf_counter()
+                shards.merge('input.csv', 'merged', n_shards, remove=True)
+                result['merge_seconds'] = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+            tokenizer.set_default(default_method)
+            if env is None:
+                del os.environ[internetarchive.ARCHIVE_ROOT_ENV]
+            else:
+                os.environ[internetarchive.ARCHIVE_ROOT_ENV] = env
+
+    return result
+
+def jobs_benchmark(n_urls=60, workers=4, crashed=5, seed=0):
+    '''
+    Drains a jobs.JobQueue with a pool of workers against the local fake
+    archive, after a worker crashed holding some jobs (they are leased and
+    never completed), and times it against get_output.
+
+    Outputs:
+        - result (dict): "urls", "workers", "seconds" (get_output),
+            "queue_seconds", "requeued" (jobs of the crashed worker that were
+            retried) and "progress" (see JobQueue.progress)
+    '''
+    from scripts.fake_archive import FakeArchive
+    from scripts import get_content
+    from scripts import internetarchive
+    from scripts import jobs
+    urls, corpus = synthetic_corpus(n_urls, seed)
+    urls += [url.replace('https://www.', 'http://') for url in urls[::10]]
+    default_method = tokenizer.get_default()
+    tokenizer.set_default('regex')
+    cwd = os.getcwd()
+    env = os.environ.get(internetarchive.ARCHIVE_ROOT_ENV)
+    result = {'urls': len(urls), 'workers': workers}
+    with tempfile.TemporaryDirectory() as work, FakeArchive(corpus) as archive:
+        os.makedirs(os.path.join(work, 'outputs'))
+        with open(os.path.join(work, 'input.csv'), 'w') as f:
+            f.write(''.join(url + '\n' for url in urls))
+        os.environ[internetarchive.ARCHIVE_ROOT_ENV] = archive.url
+        os.chdir(work)
+        try:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                start = time.perf_counter()
+                get_content.get_output('input.csv', 'single', TERMS,
+                                       DATES_PRE, DATES_POST,
+                                       dedupe=True)
+                result['seconds'] = time.perf_counter() - start
+            start = time.perf_counter()
+            with jobs.JobQueue('outputs/jobs.db', lease_seconds=1) as queue:
+                queue.add(urls, dedupe=True)
+                lost = queue.lease('crashed', crashed)
+            jobs.run_workers('outputs/jobs.db', TERMS, DATES_PRE,
+                             DATES_POST, processes=workers,
+                             lease_seconds=1, poll_seconds=0.2)
+            jobs.export('outputs/jobs.db', 'queue', TERMS)
+            result['queue_seconds'] = time.perf_counter() - start
+            with jobs.JobQueue('outputs/jobs.db') as queue:
+                result['progress'] = queue.progress()
+                attempts = dict(queue._db.execute('SELECT id, attempts FROM jobs'))
+            result['requeued'] = sum(attempts[id] == 2 for id, _ in lost)
+        finally:
+            os.chdir(cwd)
+            tokenizer.set_default(default_method)
+            if env is None:
+                del os.environ[internetarchive.ARCHIVE_ROOT_ENV]
+            else:
+                os.environ[internetarchive.ARCHIVE_ROOT_ENV] = env
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the pipeline')
+    subparsers = parser.add_subparsers(dest='command')
+    tok = subparsers.add_parser('tokenizer', help='tokenizer throughput')
+    tok.add_argument('snapshots', help='pickle file with Snapshot objects')
+    tok.add_argument('--repeat', type=int, default=3)
+    imp = subparsers.add_parser('imports',
+                                help='import time of modules against budgets')
+    imp.add_argument('--repeat', type=int, default=5)
+    pip = subparsers.add_parser('pipeline',
+                                help='get_output against a local fake archive')
+    pip.add_argument('--urls', type=int, default=100)
+    pip.add_argument('--cdx-error-rate', type=float, default=0)
+    pip.add_argument('--memento-error-rate', type=float, default=0)
+    pip.add_argument('--latency', type=float, default=0)
+    pip.add_argument('--page-size', type=int, default=None)
+    pip.add_argument('--seed', type=int, default=0)
+    pip.add_argument('--tokenizer', choices=list(tokenizer.TOKENIZERS),
+                     default=None)
+    pip.add_argument('--bulk-cdx', action='store_true',
+                     help='look up versions with grouped CDX scans')
+    sui = subparsers.add_parser('suite',
+                                help='stages of the pipeline on a synthetic corpus')
+    sui.add_argument('--sizes', type=int, nargs='+', default=SUITE_SIZES)
+    sui.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    sui.add_argument('--seed', type=int, default=0)
+    sui.add_argument('--no-memory', action='store_true',
+                     help='skip the tracemalloc run of each stage')
+    sui.add_argument('--tokenizer', choices=list(tokenizer.TOKENIZERS),
+                     default=None)
+    sui.add_argument('--output', help='json file to write the results to')
+    sui.add_argument('--baseline', help='json file of an earlier run, exits '
+                                        'with 1 if a stage regressed')
+    sui.add_argument('--tolerance', type=float, default=0.2)
+    dep = subparsers.add_parser('departments',
+                                help='changes of every department at once')
+    dep.add_argument('--pages', type=int, default=5000)
+    dep.add_argument('--departments', type=int, default=20)
+    dep.add_argument('--terms', type=int, default=200)
+    dep.add_argument('--seed', type=int, default=0)
+    dep.add_argument('--no-loop', action='store_true',
+                     help='skip the get_changes loop')
+    sig = subparsers.add_parser('significance',
+                                help='batch significance tests of every term')
+    sig.add_argument('--pages', type=int, default=2000)
+    sig.add_argument('--departments', type=int, default=5)
+    sig.add_argument('--terms', type=int, default=50)
+    sig.add_argument('--resamples', type=int, default=10000)
+    sig.add_argument('--seed', type=int, default=0)
+    loa = subparsers.add_parser('loader',
+                                help='typed loader of a result set')
+    loa.add_argument('--pages', type=int, default=100000)
+    loa.add_argument('--seed', type=int, default=0)
+    win = subparsers.add_parser('windows',
+                                help='yearly windows from one CDX search per url')
+    win.add_argument('--urls', type=int, default=50)
+    win.add_argument('--year-from', type=int, default=2016)
+    win.add_argument('--year-to', type=int, default=2026)
+    win.add_argument('--seed', type=int, default=0)
+    tra = subparsers.add_parser('trajectories',
+                                help='full history term counts by digest')
+    tra.add_argument('--urls', type=int, default=50)
+    tra.add_argument('--captures', type=int, default=40)
+    tra.add_argument('--seed', type=int, default=0)
+    sec = subparsers.add_parser('sections',
+                                help='incremental counting of page versions')
+    sec.add_argument('--pages', type=int, default=100)
+    sec.add_argument('--versions', type=int, default=20)
+    sec.add_argument('--sections', type=int, default=60)
+    sec.add_argument('--changed', type=int, default=2)
+    sec.add_argument('--seed', type=int, default=0)
+    sha = subparsers.add_parser('shards',
+                                help='sharded crawl merged against one node')
+    sha.add_argument('--urls', type=int, default=60)
+    sha.add_argument('--shards', type=int, default=3)
+    sha.add_argument('--seed', type=int, default=0)
+    job = subparsers.add_parser('jobs',
+                                help='job queue drained by worker processes')
+    job.add_argument('--urls', type=int, default=60)
+    job.add_argument('--workers', type=int, default=4)
+    job.add_argument('--crashed', type=int, default=5,
+                     help='jobs held by a crashed worker')
+    job.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'tokenizer':
+        texts = load_texts(args.snapshots)
+        for name, result in tokenizer_throughput(texts, args.repeat).items():
+            print('{}: {:.3f} s, {:.0f} pages/s, {:.0f} tokens/s'.format(
+                  name, result['seconds'], result['pages_per_s'],
+                  result['tokens_per_s']))
+    elif args.command == 'imports':
+        ok, results = check_imports(repeat=args.repeat)
+        for module, result in results.items():
+            print('{}: {:.3f} s (budget {} s){}'.format(
+                  module, result['seconds'], result['budget'],
+                  ', loads ' + ', '.join(result['heavy']) if result['heavy'] else ''))
+        if not ok:
+            sys.exit(1)
+    elif args.command == 'pipeline':
+        result = pipeline_benchmark(args.urls, args.cdx_error_rate,
+                                    args.memento_error_rate, args.latency,
+                                    args.page_size, args.seed, args.tokenizer,
+                                    args.bulk_cdx)
+        print(json.dumps(result))
+    elif args.command == 'suite':
+        results = []
+        for n_pages in args.sizes:
+            for result in stage_benchmark(n_pages, args.stages, args.seed,
+                                          not args.no_memory, args.tokenizer):
+                print(json.dumps(result))
+                results.append(result)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = find_regressions(results, json.load(f),
+                                               args.tolerance)
+            for regression in regressions:
+                print('regression:', regression)
+            if regressions:
+                sys.exit(1)
+    elif args.command == 'departments':
+        result = department_benchmark(args.pages, args.departments, args.terms,
+                                      seed=args.seed, loop=not args.no_loop)
+        print(json.dumps(result))
+    elif args.command == 'significance':
+        print(json.dumps(significance_benchmark(args.pages, args.departments,
+                                                args.terms, args.resamples,
+                                                args.seed)))
+    elif args.command == 'loader':
+        result = loader_benchmark(args.pages, args.seed)
+        print(json.dumps(result))
+    elif args.command == 'windows':
+        result = windows_benchmark(args.urls, args.year_from, args.year_to,
+                                   args.seed)
+        print(json.dumps(result))
+    elif args.command == 'trajectories':
+        result = trajectory_benchmark(args.urls, args.captures, args.seed)
+        print(json.dumps(result))
+    elif args.command == 'sections':
+        result = sections_benchmark(args.pages, args.versions, args.sections,
+                                    args.changed, args.seed)
+        print(json.dumps(result))
+    elif args.command == 'shards':
+        result = shards_benchmark(args.urls, args.shards, args.seed)
+        print(json.dumps(result))
+    elif args.command == 'jobs':
+        result = jobs_benchmark(args.urls, args.workers, args.crashed, args.seed)
+        print(json.dumps(result))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+'''
+Capture script
+
+Saves the current state of urls in the Wayback Machine with savepagenow from a
+background thread, so that captures never block or fail the counting
+pipeline. Captures are rate limited, retried, and logged to a csv file.
+
+    with CaptureQueue('outputs/captures_counts_final.csv') as captures:
+        get_output(..., capture_queue=captures)
+
+get_output closes the queue itself once every url is counted, after the
+pending captures.
+'''
+from scripts import utils
+from datetime import datetime
+import threading
+import queue
+import csv
+
+LOG_COLUMNS = ['url', 'status', 'archive_url', 'attempts', 'error', 'date']
+
+def capture_or_cache(url):
+    '''
+    Captures a url with savepagenow, which is only imported when used
+    '''
+    import savepagenow
+    return savepagenow.capture_or_cache(url)
+
+class CaptureQueue:
+    '''
+    Background queue of savepagenow captures.
+
+    Inputs:
+        - log_file (str): csv file where the result of every capture is
+            appended (url, status, archive_url, attempts, error, date), None
+            for no log
+        - calls_per_second (float): maximum rate of capture requests
+        - retries (int): number of retries of a failed capture
+        - backoff (float): seconds to wait before the first retry, doubled on
+            every retry
+        - maxsize (int): maximum number of pending urls, urls put in a full
+            queue are skipped (0 for no limit)
+        - capture_function (function): function that captures a url and
+            returns (archive_url, captured), by default
+            savepagenow.capture_or_cache
+
+    Statuses in the log: 'captured' (new capture), 'cached' (recent capture
+    reused by savepagenow), 'failed' (after all retries) and 'skipped' (queue
+    full or closed).
+    '''
+    def __init__(self, log_file=None, calls_per_second=0.2, retries=2,
+                 backoff=30, maxsize=0, capture_function=None):
+        self.log_file = log_file
+        self.calls_per_second = calls_per_second
+        self.retries = retries
+        self.backoff = backoff
+        self.counts = {'captured': 0, 'cached': 0, 'failed': 0, 'skipped': 0}
+        self._capture = capture_function
+        self.maxsize = maxsize
+        # unbounded, so that close can always add its end marker
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close(wait=type is None) # on errors pending urls are skipped
+
+    def __len__(self):
+        '''
+        Number of urls waiting to be captured
+        '''
+        return self._queue.qsize()
+
+    def put(self, url):
+        '''
+        Adds a url to the queue without waiting. Returns False if the url was
+        skipped because the queue is full or closed.
+        '''
+        if self._closed:
+            self._log(url, 'skipped', error='queue closed')
+            return False
+        if self.maxsize and self._queue.qsize() >= self.maxsize:
+            self._log(url, 'skipped', error='queue full')
+            return False
+        self._queue.put(url)
+        return True
+
+    def close(self, wait=True, timeout=None):
+        '''
+        Stops accepting urls. With wait=True, pending urls are captured first
+        (for at most timeout seconds), otherwise they are logged as skipped.
+        Closing a closed queue does nothing.
+        '''
+        if self._closed and not self._thread.is_alive():
+            return
+        self._closed = True
+        if not wait:
+            self._stop.set()
+        self._queue.put(None) # never blocks, the queue is unbounded
+        self._thread.join(timeout)
+        if self._thread.is_alive(): # timed out, drop the rest
+            self._stop.set()
+        else: # urls left by a worker that died
+            self._drain()
+
+    def report(self):
+        '''
+        Prints the number of captures by status
+        '''
+        print('captures: ' + ', '.join('{} {}'.format(v, k)
+                                       for k, v in self.counts.items()) +
+              ', {} pending'.format(len(self)))
+
+    def _drain(self):
+        while True:
+            try:
+                url = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if url is not None:
+                self._log(url, 'skipped', error='queue closed')
+
+    def _run(self):
+        while True:
+            url = self._queue.get()
+            if url is None:
+                break
+            if self._stop.is_set():
+                self._log(url, 'skipped', error='queue closed')
+                continue
+            self._capture_url(url)
+
+    def _capture_url(self, url):
+        '''
+        Captures a url with retries, logging the result
+        '''
+        error = None
+        for attempt in range(1, self.retries + 2):
+            try:
+                with utils.rate_limited(self.calls_per_second, 'savepagenow'):
+                    archive_url, captured = (self._capture or capture_or_cache)(url)
+            except Exception as e:
+                error = e
+                if attempt <= self.retries and not self._stop.is_set():
+                    self._stop.wait(self.backoff * 2 ** (attempt - 1))
+                    continue
+                break
+            status = 'captured' if captured else 'cached'
+            return self._log(url, status, archive_url, attempt)
+        self._log(url, 'failed', attempts=attempt, error=repr(error))
+
+    def _log(self, url, status, archive_url=None, attempts=0, error=None):
+        with self._lock:
+            self.counts[status] += 1
+            if self.log_file:
+                with open(self.log_file, 'a', newline='') as f:
+                    writer = csv.writer(f)
+                    if f.tell() == 0:
+                        writer.writerow(LOG_COLUMNS)
+                    writer.writerow([url, status, archive_url, attempts, error,
+                                     str(datetime.now())])
@@ -0,0 +1,223 @@
+'''
+CDX planner script
+
+Looks up the wayback versions of many urls with a few streamed CDX scans
+instead of two CDX requests per url. Urls are grouped by host and leading
+path directories; every group with enough urls is listed with one paged
+matchType='prefix' search of its html captures in each date range (the pre and
+post ranges, or the windows), and the records are joined back to the input
+urls by SURT key. Ranges are scanned separately so that the captures between
+them are never streamed.
+
+Urls at the root of their host (group_prefix returns None) are not in the plan
+and are looked up one at a time, as a scan of the whole host would stream far
+more captures than it saves.
+
+    plan = scan(urls, [dates_1, dates_2])
+    versions = plan.versions(url, dates_1) # same as list_versions, newest first
+'''
+from scripts import internetarchive
+from scripts.surt import surt
+from datetime import datetime
+import time
+
+# mime types kept by the scans: html pages and revisits of them
+SCAN_FILTER = 'mimetype:(text/html|warc/revisit)'
+
+def group_prefix(key, depth=1):
+    '''
+    Gets the scan prefix of a url key: its host and up to depth leading
+    directories of its path. Returns (prefix url, matchType), or None for
+    urls at the root of their host, whose scan would be the whole host.
+
+    Example: 'gov,hhs)/programs/social/index.html' -> ('hhs.gov/programs/',
+        'prefix')
+    '''
+    host, _, path = key.partition(')')
+    host = '.'.join(reversed(host.split(',')))
+    directories = path.split('?')[0].split('/')[1:-1][:depth]
+    if not directories:
+        return None
+
+    return host + '/' + '/'.join(directories) + '/', 'prefix'
+
+def group_urls(urls, depth=1, min_group=5):
+    '''
+    Groups urls by scan prefix.
+
+    Inputs:
+        - urls (lst): list of urls
+        - depth (int): number of leading path directories in the prefix
+        - min_group (int): minimum number of distinct urls for a group to be
+            scanned, smaller groups are looked up one url at a time
+
+    Outputs:
+        - groups (dict): (prefix url, matchType) -> set of url keys
+        - singles (lst): urls that are not in any group, including the urls
+            at the root of their host
+    '''
+    by_prefix = {}
+    singles = []
+    for url in urls:
+        key = surt(url)
+        prefix = group_prefix(key, depth)
+        if prefix is None: # looked up one url at a time
+            singles.append(url)
+        else:
+            by_prefix.setdefault(prefix, {}).setdefault(key, []).append(url)
+    groups = {}
+    for prefix, keys in by_prefix.items():
+        if len(keys) >= min_group:
+            groups[prefix] = set(keys)
+        else:
+            singles.extend(url for urls in keys.values() for url in urls)
+
+    return groups, singles
+
+def _date_range(dates):
+    return datetime(*dates[:3]), datetime(*dates[3:6])
+
+def merge_ranges(date_ranges):
+    '''
+    Gets the (from, to) datetimes of a list of date ranges, with overlapping
+    ranges merged so that no capture is scanned twice
+
+    Example: [[2016, 1, 1, 2016, 6, 30], [2016, 3, 1, 2016, 12, 31],
+        [2018, 1, 1, 2018, 1, 31]] -> [(2016-01-01, 2016-12-31),
+        (2018-01-01, 2018-01-31)]
+    '''
+    merged = []
+    for from_date, to_date in sorted(map(_date_range, date_ranges)):
+        if merged and from_date <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], to_date))
+        else:
+            merged.append((from_date, to_date))
+
+    return merged
+
+
+class CdxPlan:
+    '''
+    CDX records of many urls, as fetched by scan.
+
+    Attributes:
+        - records (dict): url key -> list of CdxRecord in timestamp order
+        - covered (set): url keys of the groups that were scanned
+        - stats (dict): "scans", "failed_scans", "records" (streamed) and
+            "seconds"
+    '''
+    def __init__(self, fallback=True):
+        self.fallback = fallback
+        self.records = {}
+        self.covered = set()
+        self.stats = {'scans': 0, 'failed_scans': 0, 'records': 0,
+                      'seconds': 0.0}
+
+    def __contains__(self, url):
+        '''
+        Whether the versions of a url can be taken from the plan. With
+        fallback, urls without any record in their scan are looked up again
+        one at a time, in case their key differs from the archive's.
+        '''
+        key = surt(url)
+        if self.fallback:
+            return key in self.records
+        return key in self.covered
+
+    def versions(self, url, dates):
+        '''
+        Lists the versions of a url within a date range, most recent first,
+        the same as list(client.list_versions(url, ...))[::-1] for its html
+        captures and revisits (see SCAN_FILTER).
+
+        Inputs:
+            - url (str): url to look for
+            - dates (lst): date range formatted as
+                [year_from, month_from, day_from, year_to, month_to, day_to]
+
+        Outputs:
+            - versions (lst): list of CdxRecord, raises NoVersionsError (a
+                ValueError) if there are none
+        '''
+        from_date, to_date = _date_range(dates)
+        versions = []
+        previous = None # digest of the previous record (CDX collapse=digest)
+        last_hashes = {} # last digest per url (skip_repeats)
+        for record in self.records.get(surt(url), []):
+            if not from_date <= record.date <= to_date:
+                continue
+            if record.digest != previous and \
+               last_hashes.get(record.url) != record.digest:
+                last_hashes[record.url] = record.digest
+                versions.append(record)
+            previous = record.digest
+        if not versions:
+            raise internetarchive.NoVersionsError(
+                "Internet archive does not have archived versions of "
+                "{}".format(url))
+
+        return versions[::-1]
+
+    def report(self):
+        print('cdx plan: {} scans ({} failed), {} records, {} urls, {:.1f} s'.format(
+              self.stats['scans'], self.stats['failed_scans'],
+              self.stats['records'], len(self.records), self.stats['seconds']))
+
+
+def scan(urls, date_ranges, client=None, depth=1, min_group=5,
+         fallback=True):
+    '''
+    Fetches the CDX records of many urls with streamed scans of every group
+    of urls (see group_urls), one per date range (see merge_ranges).
+
+    Inputs:
+        - urls (lst): list of urls
+        - date_ranges (lst): list of date ranges formatted as
+            [year_from, month_from, day_from, year_to, month_to, day_to],
+            e.g. [dates_1, dates_2] or the windows of get_output_windows
+        - client (WaybackClient): client used for the scans, a new one by
+            default
+        - depth (int): number of leading path directories in the scan prefix
+        - min_group (int): minimum number of urls for a group to be scanned
+        - fallback (bool): whether urls without records should still be
+            looked up one at a time (see CdxPlan.__contains__)
+
+    Outputs:
+        - plan (CdxPlan): the records of the urls in the scanned groups, only
+            within the date ranges. If a scan fails, the urls of its group are
+            left out of the plan, as are urls at the root of their host.
+    '''
+    plan = CdxPlan(fallback)
+    start = time.perf_counter()
+    ranges = merge_ranges(date_ranges)
+    groups, singles = group_urls(urls, depth, min_group)
+    own_client = client is None
+    if own_client:
+        client = internetarchive.WaybackClient()
+    try:
+        for (prefix, match_type), keys in groups.items():
+            records = {}
+            try:
+                for from_date, to_date in ranges:
+                    plan.stats['scans'] += 1
+                    for record in client.search(prefix, matchType=match_type,
+                                                from_date=from_date,
+                                                to_date=to_date,
+                                                filter_field=SCAN_FILTER):
+                        plan.stats['records'] += 1
+                        key = surt(record.url)
+                        if key in keys:
+                            records.setdefault(key, []).append(record)
+            except Exception: # leave these urls to per url lookups
+                plan.stats['failed_scans'] += 1
+                continue
+            plan.covered.update(keys)
+            for key, key_records in records.items():
+                key_records.sort(key=lambda r: r.timestamp)
+                plan.records[key] = key_records
+    finally:
+        if own_client:
+            client.close()
+    plan.stats['seconds'] = time.perf_counter() - start
+
+    return plan
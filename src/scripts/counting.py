@@ -0,0 +1,258 @@
+'''
+Term counting script
+
+Counts all terms in a page with a single tokenization pass and spreads the
+counting of large corpora across a process pool. SectionCounter counts
+consecutive versions of a page incrementally, recounting only the sections
+that changed.
+'''
+from multiprocessing import Pool
+from collections import Counter
+from scripts import tokenizer
+import numpy as np
+import difflib
+import hashlib
+import pickle
+import csv
+
+COUNT_DTYPE = np.int32
+
+def _term_keys(terms):
+    '''
+    Normalizes terms into tuples of words
+    '''
+    return [tokenizer.normalize_term(term) for term in terms]
+
+def _count_keys(visible_text, keys):
+    '''
+    Counts normalized term keys in a list of text sections.
+    '''
+    row = [0] * len(keys)
+    ttal_words = 0
+    lengths = {len(key) for key in keys if key}
+    for section in visible_text:
+        tokens = tokenizer.tokenize(section)
+        ttal_words += len(tokens)
+        grams = {n: Counter(zip(*[tokens[i:] for i in range(n)])) for n in lengths}
+        for idx_t, key in enumerate(keys):
+            if key:
+                row[idx_t] += grams[len(key)][key]
+
+    return row, ttal_words
+
+def count_terms(visible_text, terms):
+    '''
+    Counts every term in the visible text of a page. Equivalent to calling
+    term_counter once per term, but each section is tokenized only once.
+
+    Inputs:
+        - visible_text (lst): list of strings, as returned by get_visible_txt
+        - terms (lst): list of terms (str or lst of str)
+
+    Outputs:
+        - row (lst): number of times that each term appears in visible text
+        - ttal_words (int): number of total words in visible text
+    '''
+    return _count_keys(visible_text, _term_keys(terms))
+
+################################################################################
+# Incremental counting of versions #############################################
+################################################################################
+
+def section_hash(section):
+    return hashlib.blake2b(section.encode(), digest_size=16).digest()
+
+class SectionCounter:
+    '''
+    Counts terms in consecutive versions of urls. Terms are counted within
+    sections (n-grams do not span two sections), so the counts of a page are
+    the sum of the counts of its sections: each section is hashed, and only
+    the sections that were added or changed since the previous version of the
+    same url are tokenized and counted.
+
+    Inputs:
+        - terms (lst): list of terms (str or lst of str)
+
+    Attributes:
+        - stats (dict): "versions", "sections" (in every version) and
+            "counted" (sections that were tokenized)
+    '''
+    def __init__(self, terms):
+        self._keys = _term_keys(terms)
+        self._last = {} # url -> (hashes, texts, hash -> (row, words), row, ttal)
+        self.stats = {'versions': 0, 'sections': 0, 'counted': 0}
+
+    def _count_section(self, section):
+        row, words = _count_keys([section], self._keys)
+        self.stats['counted'] += 1
+        return np.array(row, dtype=np.int64), words
+
+    def count(self, url, visible_text):
+        '''
+        Counts every term in a new version of a url, the same as count_terms.
+
+        Inputs:
+            - url (str): url (or any key) of the page
+            - visible_text (lst): list of strings, as returned by
+                get_visible_txt
+
+        Outputs:
+            - row (lst): number of times that each term appears in visible text
+            - ttal_words (int): number of total words in visible text
+            - changes (lst): sections that differ from the previous version
+                (see section_changes), every section is 'added' for the first
+                version of a url
+        '''
+        hashes = [section_hash(section) for section in visible_text]
+        old_hashes, old_texts, old_sections, old_row, old_ttal = self._last.get(
+            url, ([], [], {}, np.zeros(len(self._keys), dtype=np.int64), 0))
+        sections = {}
+        row = old_row.copy()
+        ttal = old_ttal
+        changes = []
+        matcher = difflib.SequenceMatcher(None, old_hashes, hashes, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                for h in hashes[j1:j2]:
+                    sections[h] = old_sections[h]
+                continue
+            delta = np.zeros(len(self._keys), dtype=np.int64)
+            words = 0
+            for h in old_hashes[i1:i2]: # removed or replaced sections
+                delta -= old_sections[h][0]
+                words -= old_sections[h][1]
+            for h, section in zip(hashes[j1:j2], visible_text[j1:j2]):
+                if h not in sections:
+                    # sections moved from elsewhere in the page keep their counts
+                    sections[h] = old_sections.get(h) or \
+                                  self._count_section(section)
+                delta += sections[h][0]
+                words += sections[h][1]
+            row += delta
+            ttal += words
+            changes.append({'kind': {'replace': 'changed', 'delete': 'removed',
+                                     'insert': 'added'}[tag],
+                            'old': old_texts[i1:i2],
+                            'new': list(visible_text[j1:j2]),
+                            'delta': delta, 'words': words})
+        self._last[url] = (hashes, list(visible_text), sections, row, ttal)
+        self.stats['versions'] += 1
+        self.stats['sections'] += len(hashes)
+
+        return row.tolist(), int(ttal), changes
+
+    def __contains__(self, url):
+        return url in self._last
+
+    def forget(self, url):
+        '''
+        Drops the last version of a url
+        '''
+        self._last.pop(url, None)
+
+def term_drivers(changes, terms, term):
+    '''
+    Gets the section changes that drove the change of a term between two
+    versions, largest first.
+
+    Inputs:
+        - changes (lst): changes returned by SectionCounter.count
+        - terms (lst): terms of the counter
+        - term (str or lst of str): one of terms
+
+    Outputs:
+        - drivers (lst): (kind, old sections, new sections, change of the
+            term count) of every change with a non zero change of the term
+    '''
+    idx = _term_keys(terms).index(tokenizer.normalize_term(term))
+    drivers = [(change['kind'], change['old'], change['new'],
+                int(change['delta'][idx]))
+               for change in changes if change['delta'][idx]]
+
+    return sorted(drivers, key=lambda driver: -abs(driver[3]))
+
+################################################################################
+# Process pool #################################################################
+################################################################################
+
+_worker_keys = None
+
+def _init_worker(keys, method):
+    global _worker_keys
+    _worker_keys = keys
+    tokenizer.set_default(method) # same tokenizer as the parent process
+
+def _count_chunk(texts):
+    '''
+    Counts a chunk of pages inside a worker process. Returns compact arrays so
+    that no token lists travel back to the parent process.
+    '''
+    counts = np.zeros((len(texts), len(_worker_keys)), dtype=COUNT_DTYPE)
+    ttal = np.full(len(texts), -1, dtype=np.int64)
+    for i, visible_text in enumerate(texts):
+        if visible_text is not None:
+            row, ttal[i] = _count_keys(visible_text, _worker_keys)
+            counts[i] = row
+
+    return counts, ttal
+
+def count_corpus(texts, terms, processes=None, chunksize=64):
+    '''
+    Counts terms for many pages at once, sending chunks of pages to a process
+    pool. Chunks are collected in input order, so the output does not depend on
+    the number of processes.
+
+    Inputs:
+        - texts (lst): list of visible texts (list of strings), None for pages
+            without text
+        - terms (lst): list of terms (str or lst of str)
+        - processes (int): number of worker processes, defaults to the number
+            of cores. With processes=1 everything runs in this process
+        - chunksize (int): number of pages sent to a worker at a time
+
+    Outputs:
+        - counts (numpy array): pages x terms matrix of counts
+        - ttal (numpy array): total words per page, -1 for pages without text
+    '''
+    keys = _term_keys(terms)
+    chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+    if processes == 1:
+        _init_worker(keys, tokenizer.get_default())
+        results = [_count_chunk(chunk) for chunk in chunks]
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(keys, tokenizer.get_default())) as pool:
+            results = pool.map(_count_chunk, chunks, chunksize=1)
+    if not results:
+        return np.zeros((0, len(keys)), dtype=COUNT_DTYPE), np.zeros(0, dtype=np.int64)
+    counts = np.concatenate([r[0] for r in results])
+    ttal = np.concatenate([r[1] for r in results])
+
+    return counts, ttal
+
+def recount(txt_name, terms, output_file, processes=None, chunksize=64):
+    '''
+    Counts a new list of terms over the text stored in the pickle file produced
+    by get_output, without fetching any page again. Writes the same csv files
+    as get_output.
+
+    Inputs:
+        - txt_name (str): name of pickle file with Snapshot objects
+        - terms (lst): list of terms to be looked for
+        - output_file (str): "root name" of produced outputs
+        - processes (int): number of worker processes
+        - chunksize (int): number of pages sent to a worker at a time
+
+    Outputs:
+        - {output_file}_pre.csv: csv file with counts "pre" matrix
+        - {output_file}_post.csv: csv file with counts "post" matrix
+    '''
+    with open(txt_name, 'rb') as fp:
+        snapshots = pickle.load(fp)
+    for name in ['pre', 'post']:
+        texts = [getattr(snapshot, name)['text'] for snapshot in snapshots]
+        counts, ttal = count_corpus(texts, terms, processes, chunksize)
+        matrix = [[None] * len(terms) if ttal[i] < 0 else row
+                  for i, row in enumerate(counts.tolist())]
+        with open('outputs/' + output_file + '_' + name + '.csv', "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerows(matrix)
@@ -0,0 +1,268 @@
+'''
+Aggregate cube script
+
+Term counts and word totals of every (department, agency) group in the "pre"
+and "post" periods, kept as dense arrays so that the analysis functions read
+slices of it instead of re-aggregating the per-url matrices. The cube is built
+once from the final dataframes (or as snapshots are fetched) and updated one
+url at a time: adding a url that is already in the cube replaces its counts.
+
+    cube = AggregateCube.from_frames(df_pre, df_post, col_names)
+    departments, counts, ttal = cube.aggregate('department')
+    get_output(..., cube=cube) # keeps the cube up to date while crawling
+'''
+from scripts.utils import term_label
+from scripts.surt import surt
+import numpy as np
+import re
+
+PERIODS = ['pre', 'post']
+ARCHIVE_PREFIX = re.compile(r'^(?:https?://)?web\.archive\.org/web/[^/]+/')
+
+def agency(url):
+    '''
+    Gets the agency of a url (or of its wayback memento): the last two labels
+    of its host.
+
+    Example: 'https://web.archive.org/web/20170101000000id_/https://aidsinfo.nih.gov/x'
+        -> 'nih.gov'
+    '''
+    if not isinstance(url, str):
+        return None
+    host = surt(ARCHIVE_PREFIX.sub('', url)).partition(')')[0]
+    return '.'.join(reversed(host.split(',')[:2]))
+
+
+class AggregateCube:
+    '''
+    Counts of terms by (department, agency) group and period.
+
+    Inputs:
+        - terms (lst): list of terms, in the order of the count rows
+        - departments (dict): url id -> department name, used by add_snapshot
+        - periods (lst): names of the periods
+
+    Attributes:
+        - groups (lst): (department, agency) of each group, missing
+            departments are None
+        - counts (array): groups x terms x periods term counts
+        - ttal (array): groups x periods total number of words
+        - pages (array): groups x periods number of urls
+    '''
+    def __init__(self, terms, departments=None, periods=PERIODS):
+        self.terms = [term_label(term) for term in terms]
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        self.periods = list(periods)
+        self.period_index = {period: i for i, period in enumerate(self.periods)}
+        self.departments = dict(departments or {})
+        self.groups = []
+        self.group_index = {}
+        # arrays with room for more groups, grown by doubling
+        self._counts = np.zeros((0, len(self.terms), len(self.periods)))
+        self._ttal = np.zeros((0, len(self.periods)))
+        self._pages = np.zeros((0, len(self.periods)), dtype=int)
+        self._rows = {} # (id, period) -> (group, counts, ttal)
+
+    @property
+    def counts(self):
+        return self._counts[:len(self.groups)]
+
+    @property
+    def ttal(self):
+        return self._ttal[:len(self.groups)]
+
+    @property
+    def pages(self):
+        return self._pages[:len(self.groups)]
+
+    def __len__(self):
+        '''
+        Number of urls in the cube
+        '''
+        return len({id for id, _ in self._rows})
+
+    def __contains__(self, id):
+        return any((id, period) in self._rows for period in self.periods)
+
+    @classmethod
+    def from_frames(cls, df_pre, df_post, term_cols, ttal_col='ttal',
+                    department_col='department', agency_col=None):
+        '''
+        Builds the cube from the dataframes returned by analysis.get_final_df.
+
+        Inputs:
+            - df_pre (df): pre dataframe, one row per url
+            - df_post (df): post dataframe, one row per url
+            - term_cols (lst): list of term columns
+            - ttal_col (str): column with the total number of words
+            - department_col (str): column with the department names (may be
+                missing)
+            - agency_col (str): column with the agency names, by default the
+                agency is taken from the "url" column (see agency)
+
+        A url is in the same group in both periods, with the agency of its
+        post row as in add_snapshot (the pre row only for urls without a post
+        row).
+
+        Outputs:
+            - cube (AggregateCube)
+        '''
+        cube = cls(term_cols)
+        by_id = {} # id -> agency, post rows replace pre rows
+        for df in [df_pre, df_post]:
+            if agency_col is not None:
+                by_id.update(zip(df['id'], df[agency_col]))
+            elif 'url' in df:
+                by_id.update(zip(df['id'], map(agency, df['url'])))
+        for period, df in zip(cube.periods, [df_pre, df_post]):
+            if department_col in df:
+                departments = [None if d != d else d for d in df[department_col]]
+            else:
+                departments = [None] * len(df)
+            agencies = [by_id.get(id) for id in df['id']]
+            groups = np.array([cube._group(department, agency_name)
+                               for department, agency_name in
+                               zip(departments, agencies)], dtype=int)
+            matrix = df[term_cols].to_numpy(dtype=float)
+            ttal = df[ttal_col].to_numpy(dtype=float)
+            p = cube.period_index[period]
+            # one row per url, summed by group
+            sums = df[term_cols + [ttal_col]].groupby(groups).sum()
+            present = sums.index.to_numpy()
+            cube.counts[present, :, p] += sums[term_cols].to_numpy(dtype=float)
+            cube.ttal[present, p] += sums[ttal_col].to_numpy(dtype=float)
+            cube.pages[:, p] += np.bincount(groups, minlength=len(cube.groups))
+            for id, g, row, total in zip(df['id'], groups, matrix, ttal):
+                cube._rows[(id, period)] = (g, row, total)
+
+        return cube
+
+    def _group(self, department, agency_name):
+        '''
+        Gets the index of a group, adding it (and a row to every array) if it
+        is new
+        '''
+        key = (department, agency_name)
+        g = self.group_index.get(key)
+        if g is None:
+            g = len(self.groups)
+            self.groups.append(key)
+            self.group_index[key] = g
+            if g == len(self._counts):
+                grow = lambda array: np.concatenate([array, np.zeros(
+                    (max(g, 1),) + array.shape[1:], dtype=array.dtype)])
+                self._counts = grow(self._counts)
+                self._ttal = grow(self._ttal)
+                self._pages = grow(self._pages)
+
+        return g
+
+    def add(self, id, period, counts, ttal, department=None, agency_name=None):
+        '''
+        Adds the counts of a url in a period, replacing its previous counts
+
+        Inputs:
+            - id (int): id of the url
+            - period (str): one of the cube periods
+            - counts (lst): count of each term
+            - ttal (int): total number of words
+            - department (str): department of the url
+            - agency_name (str): agency of the url
+        '''
+        self.remove(id, period)
+        g = self._group(department, agency_name)
+        p = self.period_index[period]
+        row = np.asarray(counts, dtype=float)
+        self.counts[g, :, p] += row
+        self.ttal[g, p] += ttal
+        self.pages[g, p] += 1
+        self._rows[(id, period)] = (g, row, ttal)
+
+    def remove(self, id, period=None):
+        '''
+        Removes the counts of a url in a period (in every period by default)
+        '''
+        for name in self.periods if period is None else [period]:
+            entry = self._rows.pop((id, name), None)
+            if entry is not None:
+                g, row, ttal = entry
+                p = self.period_index[name]
+                self.counts[g, :, p] -= row
+                self.ttal[g, p] -= ttal
+                self.pages[g, p] -= 1
+
+    def add_snapshot(self, snapshot, department=None):
+        '''
+        Adds (or replaces) the counts of a Snapshot, failed snapshots are
+        removed. The department defaults to the one of its id in
+        self.departments. Both periods go to the agency of the post url, as
+        in from_frames.
+        '''
+        if snapshot.status != 'succesful':
+            self.remove(snapshot.id)
+            return
+        if department is None:
+            department = self.departments.get(snapshot.id)
+        agency_name = agency(snapshot.post['url'])
+        for period in self.periods:
+            obj = getattr(snapshot, period)
+            self.add(snapshot.id, period, obj['results'], obj['word_count'],
+                     department, agency_name)
+
+    def update(self, snapshots):
+        '''
+        Adds a list of Snapshot objects (see add_snapshot)
+        '''
+        for snapshot in snapshots:
+            if snapshot is not None:
+                self.add_snapshot(snapshot)
+
+    def aggregate(self, by='department', terms=None):
+        '''
+        Sums the groups by department or agency.
+
+        Inputs:
+            - by (str): 'department', 'agency' or None for the total of every
+                group
+            - terms (lst): terms to keep, all by default
+
+        Outputs:
+            - labels (lst): department or agency names (None for a missing
+                department), sorted
+            - counts (array): labels x terms x periods
+            - ttal (array): labels x periods
+        '''
+        counts = self.counts
+        if terms is not None:
+            counts = counts[:, [self.term_index[term] for term in terms], :]
+        if by is None:
+            return [None], counts.sum(axis=0)[None], self.ttal.sum(axis=0)[None]
+        position = {'department': 0, 'agency': 1}[by]
+        keys = [group[position] for group in self.groups]
+        labels = sorted(set(keys), key=lambda label: (label is None, label))
+        index = {label: i for i, label in enumerate(labels)}
+        # labels x groups indicator matrix
+        indicator = np.zeros((len(labels), len(keys)))
+        indicator[[index[key] for key in keys], np.arange(len(keys))] = 1
+        shape = counts.shape
+        counts = (indicator @ counts.reshape(shape[0], -1)).reshape(
+                  (len(labels),) + shape[1:])
+
+        return labels, counts, indicator @ self.ttal
+
+    def slice(self, department=None, agency_name=None, terms=None):
+        '''
+        Gets the counts of a department and/or agency, every group by default.
+
+        Outputs:
+            - counts (array): terms x periods
+            - ttal (array): periods
+        '''
+        selected = [g for g, (d, a) in enumerate(self.groups)
+                    if (department is None or d == department) and
+                       (agency_name is None or a == agency_name)]
+        counts = self.counts[selected]
+        if terms is not None:
+            counts = counts[:, [self.term_index[term] for term in terms], :]
+
+        return counts.sum(axis=0), self.ttal[selected].sum(axis=0)
@@ -0,0 +1,317 @@
+'''
+Fake archive script
+
+A local stand-in for the Wayback Machine that serves CDX search results and
+`id_` mementos from a fixture corpus, so that the internetarchive client and
+get_output can be exercised and benchmarked without the live archive.
+
+Point the pipeline to it with the WAYBACK_ARCHIVE_ROOT environment variable
+(or the archive_root argument of WaybackClient):
+
+    with FakeArchive(load_corpus('fixtures.json')) as archive:
+        os.environ['WAYBACK_ARCHIVE_ROOT'] = archive.url
+        ...
+
+A fixture corpus is a list of captures (dicts) with the keys:
+    - url (str): original url
+    - timestamp (str): 14 digit capture time, e.g. '20170119120000'
+    - status (int or str): HTTP status of the capture, '-' for a revisit
+        record of the previous capture of the same url (default 200)
+    - mime (str): mime type (default 'text/html')
+    - body (str): page content
+    - redirect (str): for 3xx captures, url the capture redirects to
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from scripts.internetarchive import cdx_hash
+from scripts.surt import surt
+from datetime import datetime
+import urllib.parse
+import threading
+import random
+import json
+import time
+import re
+
+CDX_FIELDS = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode',
+              'digest', 'length']
+MEMENTO_PATH = re.compile(r'^/web/(\d{1,14})(id_)?/(.+)$')
+HTTP_DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+def load_corpus(file_name):
+    '''
+    Reads a fixture corpus from a json file with a list of captures
+    '''
+    with open(file_name) as fp:
+        return json.load(fp)
+
+
+class FakeArchive:
+    '''
+    Local Wayback/CDX server running in a background thread.
+
+    Inputs:
+        - corpus (lst): list of captures (see the module docstring)
+        - host (str): interface to listen on
+        - port (int): port to listen on, 0 picks a free port
+        - cdx_error_rate (float): fraction of CDX requests answered with 503
+            or 504
+        - memento_error_rate (float): fraction of memento requests answered
+            with 503 or 504
+        - latency (float or tuple): seconds to wait before answering, or a
+            (min, max) range
+        - page_size (int): if set, CDX results are split in pages of this
+            size with resume keys even when the client sends no limit
+        - seed (int): seed for error injection and latency, so runs are
+            repeatable
+    '''
+    def __init__(self, corpus, host='127.0.0.1', port=0, cdx_error_rate=0,
+                 memento_error_rate=0, latency=0, page_size=None, seed=0):
+        self.cdx_error_rate = cdx_error_rate
+        self.memento_error_rate = memento_error_rate
+        self.latency = latency
+        self.page_size = page_size
+        self.stats = {'cdx': 0, 'memento': 0, 'errors': 0, 'not_found': 0,
+                      'bytes': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._rows = []
+        self._load(corpus)
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.archive = self
+        self._thread = None
+
+    def _load(self, corpus):
+        '''
+        Builds the sorted CDX rows and the content of each capture
+        '''
+        captures = []
+        for capture in corpus:
+            captures.append(dict(capture, key=surt(capture['url']),
+                                 status=str(capture.get('status', 200))))
+        captures.sort(key=lambda x: (x['key'], x['timestamp']))
+        last = {}
+        for capture in captures:
+            if capture['status'] == '-':
+                original = last.get(capture['key'])
+                if original is None:
+                    raise ValueError('revisit without a previous capture: '
+                                     '{}'.format(capture))
+                capture['body'] = original['body']
+                capture['mime'] = 'warc/revisit'
+                capture['digest'] = original['digest']
+                capture['played_status'] = original['status']
+            else:
+                capture['body'] = capture.get('body', '')
+                capture['mime'] = capture.get('mime', 'text/html')
+                capture['digest'] = cdx_hash(capture['body'])
+                capture['played_status'] = capture['status']
+                last[capture['key']] = capture
+            self._rows.append(capture)
+        self._by_key = {}
+        for capture in self._rows:
+            self._by_key.setdefault(capture['key'], []).append(capture)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def _draw(self, rate):
+        '''
+        Waits for the configured latency and decides whether to inject an
+        error. Returns the error status code or None.
+        '''
+        with self._lock:
+            if isinstance(self.latency, (tuple, list)):
+                delay = self._random.uniform(*self.latency)
+            else:
+                delay = self.latency
+            error = None
+            if rate and self._random.random() < rate:
+                error = self._random.choice([503, 504])
+                self.stats['errors'] += 1
+        if delay:
+            time.sleep(delay)
+        return error
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    ############################################################################
+    # CDX search ###############################################################
+    ############################################################################
+
+    def cdx_lines(self, params):
+        '''
+        Gets the lines of a CDX response for a dict of query parameters.
+        '''
+        url = params['url']
+        match_type = params.get('matchType')
+        if match_type is None:
+            if url.endswith('*'):
+                match_type = 'prefix'
+            elif url.startswith('*.'):
+                match_type = 'domain'
+            else:
+                match_type = 'exact'
+        key = surt(url.rstrip('*').lstrip('*.'))
+        host_key = key.split(')', 1)[0]
+        if match_type == 'exact':
+            rows = self._by_key.get(key, [])
+        elif match_type == 'prefix':
+            rows = [r for r in self._rows if r['key'].startswith(key)]
+        elif match_type == 'host':
+            rows = [r for r in self._rows if r['key'].split(')', 1)[0] == host_key]
+        elif match_type == 'domain':
+            rows = [r for r in self._rows
+                    if (r['key'].split(')', 1)[0] + ',').startswith(host_key + ',')]
+        else:
+            raise ValueError('Unknown matchType {}'.format(match_type))
+
+        date_from = params.get('from', '').ljust(14, '0')
+        date_to = params.get('to', '').ljust(14, '9')
+        rows = [r for r in rows if date_from <= r['timestamp'] <= date_to]
+
+        lines = [self._fields(r) for r in rows]
+        if params.get('filter'):
+            negate = params['filter'].startswith('!')
+            field, regex = params['filter'].lstrip('!').split(':', 1)
+            pattern = re.compile(regex)
+            idx = CDX_FIELDS.index(field)
+            lines = [l for l in lines
+                     if bool(pattern.fullmatch(l[idx])) != negate]
+        if params.get('collapse'):
+            field, _, length = params['collapse'].partition(':')
+            idx = CDX_FIELDS.index(field)
+            length = int(length) if length else None
+            collapsed = []
+            previous = None
+            for l in lines:
+                value = l[idx][:length]
+                if value != previous:
+                    collapsed.append(l)
+                previous = value
+            lines = collapsed
+
+        start = int(params.get('resumeKey') or params.get('offset') or 0)
+        limit = params.get('limit')
+        limit = int(limit) if limit else self.page_size
+        show_resume_key = params.get('showResumeKey', 'true') == 'true'
+        end = len(lines) if limit is None else start + limit
+        page = [' '.join(l) for l in lines[start:end]]
+        if show_resume_key and end < len(lines):
+            page += ['', str(end)]
+
+        return page
+
+    def _fields(self, row):
+        return [row['key'], row['timestamp'], row['url'], row['mime'],
+                row['status'], row['digest'], str(len(row['body'].encode()))]
+
+    ############################################################################
+    # Mementos #################################################################
+    ############################################################################
+
+    def find_capture(self, timestamp, url):
+        '''
+        Gets the capture of a url closest to a timestamp, or None
+        '''
+        captures = self._by_key.get(surt(url))
+        if not captures:
+            return None
+        timestamp = timestamp.ljust(14, '0')
+        target = datetime.strptime(timestamp, '%Y%m%d%H%M%S')
+        return min(captures, key=lambda c: abs(
+            (datetime.strptime(c['timestamp'], '%Y%m%d%H%M%S') - target).total_seconds()))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass # keep benchmark output clean
+
+    def _send(self, status, body=b'', headers=None):
+        headers = dict({'Content-Type': 'text/html; charset=utf-8'}, **(headers or {}))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.archive._count('bytes', len(body))
+
+    def do_GET(self):
+        archive = self.server.archive
+        parsed = urllib.parse.urlsplit(self.path)
+        if parsed.path == '/cdx/search/cdx':
+            archive._count('cdx')
+            error = archive._draw(archive.cdx_error_rate)
+            if error:
+                return self._send(error, b'Service Unavailable')
+            params = dict(urllib.parse.parse_qsl(parsed.query))
+            try:
+                lines = archive.cdx_lines(params)
+            except (KeyError, ValueError) as e:
+                return self._send(400, str(e).encode())
+            body = ''.join(line + '\n' for line in lines).encode()
+            return self._send(200, body, {'Content-Type': 'text/plain'})
+
+        match = MEMENTO_PATH.match(self.path)
+        if match is None:
+            archive._count('not_found')
+            return self._send(404, b'Not Found')
+        archive._count('memento')
+        error = archive._draw(archive.memento_error_rate)
+        if error:
+            return self._send(error, b'Service Unavailable')
+        timestamp, raw, url = match.groups()
+        capture = archive.find_capture(timestamp, url)
+        if capture is None:
+            archive._count('not_found')
+            return self._send(404, b'Not Found', {
+                'X-Archive-Wayback-Runtime-Error':
+                    'Resource Not In Archive'})
+        mode = 'id_' if raw else ''
+        if capture['timestamp'] != timestamp:
+            # like the real archive, redirect to the closest capture
+            location = '{}/web/{}{}/{}'.format(archive.url, capture['timestamp'],
+                                               mode, capture['url'])
+            return self._send(302, b'', {'Location': location})
+        capture_date = datetime.strptime(capture['timestamp'], '%Y%m%d%H%M%S')
+        headers = {
+            'Memento-Datetime': capture_date.strftime(HTTP_DATE_FORMAT),
+            'Content-Type': '{}; charset=utf-8'.format(
+                capture['mime'] if capture['mime'] != 'warc/revisit' else 'text/html'),
+            'X-Archive-Orig-Date': capture_date.strftime(HTTP_DATE_FORMAT),
+        }
+        status = int(capture['played_status'])
+        if 300 <= status < 400:
+            headers['Location'] = '{}/web/{}{}/{}'.format(
+                archive.url, capture['timestamp'], mode,
+                capture.get('redirect') or capture['url'])
+            if capture.get('redirect'):
+                headers['X-Archive-Orig-Location'] = capture['redirect']
+            return self._send(status, b'', headers)
+
+        return self._send(status, capture['body'].encode(), headers)
@@ -0,0 +1,265 @@
+'''
+Figures script
+
+Renders the figures of the analysis and their data csv files in a batch,
+without a display (Agg backend). The aggregates behind every figure are
+computed once, in this process, from the aggregate cube; the figures are drawn
+in parallel worker processes. A figure is skipped when the hash of its
+aggregates is the one recorded in the manifest of the previous run and its
+files exist.
+
+Run from the src folder with a json configuration (see main):
+    python -m scripts.figures figures.json
+or from the notebook:
+    specs = figure_specs(df_pre, df_post, col_names, ctrl_terms, groups)
+    render_figures(specs)
+'''
+from multiprocessing import Pool
+from scripts import analysis
+import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import json
+import os
+import re
+
+# part of every figure hash, change it to render every figure again after a
+# change in the drawing code
+FIGURES_VERSION = 1
+MANIFEST = 'manifest.json'
+
+def department_file_name(department_name):
+    '''
+    Gets the name of a department in the figure csv file names
+    '''
+    return re.sub(r"[^a-zA-Z0-9]+", '', department_name)
+
+def figure_specs(df_pre, df_post, col_names, ctrl_terms, department_groups=None,
+                 tone=None, exclude=None, cube=None):
+    '''
+    Gets the figures of the analysis and the aggregates they are drawn from:
+        - fig1: absolute change by term (plot_bars)
+        - fig2: relative change by term (plot_bars)
+        - fig3: term counts by department (plot_dpt_changes)
+        - one figure per department group, e.g. fig4 and fig5: changes by
+            term in each department of the group (plot_changes_dept)
+        - fig6: subjectivity by department (plot_boxplot), if tone is given
+
+    Inputs:
+        - df_pre (df): pre dataframe, as returned by get_final_df
+        - df_post (df): post dataframe, as returned by get_final_df
+        - col_names (lst): list of term columns
+        - ctrl_terms (lst): control terms
+        - department_groups (dict): figure name -> list of departments
+        - tone (tuple): "pre" and "post" results of sentiment_analysis.get_tone
+        - exclude (str): department left out of fig3
+        - cube (AggregateCube): cube of df_pre and df_post (see get_cube)
+
+    Outputs:
+        - specs (lst): list of dicts with the figure "name", its "kind", its
+            "data" (csv file name -> dataframe) and the "departments" of a
+            department group
+    '''
+    cube = analysis.get_cube(df_pre, df_post, col_names, 'ttal', cube)
+    terms, totals = analysis.department_changes(df_pre, df_post, col_names,
+                                                'ttal', ctrl_terms, cube)
+    counts, ttal = cube.slice(terms=col_names)
+    abs_changes = (counts[:, 1] - counts[:, 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_changes = ((counts[:, 1] / ttal[1]) / (counts[:, 0] / ttal[0]) - 1) * 100
+    specs = []
+    for name, changes in [('fig1', abs_changes), ('fig2', rel_changes)]:
+        df = pd.DataFrame({'term': col_names, 'change': changes})
+        df = df.dropna().sort_values('change', kind='mergesort')
+        df = df[df.change != 0].reset_index(drop=True)
+        specs.append({'name': name, 'kind': 'bars',
+                      'data': {name + '_data.csv': df}})
+
+    if exclude:
+        totals = totals[totals.department != exclude]
+    ordered_df = totals.sort_values(by='pre')[['department', 'pre', 'post', 'change']]
+    specs.append({'name': 'fig3', 'kind': 'dpt_changes',
+                  'data': {'fig3_data.csv': ordered_df}})
+
+    terms = terms[terms.change != 0].sort_values('change', kind='mergesort')
+    for name, departments in (department_groups or {}).items():
+        data = {}
+        for department_name in departments:
+            df = terms[terms.department == department_name][['term', 'change']]
+            data['{}_{}.csv'.format(name, department_file_name(department_name))] = df
+        specs.append({'name': name, 'kind': 'changes_dept', 'data': data,
+                      'departments': list(departments)})
+
+    if tone is not None:
+        tone_pre, tone_post = [pd.DataFrame(data) for data in tone]
+        df_boxplot = pd.concat([tone_pre.assign(time='pre'),
+                                tone_post.assign(time='post')],
+                               ignore_index=True)
+        specs.append({'name': 'fig6', 'kind': 'boxplot',
+                      'data': {'fig6.csv': df_boxplot}})
+
+    return specs
+
+def figure_hash(spec):
+    '''
+    Gets the hash of a figure: its kind, departments and the csv of its
+    aggregates
+    '''
+    digest = hashlib.sha256()
+    digest.update(json.dumps([FIGURES_VERSION, spec['name'], spec['kind'],
+                              spec.get('departments')]).encode())
+    for file_name, df in sorted(spec['data'].items()):
+        digest.update(file_name.encode())
+        digest.update(df.to_csv().encode())
+
+    return digest.hexdigest()
+
+def figure_files(spec, output_dir):
+    '''
+    Gets the paths of the image and csv files of a figure
+    '''
+    return [os.path.join(output_dir, spec['name'] + '.png')] + \
+           [os.path.join(output_dir, file_name) for file_name in spec['data']]
+
+def draw(spec, output_dir):
+    '''
+    Draws a figure and writes its data csv files
+    '''
+    plt, sns = analysis._pyplot()
+    save_name = os.path.join(output_dir, spec['name'] + '.png')
+    data = spec['data']
+    for file_name, df in data.items():
+        df.to_csv(os.path.join(output_dir, file_name))
+    if spec['kind'] == 'bars':
+        analysis.plot_bars(next(iter(data.values())), 'term', 'change', save_name)
+    elif spec['kind'] == 'dpt_changes':
+        analysis.draw_dpt_changes(next(iter(data.values())), save_name)
+    elif spec['kind'] == 'changes_dept':
+        changes = {department_name: df for department_name, df in
+                   zip(spec['departments'], data.values())}
+        analysis.draw_changes_dept(changes, spec['departments'], save_name)
+    elif spec['kind'] == 'boxplot':
+        analysis.draw_boxplot(next(iter(data.values())), save_name)
+    else:
+        raise ValueError('Unknown figure kind: {}'.format(spec['kind']))
+    plt.close('all')
+
+def _init_worker():
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+    except ImportError: # reported by draw, a failing initializer hangs the pool
+        pass
+
+def _draw(args):
+    spec, output_dir = args
+    try:
+        draw(spec, output_dir)
+    except Exception as e:
+        return spec['name'], repr(e)
+    return spec['name'], None
+
+def render_figures(specs, output_dir='images', processes=None, force=False):
+    '''
+    Renders the figures whose aggregates changed since the last run.
+
+    Inputs:
+        - specs (lst): figures as returned by figure_specs
+        - output_dir (str): folder of the image and csv files and of the
+            manifest with the hash of every rendered figure
+        - processes (int): number of worker processes, defaults to the
+            number of cores. With processes=1 figures are drawn in this
+            process (with the Agg backend)
+        - force (bool): whether to render every figure
+
+    Outputs:
+        - statuses (dict): figure name -> 'rendered', 'skipped' or the error
+            raised while drawing it
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_name = os.path.join(output_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_name):
+        with open(manifest_name) as f:
+            manifest = json.load(f)
+    hashes = {spec['name']: figure_hash(spec) for spec in specs}
+    statuses = {}
+    todo = []
+    for spec in specs:
+        if not force and manifest.get(spec['name']) == hashes[spec['name']] and \
+           all(os.path.exists(path) for path in figure_files(spec, output_dir)):
+            statuses[spec['name']] = 'skipped'
+        else:
+            todo.append(spec)
+
+    results = []
+    if todo and (processes == 1 or len(todo) == 1):
+        import matplotlib.pyplot as plt
+        backend = plt.get_backend()
+        plt.switch_backend('Agg')
+        try:
+            results = [_draw((spec, output_dir)) for spec in todo]
+        finally:
+            plt.switch_backend(backend)
+    elif todo:
+        with Pool(processes, initializer=_init_worker) as pool:
+            results = pool.map(_draw, [(spec, output_dir) for spec in todo],
+                               chunksize=1)
+    for name, error in results:
+        statuses[name] = error or 'rendered'
+        if error is None:
+            manifest[name] = hashes[name]
+        else:
+            manifest.pop(name, None)
+    with open(manifest_name, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    return statuses
+
+def main():
+    '''
+    Renders the figures described in a json configuration with the keys:
+        - output_file (str): "root name" of the outputs of get_output
+        - department_file (str): path to file with department names and ids
+        - one_word_terms (lst), multi_word_terms (lst), ctrl_terms (lst)
+        - exclude_ids (lst): ids left out of the analysis (optional)
+        - department_groups (dict): figure name -> list of departments
+            (optional)
+        - exclude (str): department left out of fig3 (optional)
+        - tone (bool): whether to draw fig6, which needs the visible text
+            (optional)
+    '''
+    parser = argparse.ArgumentParser(description='Renders the figures')
+    parser.add_argument('config', help='json file with the figure configuration')
+    parser.add_argument('--output-dir', default='images')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--force', action='store_true',
+                        help='render every figure, even if it did not change')
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+
+    df_pre, df_post, col_names = analysis.load_final_df(
+        config['department_file'], config['multi_word_terms'],
+        config['one_word_terms'], config['output_file'],
+        text=config.get('tone', False))
+    exclude_ids = config.get('exclude_ids', [])
+    df_pre = df_pre[~df_pre.id.isin(exclude_ids)]
+    df_post = df_post[~df_post.id.isin(exclude_ids)]
+    tone = None
+    if config.get('tone'):
+        from scripts import sentiment_analysis
+        tone = (sentiment_analysis.get_tone(df_pre, args.processes),
+                sentiment_analysis.get_tone(df_post, args.processes))
+    specs = figure_specs(df_pre, df_post, col_names, config['ctrl_terms'],
+                         config.get('department_groups'), tone,
+                         config.get('exclude'))
+    statuses = render_figures(specs, args.output_dir, args.processes,
+                              args.force)
+    for name, status in statuses.items():
+        print('{}: {}'.format(name, status))
+
+
+if __name__ == '__main__':
+    main()
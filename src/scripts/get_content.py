@@ -1,27 +1,45 @@
 '''
 Extract content script
+
+Heavy dependencies (BeautifulSoup, pandas, selenium, the NLTK
+stopwords corpus) are imported by the functions that use them, so that
+importing this module stays cheap for worker processes.
 '''
-from tqdm import tqdm_notebook as tqdm
+from scripts import instrumentation
+from scripts import cdx_planner
 from scripts import internetarchive
-from nltk.corpus import stopwords
-from nltk.collocations import *
-from datetime import datetime
-from bs4 import BeautifulSoup
-import savepagenow
-import pandas as pd
+from scripts import tokenizer
+from scripts import counting
+from scripts import shards
+from scripts import utils
+from scripts import surt
+from datetime import datetime, timedelta
+from contextlib import nullcontext
 import requests
+import bisect
 import pickle
-import numpy
-import nltk
+import copy
 import time
 import csv
 import re
 
 #nltk.download('stopwords')
 
-default_stopwords = set(nltk.corpus.stopwords.words('english'))
-all_stopwords = default_stopwords
-#download nltk
+VIABLE_STATUS_CODES = ['200', '-'] #, '301'
+PERMANENT_FAILURES = [404, 410] # memento status codes that end the analysis
+
+def __getattr__(name):
+    '''
+    Loads the NLTK stopwords corpus the first time default_stopwords or
+    all_stopwords is used
+    '''
+    if name in ('default_stopwords', 'all_stopwords'):
+        from nltk.corpus import stopwords
+        global default_stopwords, all_stopwords
+        default_stopwords = set(stopwords.words('english'))
+        all_stopwords = default_stopwords
+        return default_stopwords
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
 
 ################################################################################
 # Main functions for extracting content ########################################
@@ -47,6 +65,7 @@ class Snapshot:
                     'word_count': None}
         self.status = None
         self.exception = None
+        self.stats = instrumentation.StageStats()
 
     def instantiate_object(self, pre_date, post_date):
         '''
@@ -58,15 +77,8 @@ class Snapshot:
         try:
             dict_urls = {'pre': self.pre, 'post': self.post}
             for key, obj in dict_urls.items():
-                url = obj['url']
-                visible_text = get_visible_txt(url)
-                #print(visible_text)
-                # initialize list to store term count results
-                row = [0] * len(self._terms)
-                # count instances on page for each term
-                for idx_t, term in enumerate(self._terms):
-                    tally, ttal = term_counter(term, visible_text)
-                    row[idx_t] = tally
+                visible_text, row, ttal = count_memento(obj['url'], self._terms,
+                                                        self.stats)
                 if self.store_text:
                     obj['text'] = visible_text
                 obj['results'] = row
@@ -79,12 +91,17 @@ class Snapshot:
         except Exception as e:
             self.status = 'failed'
             self.exception = e
-            self.pre['results'] = row
-            self.post['results'] = row
+            # no partial counts, the url is left out of both matrices
+            for obj in [self.pre, self.post]:
+                obj['results'] = None
+                obj['word_count'] = None
         self._terms = None #flush variable
 
 
-def get_output(input_file, output_file, terms, dates_1, dates_2, store_text=True):
+def get_output(input_file, output_file, terms, dates_1, dates_2, store_text=True,
+               index=None, capture_queue=None, trace_file=None, report=False,
+               bulk_cdx=False, dedupe=False, negative_cache=None, cube=None,
+               shard=None):
     '''
     Counts the ocurrence of terms in a website before and after two specified
     date ranges. Stores information about the url into Snapshot objects. By
@@ -100,130 +117,571 @@ def get_output(input_file, output_file, terms, dates_1, dates_2, store_text=True
             [year_from, month_from, day_from, year_to, month_to, day_to]
         - store_text (bool): indicates whether visible text should be stored
             or not
+        - index (TextIndex): if given, the visible text of every snapshot is
+            added to this index as it is fetched (requires store_text)
+        - capture_queue (CaptureQueue): if given, every url is added to this
+            queue to save its current state with savepagenow in the background.
+            The queue is closed once every url is counted.
+        - trace_file (str): if given, path of a JSONL file with the timings
+            and counters of every url (see instrumentation.RunTrace)
+        - report (bool): whether to print a report of the time spent in each
+            stage at the end (see instrumentation.RunTrace)
+        - bulk_cdx (bool): whether to look up versions with a few CDX scans
+            of groups of urls with the same host and path prefix (see
+            cdx_planner) instead of two CDX requests per url
+        - dedupe (bool): whether urls with the same SURT key (http/https,
+            www. or trailing slash variants) are fetched only once, their
+            results are copied to every duplicate. Off by default, as
+            variants may resolve to different content
+        - negative_cache (NegativeCache): if given, urls with a cached
+            permanent failure are skipped, new permanent failures are added
+            and the cache is saved at the end
+        - cube (AggregateCube): if given, the counts of every snapshot are
+            added to this cube as it is fetched (see cube.AggregateCube)
+        - shard (tuple): (shard, number of shards), if given only the urls of
+            this shard are crawled (see shards.shard_of) and the outputs are
+            named by shards.shard_name, to be combined with shards.merge.
+            Ids are still positions in the input file.
 
     Outputs:
         - {output_file}_pre.csv: csv file with counts "pre" matrix
         - {output_file}_pre.csv: csv file with counts "post" matrix
+        - {output_file}_data.csv: csv file with the word counts, dates and
+            urls of every snapshot, read by analysis.load_final_df
         - snapshots.txt: pickle file with Snapshot objects
+        - a report of the time spent in each stage, printed at the end
+            if report
     '''
-    snapshot_lst = [] # saves snapshots to the dump into pickle file
+    from tqdm.auto import tqdm
     data = read_csv(input_file)
-    # set up columns for csv output
-    col_names = ['url', 'date', 'wayback_url'] + terms
+    urls = [elmt[0] for elmt in data] # grab urls
+    if dedupe: # variants of the same url are only fetched once
+        unique_urls, positions = surt.dedupe(urls)
+    else:
+        unique_urls, positions = urls, [[i] for i in range(len(urls))]
+    if shard is not None: # variants of a url are always in the same shard
+        selected = [idx_u for idx_u, url in enumerate(unique_urls)
+                    if shards.shard_of(url, shard[1]) == shard[0]]
+        unique_urls = [unique_urls[idx_u] for idx_u in selected]
+        positions = [positions[idx_u] for idx_u in selected]
+        output_file = shards.shard_name(output_file, *shard)
+    snapshot_lst = [None] * len(urls) # saves snapshots to the dump into pickle file
     # list of lists to store heterogenous data
     matrix_pre = [[] for i in range(len(data))]
     matrix_post = [[] for i in range(len(data))] # urls restricted by matrix pre
+    trace = instrumentation.run_trace(trace_file, report)
+    plan = None
+    if bulk_cdx:
+        plan = cdx_planner.scan(unique_urls, [dates_1, dates_2])
 
-    len_data = len(data)
-    idx_e = 0
-    for elmt in tqdm(data, desc='progress: '):
-        #print('in tqdm loop')
-        current_url = elmt[0] # grab url
-        #print(current_url)
-        #print(current_url)
-        try:
-            with internetarchive.WaybackClient() as client:
-                # save current state as you go
-                archive_url, captured = savepagenow.capture_or_cache(current_url)
-                #print(archive_url)
-                # fetch all wayback instances within the date-ranges
-                pre_dump = client.list_versions(current_url,
-                                            from_date=datetime(dates_1[0],
-                                                               dates_1[1],
-                                                               dates_1[2]),
-                                            to_date=datetime(dates_1[3],
-                                                             dates_1[4],
-                                                             dates_1[5]))
-                post_dump = client.list_versions(current_url,
-                                            from_date=datetime(dates_2[0],
-                                                               dates_2[1],
-                                                               dates_2[2]),
-                                            to_date=datetime(dates_2[3],
-                                                             dates_2[4],
-                                                             dates_2[5]))
-                try:
-                    status_codes = ['200', '-'] #, '301'
-                    post_versions = list(post_dump)[::-1]
-                    for i_post, current_version in enumerate(post_versions):
-                        #print('in first for loop')
-                        # get most recent viable version of post
-                        if any(current_version.status_code == code for code in status_codes):
-                            current_url = current_version.raw_url #switch to IAWM version
-                            pre_versions = list(pre_dump)[::-1]
-                            for i_pre, latest_version in enumerate(pre_versions):
-                                #print('in second for loop')
-                                # get most recent viable version of pre
-                                if any(latest_version.status_code == code for code in status_codes):
-                                    # found the latest viable version for both timeframes
-                                    wayback_url = latest_version.raw_url # get the archive's url
-                                    snapshot = Snapshot(idx_e + 1, current_url, wayback_url, terms, store_text)
-                                    snapshot.instantiate_object(latest_version.date, current_version.date)
-                                    matrix_post[idx_e] = snapshot.post['results']
-                                    matrix_pre[idx_e] = snapshot.pre['results']
-                                    #print('success')
-                                    break
-                                elif i_pre == len(pre_versions) - 1:
-                                    # not able to retrieve both viable versions succesfully
-                                    snapshot = Snapshot(idx_e + 1, current_url, None, terms, store_text)
-                                    snapshot.status = 'failed'
-                                    snapshot.exception = latest_version.status_code
-                                    row = [None] * len(terms) # update matrix with Nones
-                                    matrix_pre[idx_e] = row
-                                    matrix_post[idx_e] = row
-                                    #print('no viable pre post pair')
-                                else:
-                                    #print('continue searching pre version')
-                                    # still searching pre version
-                                    continue
-                            #print('breaking from pre and post loops')
-                            break
-                        elif i_post == len(post_versions) - 1:
-                            # unsuccesful search of viable post
-                            snapshot = Snapshot(idx_e + 1, current_url, None, terms, store_text)
-                            snapshot.status = 'failed'
-                            snapshot.exception = latest_version.status_code
-                            row = [None] * len(terms) # update matrix with Nones
-                            matrix_pre[idx_e] = row
-                            matrix_post[idx_e] = row
-                            #print('no viable post')
-                        else:
-                            # still searching post version
-                            #print('continue searching post version')
-                            continue
-                            #print('outside second loop')
-                except Exception as e: # unparseable format
-                    snapshot = Snapshot(idx_e + 1, current_url, None, terms, store_text)
-                    snapshot.status = 'failed'
-                    snapshot.exception = e
-                    row = [None] * len(terms) # update matrix with Nones
-                    matrix_pre[idx_e] = row
-                    matrix_post[idx_e] = row
-                    #print('e1:', e)
-        except Exception as e: # no wayback url
-            snapshot = Snapshot(idx_e + 1, current_url, None, terms, store_text)
-            snapshot.status = 'failed'
-            snapshot.exception = e
-            row = [None] * len(terms) # update matrix with Nones
-            matrix_pre[idx_e] = row
-            matrix_post[idx_e] = row
-            #print('e2:', e)
-
-        snapshot_lst.append(snapshot)
-        idx_e += 1
-
-        print(idx_e, len(snapshot_lst))
-        print(snapshot.id)
-        print(snapshot.post['url'])
-        print(snapshot.pre['url'])
-        print(snapshot.post['results'])
-        print(snapshot.post['text'])
-        print('***********')
-
+    captures = capture_queue if capture_queue is not None else nullcontext()
+    try:
+        with captures: # closed at the end, after the pending captures
+            for idx_u, current_url in enumerate(tqdm(unique_urls, desc='progress: ')):
+                first = positions[idx_u][0]
+                original = get_snapshot(first + 1, current_url, terms, dates_1,
+                                        dates_2, store_text, capture_queue, plan,
+                                        negative_cache)
+                for idx_e in positions[idx_u]:
+                    snapshot = original
+                    if idx_e != first: # fan out to the duplicates
+                        snapshot = duplicate_snapshot(original, idx_e + 1,
+                                                      current_url, urls[idx_e])
+                    if snapshot.pre['results'] is None:
+                        row = [None] * len(terms) # update matrix with Nones
+                        matrix_pre[idx_e] = row
+                        matrix_post[idx_e] = row
+                    else:
+                        matrix_pre[idx_e] = snapshot.pre['results']
+                        matrix_post[idx_e] = snapshot.post['results']
+                    snapshot_lst[idx_e] = snapshot
+                    if index is not None:
+                        index.add_snapshot(snapshot)
+                    if cube is not None:
+                        cube.add_snapshot(snapshot)
+                    trace.record(snapshot, urls[idx_e])
+    finally:
+        trace.close()
 
+    if shard is not None: # only the rows of the shard, in input order
+        rows = sorted(idx_e for group in positions for idx_e in group)
+        matrix_pre = [matrix_pre[idx_e] for idx_e in rows]
+        matrix_post = [matrix_post[idx_e] for idx_e in rows]
+        snapshot_lst = [snapshot_lst[idx_e] for idx_e in rows]
     save_csv(matrix_pre, output_file,'_pre')
     save_csv(matrix_post, output_file,'_post')
+    save_data(snapshot_lst, output_file)
     with open('outputs/snapshots_{}.txt'.format(output_file), "wb") as fp:
         pickle.dump(snapshot_lst, fp) #pickling
+    trace.report()
+    if negative_cache is not None:
+        negative_cache.save()
+        negative_cache.report()
+    if plan is not None:
+        plan.report()
+    if capture_queue is not None:
+        capture_queue.report()
+
+def duplicate_snapshot(snapshot, id, url, duplicate_url):
+    '''
+    Copies the Snapshot of a url for another input url with the same SURT key
+
+    Inputs:
+        - snapshot (Snapshot): Snapshot of url
+        - id (int): id of the duplicate (position in the input file)
+        - url (str): url of the snapshot
+        - duplicate_url (str): input url of the duplicate
+
+    Outputs:
+        - duplicate (Snapshot): copy of snapshot with its own id
+    '''
+    duplicate = copy.copy(snapshot)
+    duplicate.id = id
+    duplicate.pre = dict(snapshot.pre)
+    duplicate.post = dict(snapshot.post)
+    if duplicate.post['url'] == url: # no wayback version, keep the input url
+        duplicate.post['url'] = duplicate_url
+    duplicate.stats = instrumentation.StageStats()
+    duplicate.stats.count('duplicates')
+
+    return duplicate
+
+def find_versions(client, url, dates, plan=None):
+    '''
+    Lists the wayback versions of a url within a date range, most recent
+    first.
+
+    Inputs:
+        - client (WaybackClient): client used for the CDX search
+        - url (str): url to look for
+        - dates (lst): date range formatted as
+            [year_from, month_from, day_from, year_to, month_to, day_to]
+        - plan (CdxPlan): if given and the url is in it, versions are taken
+            from the plan instead of a CDX request
+
+    Outputs:
+        - versions (lst): list of CdxRecord, raises ValueError if there are
+            none
+    '''
+    if plan is not None and url in plan:
+        return plan.versions(url, dates)
+    return list(client.list_versions(url,
+                                     from_date=datetime(*dates[:3]),
+                                     to_date=datetime(*dates[3:6])))[::-1]
+
+def latest_viable(versions):
+    '''
+    Gets the first viable version (status 200 or a revisit of one) of a list
+    of versions, or None
+    '''
+    for version in versions:
+        if version.status_code in VIABLE_STATUS_CODES:
+            return version
+    return None
+
+def failed_snapshot(id, url, terms, store_text, exception):
+    '''
+    Builds the Snapshot of a url whose content could not be retrieved
+    '''
+    snapshot = Snapshot(id, url, None, terms, store_text)
+    snapshot.status = 'failed'
+    snapshot.exception = exception
+
+    return snapshot
+
+def get_snapshot(id, url, terms, dates_1, dates_2, store_text=True,
+                 capture_queue=None, plan=None, negative_cache=None):
+    '''
+    Gets the Snapshot of a url: finds the most recent viable versions in both
+    date ranges and counts terms in them. The time spent in each stage and the
+    requests made are kept in snapshot.stats.
+
+    Inputs:
+        - id (int): id of the url (position in the input file)
+        - url (str): url to analyze
+        - terms (lst): list of terms to be looked for
+        - dates_1 (lst): "pre" date range (see get_output)
+        - dates_2 (lst): "post" date range (see get_output)
+        - store_text (bool): whether visible text should be stored
+        - capture_queue (CaptureQueue): if given, the url is added to this
+            queue to be captured in the background
+        - plan (CdxPlan): versions found by bulk CDX scans (see find_versions)
+        - negative_cache (NegativeCache): cache of urls with a permanent
+            failure, checked before and updated after the lookup
+
+    Outputs:
+        - snapshot (Snapshot): the Snapshot object, with status 'failed' if
+            no viable pair of versions was found
+    '''
+    stats = instrumentation.StageStats()
+    if negative_cache is not None:
+        entry = negative_cache.get(url, dates_1, dates_2)
+        if entry is not None: # known to fail, no network work
+            snapshot = failed_snapshot(id, url, terms, store_text,
+                                       entry['exception'])
+            stats.count('negative_cache_hits')
+            snapshot.stats = stats
+            return snapshot
+    requests_before = utils.get_request_counts()
+    if capture_queue is not None: # save current state as you go
+        capture_queue.put(url)
+    try:
+        with internetarchive.WaybackClient() as client:
+            # get most recent viable version of post
+            with stats.stage('cdx'):
+                post_versions = find_versions(client, url, dates_2, plan)
+            stats.count('cdx_records', len(post_versions))
+            post_version = latest_viable(post_versions)
+            if post_version is None: # unsuccesful search of viable post
+                snapshot = failed_snapshot(id, url, terms, store_text,
+                                           post_versions[-1].status_code)
+            else:
+                post_url = post_version.raw_url #switch to IAWM version
+                # get most recent viable version of pre
+                with stats.stage('cdx'):
+                    pre_versions = find_versions(client, url, dates_1, plan)
+                stats.count('cdx_records', len(pre_versions))
+                pre_version = latest_viable(pre_versions)
+                if pre_version is None:
+                    # not able to retrieve both viable versions succesfully
+                    snapshot = failed_snapshot(id, post_url, terms, store_text,
+                                               pre_versions[-1].status_code)
+                else:
+                    snapshot = Snapshot(id, post_url, pre_version.raw_url,
+                                        terms, store_text)
+                    snapshot.stats = stats
+                    snapshot.instantiate_object(pre_version.date,
+                                                post_version.date)
+    except Exception as e: # no wayback url or unparseable format
+        snapshot = failed_snapshot(id, url, terms, store_text, e)
+    snapshot.stats = stats
+    stats.update({name: value - requests_before.get(name, 0)
+                  for name, value in utils.get_request_counts().items()})
+    if negative_cache is not None and snapshot.status == 'failed':
+        negative_cache.add(url, dates_1, dates_2, snapshot.exception)
+
+    return snapshot
+
+################################################################################
+# Any number of date windows ###################################################
+################################################################################
+
+class WindowSnapshot:
+    '''
+    Snapshot object that represents a given url in any number of date windows.
+    Each window is a dict like Snapshot.pre and Snapshot.post.
+    '''
+    def __init__(self, id, url, n_windows):
+        self.id = id
+        self.url = url
+        self.windows = [{'url': None,
+                         'text': None,
+                         'results': None,
+                         'date': None,
+                         'word_count': None} for i in range(n_windows)]
+        self.status = None
+        self.exception = None
+        self.stats = instrumentation.StageStats()
+
+
+def window_label(dates):
+    '''
+    Gets the name of a date window in the output file names
+
+    Example: [2016, 1, 1, 2016, 12, 31] -> '20160101-20161231'
+    '''
+    return '{:04d}{:02d}{:02d}-{:04d}{:02d}{:02d}'.format(*dates[:6])
+
+def window_range(dates):
+    '''
+    Gets the (from, to) datetimes of a date window
+    '''
+    return datetime(*dates[:3]), datetime(*dates[3:6])
+
+def yearly_windows(year_from, year_to, month=1, day=1, days=31):
+    '''
+    Gets one date window per year starting on the same day of every year,
+    e.g. yearly_windows(2016, 2026) for yearly checkpoints in January
+
+    Outputs:
+        - windows (lst): list of [year_from, month_from, day_from, year_to,
+            month_to, day_to] date ranges
+    '''
+    windows = []
+    for year in range(year_from, year_to + 1):
+        end = datetime(year, month, day) + timedelta(days=days - 1)
+        windows.append([year, month, day, end.year, end.month, end.day])
+
+    return windows
+
+def window_versions(client, url, windows, plan=None, collapse='timestamp:8'):
+    '''
+    Lists the wayback versions of a url over the union of date windows with
+    one streamed CDX search, oldest first.
+
+    Unlike find_versions, captures are not collapsed by digest: a page that
+    did not change would only keep its first capture and look missing from
+    the later windows. One capture per day (collapse='timestamp:8') keeps the
+    scan small over many years.
+
+    Inputs:
+        - client (WaybackClient): client used for the CDX search
+        - url (str): url to look for
+        - windows (lst): list of date ranges formatted as
+            [year_from, month_from, day_from, year_to, month_to, day_to]
+        - plan (CdxPlan): if given and the url is in it, versions are taken
+            from the plan instead of a CDX request, collapsed the same way
+            (see collapse_records). Both keep html captures and revisits only
+            (see cdx_planner.SCAN_FILTER). The plan has no captures between
+            the windows, which latest_in_windows ignores anyway, so both
+            select the same versions for collapses by day or finer
+        - collapse (str): CDX collapse parameter, None for every capture
+
+    Outputs:
+        - versions (lst): list of CdxRecord
+    '''
+    if plan is not None and url in plan: # the same captures as the search
+        return collapse_records(plan.records.get(surt.surt(url), []), collapse)
+    ranges = [window_range(dates) for dates in windows]
+    versions = list(client.search(url, from_date=min(r[0] for r in ranges),
+                                  to_date=max(r[1] for r in ranges),
+                                  filter_field=cdx_planner.SCAN_FILTER,
+                                  collapse=collapse))
+    versions.sort(key=lambda version: version.timestamp)
+
+    return versions
+
+# CDX field -> CdxRecord attribute
+CDX_RECORD_FIELDS = {'urlkey': 'key', 'timestamp': 'timestamp',
+                     'original': 'url', 'mimetype': 'mime_type',
+                     'statuscode': 'status_code', 'digest': 'digest'}
+
+def collapse_records(records, collapse):
+    '''
+    Applies a CDX collapse parameter (e.g. 'timestamp:8') to a list of
+    CdxRecord of one url in timestamp order: keeps the first of every run of
+    records with the same value (or prefix) of the field
+    '''
+    if collapse is None:
+        return list(records)
+    field, _, length = collapse.partition(':')
+    attribute = CDX_RECORD_FIELDS[field]
+    length = int(length) if length else None
+    collapsed = []
+    previous = None
+    for record in records:
+        value = getattr(record, attribute)[:length]
+        if value != previous:
+            collapsed.append(record)
+        previous = value
+
+    return collapsed
+
+def latest_in_windows(versions, windows):
+    '''
+    Gets the latest viable version (see latest_viable) of each date window
+
+    Inputs:
+        - versions (lst): list of CdxRecord, oldest first
+        - windows (lst): list of date ranges (see window_versions)
+
+    Outputs:
+        - selected (lst): CdxRecord of each window, None if the window has
+            no viable version
+        - last (lst): latest version of each window, viable or not, None if
+            the window has no version
+    '''
+    dates = [version.date for version in versions]
+    selected = []
+    last = []
+    for from_date, to_date in map(window_range, windows):
+        in_window = versions[bisect.bisect_left(dates, from_date):
+                             bisect.bisect_right(dates, to_date)][::-1]
+        selected.append(latest_viable(in_window))
+        last.append(in_window[0] if in_window else None)
+
+    return selected, last
+
+def get_window_snapshot(id, url, terms, windows, store_text=True,
+                        capture_queue=None, plan=None, collapse='timestamp:8'):
+    '''
+    Gets the WindowSnapshot of a url: finds the most recent viable version in
+    every date window with one CDX search and counts terms in them. A capture
+    selected in several windows, or any capture with the same content digest,
+    is fetched and counted once.
+
+    Inputs:
+        - id (int): id of the url (position in the input file)
+        - url (str): url to analyze
+        - terms (lst): list of terms to be looked for
+        - windows (lst): list of date ranges (see get_output_windows)
+        - store_text (bool): whether visible text should be stored
+        - capture_queue (CaptureQueue): if given, the url is added to this
+            queue to be captured in the background
+        - plan (CdxPlan): versions found by bulk CDX scans
+        - collapse (str): CDX collapse parameter (see window_versions)
+
+    Outputs:
+        - snapshot (WindowSnapshot): the WindowSnapshot object, with status
+            'succesful' if every window was counted, 'partial' if some were
+            and 'failed' if none was. snapshot.exception is the last failure.
+    '''
+    snapshot = WindowSnapshot(id, url, len(windows))
+    stats = snapshot.stats
+    requests_before = utils.get_request_counts()
+    if capture_queue is not None: # save current state as you go
+        capture_queue.put(url)
+    try:
+        with internetarchive.WaybackClient() as client:
+            with stats.stage('cdx'):
+                versions = window_versions(client, url, windows, plan, collapse)
+        stats.count('cdx_records', len(versions))
+        if not versions:
+            raise internetarchive.NoVersionsError(
+                "Internet archive does not have archived versions of "
+                "{}".format(url))
+        selected, last = latest_in_windows(versions, windows)
+        fetched = {} # digest -> (visible_text, row, ttal) or exception
+        for obj, version, last_version in zip(snapshot.windows, selected, last):
+            if version is None: # no viable version in the window
+                if last_version is not None:
+                    snapshot.exception = last_version.status_code
+                continue
+            if version.digest in fetched: # same content as another window
+                stats.count('shared_captures')
+            else:
+                try:
+                    fetched[version.digest] = count_memento(version.raw_url,
+                                                            terms, stats)
+                except Exception as e:
+                    fetched[version.digest] = e
+            result = fetched[version.digest]
+            if isinstance(result, Exception):
+                snapshot.exception = result
+                continue
+            visible_text, row, ttal = result
+            if store_text:
+                obj['text'] = visible_text
+            obj['url'] = version.raw_url
+            obj['results'] = row
+            obj['date'] = str(version.date)
+            obj['word_count'] = ttal
+    except Exception as e: # no wayback url or unparseable format
+        snapshot.exception = e
+    counted = sum(obj['results'] is not None for obj in snapshot.windows)
+    if counted == len(windows):
+        snapshot.status = 'succesful'
+    elif counted:
+        snapshot.status = 'partial'
+    else:
+        snapshot.status = 'failed'
+    stats.update({name: value - requests_before.get(name, 0)
+                  for name, value in utils.get_request_counts().items()})
+
+    return snapshot
+
+def duplicate_window_snapshot(snapshot, id):
+    '''
+    Copies the WindowSnapshot of a url for another input url with the same
+    SURT key
+    '''
+    duplicate = copy.copy(snapshot)
+    duplicate.id = id
+    duplicate.windows = [dict(obj) for obj in snapshot.windows]
+    duplicate.stats = instrumentation.StageStats()
+    duplicate.stats.count('duplicates')
+
+    return duplicate
+
+def get_output_windows(input_file, output_file, terms, windows,
+                       store_text=False, capture_queue=None, trace_file=None,
+                       report=False, bulk_cdx=False, dedupe=False,
+                       collapse='timestamp:8'):
+    '''
+    Counts the ocurrence of terms in a website in any number of date windows,
+    e.g. yearly checkpoints (see yearly_windows). Each url is looked up with
+    one CDX search over the union of the windows, instead of one search per
+    window, and captures shared by several windows are fetched once.
+
+    Inputs:
+        - input_file (str): path to csv with urls
+        - output_file (str): "root name" of produced outputs
+        - terms (lst): list of terms to be looked for
+        - windows (lst): list of date ranges formatted as
+            [year_from, month_from, day_from, year_to, month_to, day_to]
+        - store_text (bool): indicates whether visible text should be stored
+            or not
+        - capture_queue (CaptureQueue): if given, every url is added to this
+            queue to save its current state with savepagenow in the background.
+            The queue is closed once every url is counted.
+        - trace_file (str): if given, path of a JSONL file with the timings
+            and counters of every url (see instrumentation.RunTrace)
+        - report (bool): whether to print a report of the time spent in each
+            stage at the end (see instrumentation.RunTrace)
+        - bulk_cdx (bool): whether to look up versions with a few CDX scans
+            of groups of urls with the same host and path prefix (see
+            cdx_planner)
+        - dedupe (bool): whether urls with the same SURT key are fetched only
+            once
+        - collapse (str): CDX collapse parameter (see window_versions)
+
+    Outputs:
+        - {output_file}_{window}.csv: csv file with counts matrix of each
+            window, named by window_label. Urls without a viable version in
+            the window have a row of Nones.
+        - {output_file}_windows.csv: csv file with the status of every url
+            and the word count, date and url of each window
+        - snapshots_{output_file}_windows.txt: pickle file with
+            WindowSnapshot objects
+        - a report of the time spent in each stage, printed at the end
+            if report
+    '''
+    from tqdm.auto import tqdm
+    data = read_csv(input_file)
+    urls = [elmt[0] for elmt in data] # grab urls
+    if dedupe: # variants of the same url are only fetched once
+        unique_urls, positions = surt.dedupe(urls)
+    else:
+        unique_urls, positions = urls, [[i] for i in range(len(urls))]
+    snapshot_lst = [None] * len(urls)
+    matrices = [[[] for i in range(len(data))] for dates in windows]
+    trace = instrumentation.run_trace(trace_file, report)
+    plan = None
+    if bulk_cdx: # scans of each group limited to the windows
+        plan = cdx_planner.scan(unique_urls, windows)
+
+    captures = capture_queue if capture_queue is not None else nullcontext()
+    try:
+        with captures: # closed at the end, after the pending captures
+            for idx_u, current_url in enumerate(tqdm(unique_urls, desc='progress: ')):
+                first = positions[idx_u][0]
+                original = get_window_snapshot(first + 1, current_url, terms,
+                                               windows, store_text, capture_queue,
+                                               plan, collapse)
+                for idx_e in positions[idx_u]:
+                    snapshot = original
+                    if idx_e != first: # fan out to the duplicates
+                        snapshot = duplicate_window_snapshot(original, idx_e + 1)
+                    for matrix, obj in zip(matrices, snapshot.windows):
+                        if obj['results'] is None:
+                            matrix[idx_e] = [None] * len(terms)
+                        else:
+                            matrix[idx_e] = obj['results']
+                    snapshot_lst[idx_e] = snapshot
+                    trace.record(snapshot, urls[idx_e])
+    finally:
+        trace.close()
+
+    for matrix, dates in zip(matrices, windows):
+        save_csv(matrix, output_file, '_' + window_label(dates))
+    save_window_data(snapshot_lst, output_file, windows)
+    with open('outputs/snapshots_{}_windows.txt'.format(output_file), "wb") as fp:
+        pickle.dump(snapshot_lst, fp) #pickling
+    trace.report()
+    if plan is not None:
+        plan.report()
+    if capture_queue is not None:
+        capture_queue.report()
 
 ################################################################################
 # Get links from usa.gov #######################################################
@@ -255,72 +713,94 @@ def gen_usagovsearch(terms, depth):
             page_num, search_str)
             urls.append(next_search)
 
+    import pandas as pd
     df = pd.DataFrame(urls, columns=["urls"])
     df.to_csv('inputs/usagovsearch_urls.csv', index=False)
 
     return urls
 
-def get_hrefs(urls):
+# links from usa.gov searches that are not federal webpages or not html
+STATES = ['alabama.', 'alaska.', 'az.', 'arkansas.', 'ca.', 'colorado.', 'ct.',
+          'delaware.', 'myflorida.', 'georgia.', 'hawaii.', 'illinois','in.',
+          'iowa.', 'kansas.', 'kentucky.', 'lousiana.', 'maine.', 'maryland.',
+          'mass.', 'michigan.', 'mn.', 'ms.', 'mo.', 'mt.', 'nebraska.', 'nv.',
+          'nh.', 'nj.', 'ny.', 'nc.', 'nd.', 'ohio.', 'ok.', 'oregon.', 'pa.',
+          'ri.', 'sc.', 'sd.', 'tn.', 'texas.', 'utah.', 'vermont.',
+          'virginia.', 'wa.', 'wv.', 'wisconsin.', 'wyo.', '.wi.']
+OTHER = ['nyc.', 'ma.', 'tx.', 'county', 'city', '.house.', 'smithsonian',
+         'usembassy', 'longbeach', '.dc.', 'phila', 'whitehouse', 'seattle',
+         '.loc.gov', 'fmcs', 'cabq', 'atlantaga', 'alexandriava', 'loudoun',
+         'fortlauderdale', 'nysed', 'nycourts']
+NOT_ACCEPTED = ['.pdf', '.doc', '.docx', '.rtf', 'news', 'blog', 'espanol',
+                'spanish', '.pptx'] + STATES + OTHER
+# a single matcher for all the rules, compiled once
+EXCLUDED_LINK = re.compile('|'.join(re.escape(x) for x in NOT_ACCEPTED))
+
+def accepted_link(link):
+    '''
+    Checks whether a (lowercase) link is a federal government webpage that
+    should be analyzed
+    '''
+    return '.gov' in link and EXCLUDED_LINK.search(link) is None
+
+def _page_hrefs(url, clients):
+    '''
+    Gets the accepted links of the latest version of a usa.gov search page,
+    with a WaybackClient taken from a queue of clients
+    '''
+    from bs4 import BeautifulSoup, SoupStrainer
+    from collections import deque
+    client = clients.get()
+    try:
+        # lookup the versions to scrape them because direct scrape fails
+        dump = client.list_versions(url,
+                                    from_date=datetime(2019, 8, 1),
+                                    to_date=datetime(2019, 8, 8))
+        latest_version = deque(dump, maxlen=1)[0] # newest, without a list
+        wayback_url = latest_version.raw_url
+        contents = client.session.get(wayback_url).content.decode()
+    finally:
+        clients.put(client)
+    soup = BeautifulSoup(contents, 'lxml', parse_only=SoupStrainer(id='results'))
+    soup = soup.find('div', {'id': 'results'})
+
+    return [link for link in (a['href'].lower() for a in soup.find_all('a', href=True))
+            if accepted_link(link)]
+
+def get_hrefs(urls, max_workers=8):
     '''
     Gets the urls from a given usa.gov search engine page and restricts them to
     federal government webpages to the extent possible, excluding some formats
-    like pdf, doc, ppt.
+    like pdf, doc, ppt. Search pages are fetched concurrently.
 
     Inputs:
         - urls (lst): list of strings
+        - max_workers (int): number of search pages fetched at the same time,
+            each worker reuses its own WaybackClient
 
     Outputs:
         - url_set (set): a set of unique urls
         - exceptions (lst): a list of any encountered exceptions
     '''
+    from concurrent.futures import ThreadPoolExecutor
+    import queue
     url_set = set()
     exceptions = []
-    for url in urls:
-        try:
-            with internetarchive.WaybackClient() as client:
-                # lookup the versions to scrape them because direct scrape fails
-                dump = client.list_versions(url,
-                                            from_date=datetime(2019,
-                                                               8,
-                                                               1),
-                                            to_date=datetime(2019,
-                                                             8,
-                                                             8))
-                latest_version = list(dump)[::-1][0]
-                wayback_url = latest_version.raw_url
-                #print(wayback_url)
-                wayback_date = latest_version.date
-                contents = requests.get(wayback_url).content.decode()
-                soup = BeautifulSoup(contents, 'lxml')
-                soup = soup.find('div', {'id': 'results'})
-                for a in soup.find_all('a', href=True):
-                    link = a['href'].lower()
-                    #print(link)
-                    states = ['alabama.', 'alaska.', 'az.', 'arkansas.', 'ca.',
-                              'colorado.', 'ct.', 'delaware.', 'myflorida.',
-                              'georgia.', 'hawaii.', 'illinois','in.', 'iowa.',
-                              'kansas.', 'kentucky.', 'lousiana.', 'maine.',
-                              'maryland.', 'mass.', 'michigan.', 'mn.', 'ms.',
-                              'mo.', 'mt.', 'nebraska.', 'nv.', 'nh.', 'nj.',
-                              'ny.', 'nc.', 'nd.', 'ohio.', 'ok.', 'oregon.',
-                              'pa.', 'ri.', 'sc.', 'sd.', 'tn.', 'texas.',
-                              'utah.', 'vermont.', 'virginia.', 'wa.', 'wv.',
-                              'wisconsin.', 'wyo.', '.wi.']
-                    other = ['nyc.', 'ma.', 'tx.', 'county', 'city', '.house.',
-                            'smithsonian', 'usembassy', 'longbeach', '.dc.',
-                            'phila', 'whitehouse', 'seattle', '.loc.gov', 'fmcs',
-                            'cabq', 'atlantaga', 'alexandriava', 'loudoun',
-                            'fortlauderdale', 'nysed', 'nycourts']
-                    not_accepted = ['.pdf', '.doc', '.docx', '.rtf',
-                                    'news', 'blog', 'espanol', 'spanish'
-                                    '.pptx'] + states + other
-                    if not any(element in link for element in not_accepted):
-                        if '.gov' in link: #only .gov links
-                            #print(wayback_date)
-                            url_set.add(link) #get rid of web.archive part
-        except Exception as e:
-            #print(e, url)
-            exceptions.append(url)
+    clients = queue.Queue()
+    for _ in range(max_workers):
+        clients.put(internetarchive.WaybackClient())
+    try:
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(_page_hrefs, url, clients) for url in urls]
+            for url, future in zip(urls, futures):
+                try:
+                    url_set.update(future.result())
+                except Exception as e:
+                    #print(e, url)
+                    exceptions.append(url)
+    finally:
+        while not clients.empty():
+            clients.get().close()
 
     return url_set, exceptions
 
@@ -328,26 +808,18 @@ def get_hrefs(urls):
 # HUD analysis functions #######################################################
 ################################################################################
 
-from selenium import webdriver
-from dateutil.parser import parse
-#import internetarchive
-import requests
-from os import path
-import csv
-import os
-import shutil
-from urllib.parse import urljoin
-import savepagenow
-
 def open_chrome(wayback_url, driver_path):
     '''
     '''
+    from selenium import webdriver
     browser = webdriver.Chrome(executable_path=driver_path)
     browser.get(wayback_url)
     return browser
 
 
 def get_urls(browser, analysis_from, analysis_to, output_name):
+    from tqdm import tqdm_notebook as tqdm
+    from dateutil.parser import parse
     # take all valid urls that existed
     stored_urls = []
     try:
@@ -398,6 +870,77 @@ def get_urls(browser, analysis_from, analysis_to, output_name):
     for row in stored_copy:
         row[0] = row[0][30:]
 
+WAYBACK_URLS_PREFIX = 'https://web.archive.org/web/*/' # links in the urls table
+
+def get_urls_cdx(host, analysis_from, analysis_to, output_name,
+                 match_type='prefix', mime_type='text/html', client=None):
+    '''
+    Gets the same [url, date_from, date_to] rows as get_urls, from the CDX
+    server instead of the Wayback Machine "URLs" table: html urls of a host
+    captured within the analysis window. date_from is the day of the first
+    capture of each url in the window and date_to the day of its last capture
+    with new content in the window (the urls table gives the first and last
+    capture to date).
+
+    Two streamed CDX queries are made, both limited to the window: the first
+    capture of every url (collapsed by urlkey), and its captures collapsed by
+    digest, of which the latest of each url is kept. CDX only collapses
+    adjacent lines, so a url whose captures all have the digest of the last
+    capture of the previous url keeps its first capture as date_to.
+
+    Inputs:
+        - host (str): host to enumerate, e.g. 'hud.gov'
+        - analysis_from (str or datetime): start of the analysis window
+        - analysis_to (str or datetime): end of the analysis window
+        - output_name (str): path of the output csv
+        - match_type (str): 'prefix' for the host, 'domain' to include its
+            subdomains
+        - mime_type (str): mime type of the captures to keep
+        - client (WaybackClient): client for the queries, a new one by default
+
+    Outputs:
+        - stored_urls (lst): list of [url, date_from, date_to], urls in the
+            'https://web.archive.org/web/*/{url}' format of the urls table
+    '''
+    if isinstance(analysis_from, str) or isinstance(analysis_to, str):
+        from dateutil.parser import parse
+        analysis_from = parse(analysis_from) if isinstance(analysis_from, str) else analysis_from
+        analysis_to = parse(analysis_to) if isinstance(analysis_to, str) else analysis_to
+    day = lambda date: datetime(date.year, date.month, date.day)
+    mime_filter = 'mimetype:{}'.format(re.escape(mime_type))
+    own_client = client is None
+    if own_client:
+        client = internetarchive.WaybackClient()
+    window = {'from_date': day(analysis_from),
+              'to_date': analysis_to + timedelta(days=1)}
+    try:
+        first = {} # urlkey -> first capture within the window
+        for record in client.search(host, matchType=match_type,
+                                    filter_field=mime_filter, collapse='urlkey',
+                                    **window):
+            first.setdefault(record.key, record)
+        last = {} # urlkey -> last capture with new content within the window
+        for record in client.search(host, matchType=match_type,
+                                    filter_field=mime_filter, collapse='digest',
+                                    **window):
+            if record.key not in last or \
+               record.timestamp > last[record.key].timestamp:
+                last[record.key] = record
+    finally:
+        if own_client:
+            client.close()
+    stored_urls = []
+    for key, record in first.items():
+        latest = max(record, last.get(key, record), key=lambda r: r.timestamp)
+        stored_urls.append([WAYBACK_URLS_PREFIX + record.url, day(record.date),
+                            day(latest.date)])
+
+    with open(output_name, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerows(stored_urls)
+
+    return stored_urls
+
 ################################################################################
 # Helper functions #############################################################
 ################################################################################
@@ -410,6 +953,83 @@ def save_csv(matrix, output_file, name):
         writer = csv.writer(f)
         writer.writerows(matrix)
 
+DATA_COLUMNS = ['id', 'status', 'ttal_pre', 'ttal_post', 'dates_pre',
+                'dates_post', 'url_pre', 'url_post']
+
+def save_data(snapshots, output_file):
+    '''
+    Saves the word counts, dates and urls of Snapshot objects into a csv file,
+    so that they can be loaded without unpickling the snapshots
+    '''
+    with open('outputs/' + output_file + '_data.csv', "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(DATA_COLUMNS)
+        writer.writerows([snapshot.id, snapshot.status,
+                          snapshot.pre['word_count'], snapshot.post['word_count'],
+                          snapshot.pre['date'], snapshot.post['date'],
+                          snapshot.pre['url'], snapshot.post['url']]
+                         for snapshot in snapshots if snapshot is not None)
+
+def fetch_visible_txt(url, stats):
+    '''
+    Fetches a wayback memento and gets its visible text (see
+    extract_visible_txt). The time spent in each stage and the bytes fetched
+    are added to stats. Raises MementoPlaybackError for permanent failures.
+    '''
+    with stats.stage('fetch'):
+        response = requests.get(url)
+        contents = response.content
+    stats.count('requests')
+    stats.count('bytes', len(contents))
+    if response.status_code in PERMANENT_FAILURES:
+        error = internetarchive.MementoPlaybackError(
+                'Memento at {} returned {}'.format(url, response.status_code))
+        error.status_code = response.status_code
+        raise error
+    with stats.stage('parse'):
+        visible_text = extract_visible_txt(contents.decode(), url)
+
+    return visible_text
+
+def count_memento(url, terms, stats):
+    '''
+    Fetches a wayback memento and counts terms in its visible text. The time
+    spent in each stage and the bytes fetched are added to stats.
+
+    Inputs:
+        - url (str): url of the memento
+        - terms (lst): list of terms to be looked for
+        - stats (StageStats): stats of the snapshot
+
+    Outputs:
+        - visible_text (lst): visible text of the memento
+        - row (lst): count of each term
+        - ttal (int): total number of words
+    '''
+    visible_text = fetch_visible_txt(url, stats)
+    # count instances on page for all terms
+    with stats.stage('count'):
+        row, ttal = counting.count_terms(visible_text, terms)
+
+    return visible_text, row, ttal
+
+def save_window_data(snapshots, output_file, windows):
+    '''
+    Saves the status of WindowSnapshot objects and the word count, date and
+    url of each of their windows into a csv file
+    '''
+    labels = [window_label(dates) for dates in windows]
+    header = ['id', 'status'] + ['{}_{}'.format(name, label)
+                                 for label in labels
+                                 for name in ['ttal', 'dates', 'url']]
+    with open('outputs/' + output_file + '_windows.csv', "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows([snapshot.id, snapshot.status] +
+                         [obj[key] for obj in snapshot.windows
+                          for key in ['word_count', 'date', 'url']]
+                         for snapshot in snapshots if snapshot is not None)
+
 def read_csv(input_file):
     '''
     Reads in a simple csv with a list of links
@@ -435,26 +1055,17 @@ def term_counter(term, visible_text):
 
     Attributions: based on EDGI's code
     '''
+    import nltk
     tally = 0
     ttal_words = 0
-    if not isinstance(term, list): #put single word strings into a list
-        term = [term]
-    term = [re.sub(r'[^\w\s]', '', x) for x in term]
-    length = len(term)
+    key = tokenizer.normalize_term(term)
+    length = len(key)
     for section in visible_text:
-        #print(visible_text)
-        tokens = nltk.word_tokenize(section) # tokenize
-        tokens = [x.lower() for x in tokens] # convert to lowercase
-        tokens = [re.sub(r'[^\w\s]', '', x) for x in tokens] # get rid of punctuation
-        tokens = [x for x in tokens if x != ''] # get rid of ''
-        grams = nltk.ngrams(tokens, 1)
-        all_words = [item[0] for item in grams]
-        ttal_words += len(all_words)
+        tokens = tokenizer.tokenize(section) # normalized tokens
+        ttal_words += len(tokens)
         if length >= 1:
-            grams = nltk.ngrams(tokens, length) # get ngrams
-        fdist = nltk.FreqDist(grams) # get frequency distribution
-        key = tuple([term[i].lower() for i in range(length)])
-        tally += fdist[key]
+            fdist = nltk.FreqDist(nltk.ngrams(tokens, length)) # get frequency distribution
+            tally += fdist[key]
 
     return tally, ttal_words
 
@@ -470,6 +1081,22 @@ def get_visible_txt(url):
         - body (lst): list of strings
     '''
     contents = requests.get(url).content.decode()
+
+    return extract_visible_txt(contents, url)
+
+def extract_visible_txt(contents, url=''):
+    '''
+    Gets visible text content from the html of a federal government department
+    page, removing headers, navigation, sidebars, footers and the like.
+
+    Inputs:
+        - contents (str): html of the page
+        - url (str): url of the page, used for department specific rules
+
+    Outputs:
+        - body (lst): list of strings
+    '''
+    from bs4 import BeautifulSoup
     contents = BeautifulSoup(contents, 'lxml')
     body = contents.find('body')
 
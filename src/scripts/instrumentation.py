@@ -0,0 +1,165 @@
+'''
+Instrumentation script
+
+Per-stage timers and counters for the crawl pipeline. Every Snapshot carries a
+StageStats object with the time spent in each stage (cdx, fetch, parse,
+count) and counters such as requests, retries and bytes fetched.
+RunTrace collects them over a run, prints an aggregate report with
+percentiles and, if given a file name, writes one JSON line per url.
+run_trace only builds one when a trace file or a report is asked for,
+otherwise the run gets a NullTrace and tracing adds no overhead.
+'''
+from contextlib import contextmanager
+import numpy as np
+import json
+import time
+
+PERCENTILES = [50, 90, 99]
+
+class StageStats:
+    '''
+    Timers (seconds per stage) and counters of one unit of work.
+    '''
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Adds the time spent in the body of the with statement to a stage
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + \
+                                 time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def update(self, counters):
+        '''
+        Adds a dict of counters
+        '''
+        for name, value in counters.items():
+            if value:
+                self.count(name, value)
+
+    def total(self):
+        return sum(self.timings.values())
+
+
+class RunTrace:
+    '''
+    Collects the StageStats of every url of a run.
+
+    Inputs:
+        - trace_file (str): if given, path of a JSONL file with one record per
+            url (id, url, status, timings and counters)
+    '''
+    def __init__(self, trace_file=None):
+        self.timings = {} # stage -> list of seconds
+        self.counters = {} # counter -> total
+        self.statuses = {}
+        self.n = 0
+        self._start = time.perf_counter()
+        self._fp = open(trace_file, 'w') if trace_file else None
+
+    def record(self, snapshot, url=None):
+        '''
+        Adds the stats of a Snapshot to the run
+        '''
+        stats = snapshot.stats
+        self.n += 1
+        self.statuses[snapshot.status] = self.statuses.get(snapshot.status, 0) + 1
+        for name, seconds in stats.timings.items():
+            self.timings.setdefault(name, []).append(seconds)
+        for name, value in stats.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self._fp is not None:
+            exception = snapshot.exception
+            self._fp.write(json.dumps({
+                'id': snapshot.id, 'url': url, 'status': snapshot.status,
+                'exception': None if exception is None else repr(exception),
+                'seconds': stats.total(), 'timings': stats.timings,
+                'counters': stats.counters}) + '\n')
+
+    def summary(self):
+        '''
+        Gets the aggregate statistics of the run.
+
+        Outputs:
+            - summary (dict): "urls", "seconds", "statuses", "counters" and
+                "stages" (stage -> dict with "total", "mean", "max" and a
+                "p{n}" key for each of PERCENTILES)
+        '''
+        stages = {}
+        for name, values in self.timings.items():
+            values = np.asarray(values)
+            stage = {'total': values.sum(), 'mean': values.mean(),
+                     'max': values.max()}
+            for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                stage['p{}'.format(p)] = value
+            stages[name] = {k: float(v) for k, v in stage.items()}
+
+        return {'urls': self.n,
+                'seconds': time.perf_counter() - self._start,
+                'statuses': dict(self.statuses),
+                'counters': dict(self.counters),
+                'stages': stages}
+
+    def report(self):
+        '''
+        Prints the aggregate statistics of the run
+        '''
+        summary = self.summary()
+        print('{} urls in {:.1f} s ({})'.format(
+              summary['urls'], summary['seconds'],
+              ', '.join('{} {}'.format(v, k) for k, v in summary['statuses'].items())))
+        header = ['total', 'mean'] + ['p{}'.format(p) for p in PERCENTILES] + ['max']
+        print('{:<10}'.format('stage') + ''.join('{:>10}'.format(h) for h in header))
+        for name, stage in summary['stages'].items():
+            print('{:<10}'.format(name) +
+                  ''.join('{:>10.3f}'.format(stage[h]) for h in header))
+        if summary['counters']:
+            print(', '.join('{}: {}'.format(k, v)
+                            for k, v in sorted(summary['counters'].items())))
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class NullTrace:
+    '''
+    Stands in for RunTrace when tracing is off, every method does nothing.
+    '''
+    def record(self, snapshot, url=None):
+        pass
+
+    def report(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run_trace(trace_file=None, report=False):
+    '''
+    Gets the trace of a run.
+
+    Inputs:
+        - trace_file (str): if given, path of a JSONL file with one record per
+            url
+        - report (bool): whether the aggregate report will be printed
+
+    Outputs:
+        - trace (RunTrace or NullTrace): a RunTrace if there is a trace file
+            or a report, otherwise a NullTrace
+    '''
+    if trace_file or report:
+        return RunTrace(trace_file)
+    return NullTrace()
@@ -18,6 +18,7 @@ from datetime import datetime
 from scripts import utils
 import hashlib
 import urllib.parse
+import os
 import re
 import requests
 
@@ -40,12 +41,25 @@ class SessionClosedError(WaybackException):
     ...
 
 
-CDX_SEARCH_URL = 'http://web.archive.org/cdx/search/cdx'
-ARCHIVE_RAW_URL_TEMPLATE = 'http://web.archive.org/web/{timestamp}id_/{url}'
-ARCHIVE_VIEW_URL_TEMPLATE = 'http://web.archive.org/web/{timestamp}/{url}'
+class NoVersionsError(WaybackException, ValueError):
+    # Raised by `list_versions` when there are no versions of a URL. It is a
+    # ValueError for code written against earlier versions.
+    ...
+
+
+ARCHIVE_ROOT = 'http://web.archive.org'
+# Set this environment variable to use another Wayback server, e.g. the local
+# stand-in server in `scripts.fake_archive`.
+ARCHIVE_ROOT_ENV = 'WAYBACK_ARCHIVE_ROOT'
+CDX_SEARCH_PATH = '/cdx/search/cdx'
+ARCHIVE_RAW_PATH_TEMPLATE = '/web/{timestamp}id_/{url}'
+ARCHIVE_VIEW_PATH_TEMPLATE = '/web/{timestamp}/{url}'
+CDX_SEARCH_URL = ARCHIVE_ROOT + CDX_SEARCH_PATH
+ARCHIVE_RAW_URL_TEMPLATE = ARCHIVE_ROOT + ARCHIVE_RAW_PATH_TEMPLATE
+ARCHIVE_VIEW_URL_TEMPLATE = ARCHIVE_ROOT + ARCHIVE_VIEW_PATH_TEMPLATE
 URL_DATE_FORMAT = '%Y%m%d%H%M%S'
 MEMENTO_URL_PATTERN = re.compile(
-    r'^http(?:s)?://web.archive.org/web/\d+(?:id_)?/(.+)$')
+    r'^http(?:s)?://[^/]+/web/\d+(?:id_)?/(.+)$')
 REDUNDANT_HTTP_PORT = re.compile(r'^(http://[^:/]+):80(.*)$')
 REDUNDANT_HTTPS_PORT = re.compile(r'^(https://[^:/]+):443(.*)$')
 
@@ -132,9 +146,19 @@ class WaybackClient:
     Parameters
     ----------
     session : :class:`requests.Session`, optional
+    archive_root : str, optional
+        Root URL of the Wayback server. Defaults to the value of the
+        ``WAYBACK_ARCHIVE_ROOT`` environment variable or to
+        ``http://web.archive.org``.
     """
-    def __init__(self, session=None):
+    def __init__(self, session=None, archive_root=None):
         self.session = session or WaybackSession()
+        root = (archive_root or os.environ.get(ARCHIVE_ROOT_ENV)
+                or ARCHIVE_ROOT).rstrip('/')
+        self.archive_root = root
+        self.cdx_search_url = root + CDX_SEARCH_PATH
+        self.raw_url_template = root + ARCHIVE_RAW_PATH_TEMPLATE
+        self.view_url_template = root + ARCHIVE_VIEW_PATH_TEMPLATE
 
     def __enter__(self):
         return self
@@ -262,7 +286,7 @@ class WaybackClient:
                 else:
                     final_query[key] = str(value).lower()
 
-        response = utils.retryable_request('GET', CDX_SEARCH_URL,
+        response = utils.retryable_request('GET', self.cdx_search_url,
                                            params=final_query,
                                            session=self.session)
         lines = response.iter_lines()
@@ -297,9 +321,9 @@ class WaybackClient:
             # automatically here.
             data = data._replace(
                 date=capture_time,
-                raw_url=ARCHIVE_RAW_URL_TEMPLATE.format(
+                raw_url=self.raw_url_template.format(
                     timestamp=data.timestamp, url=data.url),
-                view_url=ARCHIVE_VIEW_URL_TEMPLATE.format(
+                view_url=self.view_url_template.format(
                     timestamp=data.timestamp, url=data.url)
             )
             count += 1
@@ -342,8 +366,8 @@ class WaybackClient:
         ------
         UnexpectedResponseFormat
             If the CDX response was not parseable.
-        ValueError
-            If there were no versions of the given URL.
+        NoVersionsError
+            If there were no versions of the given URL (a ValueError).
 
         Examples
         --------
@@ -378,8 +402,8 @@ class WaybackClient:
                 yield version
 
         if not last_hashes:
-            raise ValueError("Internet archive does not have archived "
-                             "versions of {}".format(url))
+            raise NoVersionsError("Internet archive does not have archived "
+                                  "versions of {}".format(url))
 
     def timestamped_uri_to_version(self, dt, uri, *, url,
                                    maintainers=None, tags=None, view_url=None):
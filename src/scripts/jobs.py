@@ -0,0 +1,483 @@
+'''
+Jobs script
+
+Durable local queue of url jobs in a SQLite database, drained by any number of
+worker processes on one machine. A worker leases a few jobs at a time and
+renews the lease with heartbeats from a background thread while it counts
+them; the jobs of a worker that crashed are requeued when their lease expires.
+Every job is tried up to max_attempts times. The Snapshot of every finished
+job is kept in the database, so a crawl can be stopped and resumed, and its
+progress and throughput can be queried while it runs (from another shell or
+the notebook). export writes the same outputs as get_output.
+
+Run from the src folder with a json configuration (see main):
+    python -m scripts.jobs crawl crawl.json --workers 8
+    python -m scripts.jobs status crawl.json
+or from the notebook:
+    queue = JobQueue('outputs/counts_jobs.db')
+    queue.add(urls)
+    run_workers(queue.file_name, terms, dates_1, dates_2, processes=8)
+    export(queue.file_name, 'counts', terms)
+'''
+from multiprocessing import Pool
+from scripts import surt
+import threading
+import argparse
+import sqlite3
+import pickle
+import socket
+import json
+import time
+import os
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,  -- id of the url (position in the input file)
+    url TEXT NOT NULL,
+    positions TEXT NOT NULL, -- json list of [id, url] of the url and its variants
+    status TEXT NOT NULL DEFAULT 'pending', -- pending, leased, done or failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    result_status TEXT, -- status of the Snapshot
+    result BLOB -- pickled Snapshot
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+'''
+STATUSES = ['pending', 'leased', 'done', 'failed']
+
+def worker_name():
+    '''
+    Gets a name for the worker of this process
+    '''
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class JobQueue:
+    '''
+    Queue of url jobs in a SQLite database, safe to use from several
+    processes (each with its own JobQueue object).
+
+    Inputs:
+        - file_name (str): SQLite database file, created if needed
+        - lease_seconds (float): time a worker holds a job without a heartbeat
+            before it is requeued
+        - max_attempts (int): number of leases of a job before it is marked as
+            failed
+    '''
+    def __init__(self, file_name, lease_seconds=300, max_attempts=3):
+        self.file_name = file_name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit, transactions are opened explicitly
+        self._db = sqlite3.connect(file_name, timeout=60, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def _transaction(self, statements):
+        '''
+        Runs a function on the database in an immediate (write locked)
+        transaction and returns its result
+        '''
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(self._db)
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+        return result
+
+    def add(self, urls, dedupe=False):
+        '''
+        Adds a job for every url of an input list. With dedupe, variants of
+        a url (see surt.dedupe) are one job. Jobs already in the queue are
+        left as they are, so adding the same list again resumes the crawl.
+
+        Outputs:
+            - n (int): number of jobs added
+        '''
+        if dedupe:
+            unique_urls, positions = surt.dedupe(urls)
+        else:
+            unique_urls, positions = urls, [[i] for i in range(len(urls))]
+        rows = [(group[0] + 1, url, json.dumps([[i + 1, urls[i]] for i in group]))
+                for url, group in zip(unique_urls, positions)]
+
+        return self._transaction(lambda db: db.executemany(
+            'INSERT OR IGNORE INTO jobs (id, url, positions) VALUES (?, ?, ?)',
+            rows).rowcount)
+
+    def requeue_expired(self, now=None):
+        '''
+        Requeues the leased jobs whose lease expired (their worker crashed or
+        hung), or marks them as failed after max_attempts leases.
+
+        Outputs:
+            - n (int): number of requeued or failed jobs
+        '''
+        now = time.time() if now is None else now
+        def statements(db):
+            n = db.execute(
+                "UPDATE jobs SET status = 'failed', worker = NULL, finished = ?, "
+                "error = 'lease expired' WHERE status = 'leased' AND "
+                "lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts)).rowcount
+            return n + db.execute(
+                "UPDATE jobs SET status = 'pending', worker = NULL "
+                "WHERE status = 'leased' AND lease_until < ?", (now,)).rowcount
+
+        return self._transaction(statements)
+
+    def lease(self, worker, n=1, now=None):
+        '''
+        Leases up to n pending jobs, in id order, after requeueing the expired
+        leases.
+
+        Outputs:
+            - jobs (lst): (id, url) of the leased jobs
+        '''
+        now = time.time() if now is None else now
+        self.requeue_expired(now)
+        def statements(db):
+            jobs = db.execute("SELECT id, url FROM jobs WHERE status = 'pending' "
+                              "ORDER BY id LIMIT ?", (n,)).fetchall()
+            db.executemany(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1, started = ? WHERE id = ?",
+                [(worker, now + self.lease_seconds, now, id) for id, _ in jobs])
+            return jobs
+
+        return self._transaction(statements)
+
+    def heartbeat(self, worker, now=None):
+        '''
+        Renews the leases of every job held by a worker. Returns the number of
+        renewed leases.
+        '''
+        now = time.time() if now is None else now
+        return self._db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE status = 'leased' AND worker = ?",
+            (now + self.lease_seconds, worker)).rowcount
+
+    def complete(self, id, worker, snapshot, now=None):
+        '''
+        Stores the Snapshot of a leased job. Returns False if the worker lost
+        the lease (the job was requeued), in which case nothing is stored.
+        '''
+        now = time.time() if now is None else now
+        return self._db.execute(
+            "UPDATE jobs SET status = 'done', worker = NULL, finished = ?, "
+            "result_status = ?, result = ? WHERE id = ? AND worker = ? AND "
+            "status = 'leased'",
+            (now, snapshot.status, pickle.dumps(snapshot), id, worker)).rowcount == 1
+
+    def fail(self, id, worker, error, now=None):
+        '''
+        Gives back a leased job that raised an error: it is requeued, or
+        marked as failed after max_attempts leases.
+        '''
+        now = time.time() if now is None else now
+        return self._db.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' "
+            "ELSE 'pending' END, worker = NULL, error = ?, finished = ? "
+            "WHERE id = ? AND worker = ? AND status = 'leased'",
+            (self.max_attempts, error, now, id, worker)).rowcount == 1
+
+    def requeue(self, status='failed'):
+        '''
+        Sets the jobs with a status back to pending, with no attempts, e.g.
+        to retry the failed jobs. Returns the number of requeued jobs.
+        '''
+        return self._db.execute(
+            "UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL, "
+            "error = NULL WHERE status = ?", (status,)).rowcount
+
+    def progress(self, window=60, now=None):
+        '''
+        Gets the progress of the crawl.
+
+        Inputs:
+            - window (float): seconds over which the recent throughput is
+                measured
+
+        Outputs:
+            - progress (dict): number of jobs by status ("pending", "leased",
+                "done", "failed"), "jobs", "workers" (with a lease),
+                "results" (done jobs by Snapshot status), "urls_per_s" (since
+                the first lease), "recent_urls_per_s" (over the window) and
+                "eta_seconds"
+        '''
+        now = time.time() if now is None else now
+        db = self._db
+        progress = dict.fromkeys(STATUSES, 0)
+        progress.update(db.execute('SELECT status, COUNT(*) FROM jobs '
+                                   'GROUP BY status').fetchall())
+        progress['jobs'] = sum(progress[status] for status in STATUSES)
+        progress['workers'] = db.execute(
+            "SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'leased'").fetchone()[0]
+        progress['results'] = dict(db.execute(
+            "SELECT result_status, COUNT(*) FROM jobs WHERE status = 'done' "
+            "GROUP BY result_status").fetchall())
+        first, finished = db.execute(
+            "SELECT MIN(started), COUNT(*) FROM jobs WHERE status IN ('done', 'failed')"
+        ).fetchone()
+        recent = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN "
+                            "('done', 'failed') AND finished > ?",
+                            (now - window,)).fetchone()[0]
+        progress['urls_per_s'] = finished / (now - first) if first and now > first else 0.0
+        progress['recent_urls_per_s'] = recent / window
+        remaining = progress['pending'] + progress['leased']
+        rate = progress['recent_urls_per_s'] or progress['urls_per_s']
+        progress['eta_seconds'] = remaining / rate if rate else None
+
+        return progress
+
+    def report(self):
+        progress = self.progress()
+        print('jobs: {} of {} done, {} failed, {} leased by {} workers, '
+              '{:.2f} urls/s ({:.2f} recent){}'.format(
+              progress['done'], progress['jobs'], progress['failed'],
+              progress['leased'], progress['workers'], progress['urls_per_s'],
+              progress['recent_urls_per_s'],
+              '' if progress['eta_seconds'] is None else
+              ', {:.0f} s left'.format(progress['eta_seconds'])))
+
+    def results(self):
+        '''
+        Iterates over the jobs in id order.
+
+        Outputs:
+            - (id, url, positions, status, error, snapshot) of every job:
+                positions are the [id, url] of the url and its variants,
+                snapshot is None unless it is done
+        '''
+        for id, url, positions, status, error, result in self._db.execute(
+                'SELECT id, url, positions, status, error, result FROM jobs '
+                'ORDER BY id'):
+            yield (id, url, json.loads(positions), status, error,
+                   None if result is None else pickle.loads(result))
+
+################################################################################
+# Workers ######################################################################
+################################################################################
+
+class _Heartbeat:
+    '''
+    Renews the leases of a worker from a background thread, with its own
+    database connection
+    '''
+    def __init__(self, file_name, worker, lease_seconds):
+        self._args = (file_name, worker, lease_seconds)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        file_name, worker, lease_seconds = self._args
+        with JobQueue(file_name, lease_seconds) as queue:
+            while not self._stop.wait(lease_seconds / 3):
+                queue.heartbeat(worker)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def work(file_name, terms, dates_1, dates_2, store_text=True, batch=1,
+         lease_seconds=300, max_attempts=3, poll_seconds=5, worker=None):
+    '''
+    Drains a job queue: leases jobs, gets their Snapshot (see
+    get_content.get_snapshot) and stores it, until no job is pending or
+    leased by another worker.
+
+    Inputs:
+        - file_name (str): SQLite database of the queue
+        - terms (lst): list of terms to be looked for
+        - dates_1 (lst), dates_2 (lst): "pre" and "post" date ranges (see
+            get_output)
+        - store_text (bool): whether visible text should be stored
+        - batch (int): number of jobs leased at a time
+        - lease_seconds (float), max_attempts (int): see JobQueue
+        - poll_seconds (float): seconds to wait for the jobs leased by other
+            workers, which may be requeued
+        - worker (str): name of the worker, see worker_name by default
+
+    Outputs:
+        - n (int): number of jobs completed by this worker
+    '''
+    from scripts import get_content
+    worker = worker or worker_name()
+    n = 0
+    with JobQueue(file_name, lease_seconds, max_attempts) as queue:
+        heartbeat = _Heartbeat(file_name, worker, lease_seconds)
+        try:
+            while True:
+                jobs = queue.lease(worker, batch)
+                if not jobs:
+                    if not queue.progress()['leased']:
+                        break
+                    time.sleep(poll_seconds)
+                    continue
+                for id, url in jobs:
+                    try:
+                        snapshot = get_content.get_snapshot(id, url, terms,
+                                                            dates_1, dates_2,
+                                                            store_text)
+                    except Exception as e:
+                        queue.fail(id, worker, repr(e))
+                        continue
+                    n += queue.complete(id, worker, snapshot)
+        finally:
+            heartbeat.stop()
+
+    return n
+
+def _work(args):
+    file_name, terms, dates_1, dates_2, store_text, options, i = args
+    return work(file_name, terms, dates_1, dates_2, store_text,
+                worker='{}:{}'.format(worker_name(), i), **options)
+
+def run_workers(file_name, terms, dates_1, dates_2, store_text=True,
+                processes=None, **options):
+    '''
+    Drains a job queue with a pool of worker processes (see work). More
+    workers can join from other shells with the work command.
+
+    Inputs:
+        - processes (int): number of worker processes, defaults to the number
+            of cores
+        - options: batch, lease_seconds, max_attempts and poll_seconds, passed
+            on to work
+
+    Outputs:
+        - n (int): number of jobs completed by the workers
+    '''
+    processes = processes or os.cpu_count()
+    with Pool(processes) as pool:
+        done = pool.map(_work, [(file_name, terms, dates_1, dates_2, store_text,
+                                 options, i) for i in range(processes)],
+                        chunksize=1)
+
+    return sum(done)
+
+def export(file_name, output_file, terms):
+    '''
+    Writes the outputs of get_output from the jobs of a queue: every url gets
+    the Snapshot of its job (copied to its variants), jobs that failed or are
+    not done get a failed Snapshot.
+
+    Outputs:
+        - {output_file}_pre.csv, {output_file}_post.csv,
+            {output_file}_data.csv and snapshots_{output_file}.txt, as written
+            by get_output
+    '''
+    from scripts import get_content
+    with JobQueue(file_name) as queue:
+        jobs = list(queue.results())
+    n_urls = max([id for _, _, positions, _, _, _ in jobs
+                  for id, _ in positions] or [0])
+    snapshot_lst = [None] * n_urls
+    matrix_pre = [[] for i in range(n_urls)]
+    matrix_post = [[] for i in range(n_urls)]
+    for id, url, positions, status, error, original in jobs:
+        if original is None: # failed or unfinished job
+            original = get_content.failed_snapshot(id, url, terms, False,
+                                                   error or status)
+        for position, input_url in positions:
+            snapshot = original
+            if position != id: # fan out to the duplicates
+                snapshot = get_content.duplicate_snapshot(original, position,
+                                                          url, input_url)
+            if snapshot.pre['results'] is None:
+                row = [None] * len(terms) # update matrix with Nones
+                matrix_pre[position - 1] = row
+                matrix_post[position - 1] = row
+            else:
+                matrix_pre[position - 1] = snapshot.pre['results']
+                matrix_post[position - 1] = snapshot.post['results']
+            snapshot_lst[position - 1] = snapshot
+
+    get_content.save_csv(matrix_pre, output_file, '_pre')
+    get_content.save_csv(matrix_post, output_file, '_post')
+    get_content.save_data(snapshot_lst, output_file)
+    with open('outputs/snapshots_{}.txt'.format(output_file), "wb") as fp:
+        pickle.dump(snapshot_lst, fp) #pickling
+
+def main():
+    '''
+    Crawls with a job queue described in a json configuration with the keys:
+        - input_file (str): path to csv with urls
+        - output_file (str): "root name" of produced outputs
+        - terms (lst): list of terms to be looked for
+        - dates_1 (lst), dates_2 (lst): "pre" and "post" date ranges
+        - queue_file (str): SQLite database of the queue (optional, by
+            default outputs/{output_file}_jobs.db)
+        - store_text, dedupe (bool) (optional)
+    '''
+    parser = argparse.ArgumentParser(description='Crawls with a job queue')
+    subparsers = parser.add_subparsers(dest='command')
+    cra = subparsers.add_parser('crawl', help='add the input urls, drain the '
+                                'queue with a pool of workers and export')
+    cra.add_argument('--workers', type=int, default=None)
+    wor = subparsers.add_parser('work', help='drain the queue with one worker')
+    for sub in [cra, wor]:
+        sub.add_argument('--batch', type=int, default=1)
+        sub.add_argument('--lease-seconds', type=float, default=300)
+        sub.add_argument('--max-attempts', type=int, default=3)
+    sta = subparsers.add_parser('status', help='progress of the crawl')
+    req = subparsers.add_parser('requeue', help='retry the failed jobs')
+    exp = subparsers.add_parser('export', help='write the outputs of the crawl')
+    for sub in [cra, wor, sta, req, exp]:
+        sub.add_argument('config', help='json file with the crawl configuration')
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
+    with open(args.config) as f:
+        config = json.load(f)
+    file_name = config.get('queue_file',
+                           'outputs/{}_jobs.db'.format(config['output_file']))
+
+    if args.command in ('crawl', 'work'):
+        options = {'batch': args.batch, 'lease_seconds': args.lease_seconds,
+                   'max_attempts': args.max_attempts}
+        crawl = (file_name, config['terms'], config['dates_1'],
+                 config['dates_2'], config.get('store_text', True))
+        if args.command == 'crawl':
+            from scripts import get_content
+            with JobQueue(file_name) as queue:
+                urls = [elmt[0] for elmt in get_content.read_csv(config['input_file'])]
+                queue.add(urls, config.get('dedupe', False))
+            run_workers(*crawl, processes=args.workers, **options)
+            export(file_name, config['output_file'], config['terms'])
+        else:
+            work(*crawl, **options)
+    elif args.command == 'requeue':
+        with JobQueue(file_name) as queue:
+            print('{} jobs requeued'.format(queue.requeue()))
+    elif args.command == 'export':
+        export(file_name, config['output_file'], config['terms'])
+    with JobQueue(file_name) as queue:
+        queue.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+'''
+Negative cache script
+
+Persistent cache of urls whose lookup failed for a reason that will not go
+away on the next run: no archived versions in the date ranges, no viable
+(status 200) version, or a permanent 404/410 memento. Each failure class has
+its own time to live, after which the url is looked up again.
+
+    cache = NegativeCache()
+    get_output(..., negative_cache=cache) # saves the cache at the end
+    cache.revalidate(failure_class='no_history') # check these again next run
+'''
+from scripts import internetarchive
+from scripts.surt import surt
+import pickle
+import time
+import os
+
+DAY = 24 * 60 * 60
+# time to live (seconds) of each failure class
+FAILURE_TTLS = {'no_history': 30 * DAY, # no versions in the date ranges
+                'no_viable': 30 * DAY,  # versions, but none with status 200
+                'not_found': 90 * DAY,  # memento returned 404
+                'gone': 365 * DAY}      # memento returned 410
+MEMENTO_FAILURES = {404: 'not_found', 410: 'gone'}
+
+def failure_class(exception):
+    '''
+    Gets the failure class of the exception of a failed Snapshot, or None for
+    failures that should be retried (network errors, timeouts, ...)
+    '''
+    if isinstance(exception, internetarchive.NoVersionsError):
+        return 'no_history'
+    if isinstance(exception, str): # status code of the last version
+        return 'no_viable'
+    if isinstance(exception, internetarchive.MementoPlaybackError):
+        return MEMENTO_FAILURES.get(getattr(exception, 'status_code', None))
+    return None
+
+
+class NegativeCache:
+    '''
+    Urls with a permanent failure, keyed by SURT key and date ranges.
+
+    Inputs:
+        - file_name (str): pickle file where the cache is kept
+        - ttls (dict): failure class -> seconds, defaults to FAILURE_TTLS
+    '''
+    def __init__(self, file_name='outputs/negative_cache.pkl', ttls=None):
+        self.file_name = file_name
+        self.ttls = dict(FAILURE_TTLS, **(ttls or {}))
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        if file_name and os.path.exists(file_name):
+            with open(file_name, 'rb') as fp:
+                self._entries = pickle.load(fp)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(url, dates_1, dates_2):
+        '''
+        Gets the cache key of a url for the "pre" and "post" date ranges
+        '''
+        return surt(url), tuple(dates_1), tuple(dates_2)
+
+    def get(self, url, dates_1, dates_2, now=None):
+        '''
+        Gets the cached failure of a url, or None if there is none or it
+        expired.
+
+        Outputs:
+            - entry (dict): "class", "exception" and "time" of the failure
+        '''
+        now = time.time() if now is None else now
+        entry = self._entries.get(self.key(url, dates_1, dates_2))
+        if entry is not None and now - entry['time'] > self.ttls[entry['class']]:
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def add(self, url, dates_1, dates_2, exception, now=None):
+        '''
+        Adds the failure of a url if it is permanent. Returns its failure
+        class, None if it was not added.
+        '''
+        name = failure_class(exception)
+        if name is not None:
+            self._entries[self.key(url, dates_1, dates_2)] = {
+                'class': name, 'exception': exception,
+                'time': time.time() if now is None else now}
+        return name
+
+    def revalidate(self, urls=None, failure_class=None, older_than=None,
+                   now=None):
+        '''
+        Removes entries so that their urls are looked up again on the next
+        run. With no arguments every entry is removed.
+
+        Inputs:
+            - urls (lst): only remove entries of these urls
+            - failure_class (str): only remove entries of this class
+            - older_than (float): only remove entries older than this many
+                seconds
+
+        Outputs:
+            - n (int): number of removed entries
+        '''
+        now = time.time() if now is None else now
+        keys = None if urls is None else {surt(url) for url in urls}
+        remove = [k for k, entry in self._entries.items()
+                  if (keys is None or k[0] in keys) and
+                     (failure_class is None or entry['class'] == failure_class) and
+                     (older_than is None or now - entry['time'] > older_than)]
+        for k in remove:
+            del self._entries[k]
+
+        return len(remove)
+
+    def expire(self, now=None):
+        '''
+        Removes the entries whose time to live has passed
+        '''
+        now = time.time() if now is None else now
+        expired = [k for k, entry in self._entries.items()
+                   if now - entry['time'] > self.ttls[entry['class']]]
+        for k in expired:
+            del self._entries[k]
+
+        return len(expired)
+
+    def report(self):
+        '''
+        Prints the number of hits and entries by failure class
+        '''
+        classes = {}
+        for entry in self._entries.values():
+            classes[entry['class']] = classes.get(entry['class'], 0) + 1
+        print('negative cache: {} hits, {} misses, {} entries ({})'.format(
+              self.hits, self.misses, len(self),
+              ', '.join('{} {}'.format(v, k) for k, v in sorted(classes.items()))))
+
+    def save(self):
+        self.expire()
+        with open(self.file_name, 'wb') as fp:
+            pickle.dump(self._entries, fp)
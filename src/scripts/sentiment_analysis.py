@@ -1,12 +1,32 @@
 '''
 Sentiment analysis script
+
+pysentiment and its lexicon are only loaded when the first document is scored.
 '''
-import pysentiment as ps
+from multiprocessing import Pool
 import numpy as np
-import pandas as pd
+import hashlib
+import pickle
+import os
+import re
 
 results = []
-hiv4 = ps.HIV4()
+_hiv4 = None
+
+def get_hiv4():
+    '''
+    Gets the Harvard IV-4 dictionary from pysentiment, loading it on first use
+    '''
+    global _hiv4
+    if _hiv4 is None:
+        import pysentiment as ps
+        _hiv4 = ps.HIV4()
+    return _hiv4
+
+def __getattr__(name):
+    if name == 'hiv4': # kept for code that uses the module attribute
+        return get_hiv4()
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
 
 # pip3 install git+https://github.com/hanzhichao2000/pysentiment
 # http://www.wjh.harvard.edu/~inquirer/homecat.htm
@@ -15,36 +35,301 @@ hiv4 = ps.HIV4()
 # https://github.com/hanzhichao2000/pysentiment
 # Polarity = (Pos-Neg)/(Pos+Neg)
 # Subjectivity= (Pos+Neg)/count(*)
-def get_tone(df):
+
+WORDS = re.compile('[a-z]+') # same words as the pysentiment tokenizer
+
+class HIV4Scorer:
+    '''
+    Scores many documents with the Harvard IV-4 lexicon. The positive and
+    negative lexicons are loaded once into sets, and every distinct word is
+    stemmed and looked up only once, so scores match hiv4.get_score on
+    hiv4.tokenize of the same text.
+    '''
+    EPSILON = 1e-6 # same as pysentiment
+
+    def __init__(self, lexicon=None):
+        lexicon = lexicon or get_hiv4()
+        self._lexicon = lexicon
+        self.positive = frozenset(lexicon._posset)
+        # a term in both sets counts as positive in pysentiment
+        self.negative = frozenset(lexicon._negset - lexicon._posset)
+        self._scores = {} # word -> +1, -1, 0 or None for stop words
+        self._version = None
+
+    @property
+    def version(self):
+        '''
+        Hash of the lexicon, so that cached scores are not reused after the
+        lexicon changes
+        '''
+        if self._version is None:
+            content = '\n'.join(sorted(self.positive)) + '\n--\n' + \
+                      '\n'.join(sorted(self.negative)) + '\n--\n' + \
+                      WORDS.pattern + str(self.EPSILON)
+            self._version = hashlib.sha1(content.encode()).hexdigest()
+        return self._version
+
+    def words(self, text):
+        '''
+        Splits a visible text (list of strings) or a string into the words
+        that the lexicon tokenizer looks at, before stemming.
+        '''
+        if not isinstance(text, str):
+            text = ', '.join(text) # join text as string
+        return WORDS.findall(text.lower())
+
+    def _score_word(self, word):
+        stems = self._lexicon.tokenize(word)
+        if not stems: # stop word
+            score = None
+        elif stems[0] in self.positive:
+            score = 1
+        elif stems[0] in self.negative:
+            score = -1
+        else:
+            score = 0
+        self._scores[word] = score
+
+        return score
+
+    def counts(self, words):
+        '''
+        Gets the number of positive, negative and scored words in a list of
+        words
+        '''
+        scores = self._scores
+        n_pos = 0
+        n_neg = 0
+        n = 0
+        for word in words:
+            score = scores[word] if word in scores else self._score_word(word)
+            if score is not None:
+                n += 1
+                if score > 0:
+                    n_pos += 1
+                elif score < 0:
+                    n_neg += 1
+
+        return n_pos, n_neg, n
+
+    def count_batch(self, texts=None, words=None):
+        '''
+        Gets the number of positive, negative and scored words for a batch of
+        documents.
+
+        Inputs:
+            - texts (lst): list of visible texts (list of strings or string),
+                None for missing text
+            - words (lst): already tokenized documents (lists of words from
+                HIV4Scorer.words), used instead of texts where not None
+
+        Outputs:
+            - counts (numpy array): documents x (positive, negative, total)
+                array, nan for documents without text
+        '''
+        n_docs = len(words if texts is None else texts)
+        counts = np.full((n_docs, 3), np.nan)
+        for i in range(n_docs):
+            doc_words = words[i] if words is not None else None
+            if doc_words is None and texts is not None:
+                if isinstance(texts[i], (list, tuple, str)):
+                    doc_words = self.words(texts[i])
+            if doc_words is not None:
+                counts[i] = self.counts(doc_words)
+
+        return counts
+
+    def score(self, texts=None, words=None):
+        '''
+        Scores a batch of documents (see count_batch for the inputs).
+
+        Outputs:
+            - polarity (numpy array): polarity per document, nan if missing
+            - subjectivity (numpy array): subjectivity per document, nan if
+                missing
+        '''
+        return scores_from_counts(self.count_batch(texts, words), self.EPSILON)
+
+
+def scores_from_counts(counts, epsilon=HIV4Scorer.EPSILON):
+    '''
+    Computes polarity and subjectivity from an array of (positive, negative,
+    total) word counts, with the same formulas as pysentiment.
+    '''
+    n_pos, n_neg, n = counts[:, 0], counts[:, 1], counts[:, 2]
+    polarity = (n_pos - n_neg) / (n_pos + n_neg + epsilon)
+    subjectivity = (n_pos + n_neg) / (n + epsilon)
+
+    return polarity, subjectivity
+
+class SentimentCache:
+    '''
+    Persistent cache of sentiment word counts keyed by a hash of the joined
+    visible text and the lexicon version. Pages whose text did not change
+    between runs (or between pre and post) are scored only once.
+    '''
+    def __init__(self, file_name='outputs/sentiment_cache.pkl'):
+        self.file_name = file_name
+        self.hits = 0
+        self.misses = 0
+        self._counts = {}
+        if file_name and os.path.exists(file_name):
+            with open(file_name, 'rb') as fp:
+                self._counts = pickle.load(fp)
+
+    def __len__(self):
+        return len(self._counts)
+
+    @staticmethod
+    def key(text, version):
+        '''
+        Gets the cache key of a visible text (list of strings or string)
+        '''
+        if not isinstance(text, str):
+            text = ', '.join(text)
+        return hashlib.sha1((version + '\n' + text).encode()).hexdigest()
+
+    def get(self, key):
+        counts = self._counts.get(key)
+        if counts is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return counts
+
+    def put(self, key, counts):
+        self._counts[key] = tuple(counts)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        '''
+        Prints the number of lookups and the hit rate
+        '''
+        print('sentiment cache: {} hits, {} misses ({:.1f}% hit rate), {} entries'.format(
+              self.hits, self.misses, self.hit_rate() * 100, len(self)))
+
+    def save(self):
+        with open(self.file_name, 'wb') as fp:
+            pickle.dump(self._counts, fp)
+
+
+_worker_scorer = None
+
+def _init_worker():
+    global _worker_scorer
+    _worker_scorer = HIV4Scorer()
+
+def _score_chunk(chunk):
+    texts, words = chunk
+    return _worker_scorer.count_batch(texts, words)
+
+def score_batch(texts, ids=None, words=None, processes=None, chunksize=256,
+                cache=None):
+    '''
+    Gets polarity and subjectivity for many documents, spread across a process
+    pool. Each worker loads the lexicon once.
+
+    Inputs:
+        - texts (lst): list of visible texts (list of strings or string),
+            None for missing text
+        - ids (lst): ids of the documents, defaults to their position
+        - words (lst): already tokenized documents (see HIV4Scorer.words),
+            None where not available
+        - processes (int): number of worker processes, defaults to the number
+            of cores. With processes=1 everything runs in this process
+        - chunksize (int): number of documents sent to a worker at a time
+        - cache (SentimentCache): if given, documents with a cached text hash
+            are not scored again, and new scores are added to the cache (call
+            cache.save() to keep them for the next run)
+
+    Outputs:
+        - scores (dict): "id", "polarity" and "subjectivity" numpy arrays
+            aligned with the input, nan where the text is missing
+    '''
+    if words is None:
+        words = [None] * len(texts)
+    if ids is None:
+        ids = np.arange(len(texts))
+    counts = np.full((len(texts), 3), np.nan)
+    # documents to score, the same text is only scored once per batch
+    todo = list(range(len(texts)))
+    keys = {}
+    if cache is not None:
+        if _worker_scorer is None:
+            _init_worker()
+        version = _worker_scorer.version
+        todo = []
+        first = {}
+        for i, text in enumerate(texts):
+            if isinstance(text, (list, tuple, str)):
+                key = cache.key(text, version)
+                if key in first: # same text as an earlier document
+                    keys[i] = key
+                    cache.hits += 1
+                    continue
+                cached = cache.get(key)
+                if cached is not None:
+                    counts[i] = cached
+                else:
+                    keys[i] = first[key] = key
+                    todo.append(i)
+            elif words[i] is not None:
+                todo.append(i)
+    todo_texts = [texts[i] for i in todo]
+    todo_words = [words[i] for i in todo]
+    chunks = [(todo_texts[i:i + chunksize], todo_words[i:i + chunksize])
+              for i in range(0, len(todo), chunksize)]
+    if processes == 1 or len(chunks) <= 1:
+        if _worker_scorer is None:
+            _init_worker()
+        results = [_score_chunk(chunk) for chunk in chunks]
+    else:
+        with Pool(processes, initializer=_init_worker) as pool:
+            results = pool.map(_score_chunk, chunks, chunksize=1)
+    if results:
+        counts[todo] = np.concatenate(results)
+    if cache is not None:
+        scored = {keys[i]: counts[i] for i in todo if i in keys}
+        for i, key in keys.items():
+            counts[i] = scored[key]
+            cache.put(key, scored[key])
+    polarity, subjectivity = scores_from_counts(counts)
+
+    return {'id': np.asarray(ids),
+            'polarity': polarity,
+            'subjectivity': subjectivity}
+
+def get_tone(df, processes=1, cache=None):
     '''
     Gets polarity and subjectivity for a set of websites.
 
     Inputs:
         - df (pandas dataframe): a pandas dataframe with a "text", "id" and
             "department" columns
-    '''
+        - processes (int): number of worker processes used for scoring
+        - cache (SentimentCache): cache of scores by text hash, saved and
+            reported after scoring
 
-    data = {'id': [],
-            'department': [],
-            'polarity': [],
-            'subjectivity': []}
-    df_content = df[['text', 'id', 'department']].values.tolist()
-    #print(df_content)
+    Outputs:
+        - data (dict): "id", "department", "polarity" and "subjectivity"
+            lists, for the websites with text
+    '''
+    texts = df['text'].tolist()
+    scores = score_batch(texts, df['id'].values, processes=processes,
+                         cache=cache)
+    if cache is not None:
+        cache.save()
+        cache.report()
+    has_text = ~np.isnan(scores['polarity'])
+    for id_obs in scores['id'][~has_text]:
+        print('exception', id_obs)
 
-    for row in df_content:
-        text, id_obs, department = row
-        try:
-            #print(text)
-            text = ', '.join(text) # join text as string
-            tokens = hiv4.tokenize(text)
-            score = hiv4.get_score(tokens)
-            #print(score)
-            data['id'].append(id_obs)
-            data['department'].append(department)
-            data['polarity'].append(score['Polarity'])
-            data['subjectivity'].append(score['Subjectivity'])
-        except:
-            print('exception', id_obs)
-            continue
+    data = {'id': scores['id'][has_text].tolist(),
+            'department': df['department'].values[has_text].tolist(),
+            'polarity': scores['polarity'][has_text].tolist(),
+            'subjectivity': scores['subjectivity'][has_text].tolist()}
 
     return data
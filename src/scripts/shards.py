@@ -0,0 +1,149 @@
+'''
+Shards script
+
+Splits a crawl across nodes. Every input url is assigned to one of n shards
+by a stable hash of its SURT key, so all the nodes agree on the split without
+talking to each other and the variants of a url (see surt.dedupe) stay in the
+same shard. Each node runs get_output on its shard, which keeps the ids of a
+single-node run (positions in the input file) and writes partial outputs
+named by shard_name. merge combines them into the files of a single-node run:
+
+    python -m scripts.shards crawl crawl.json --shard 0 --shards 4 # node 0
+    ...
+    python -m scripts.shards merge crawl.json --shards 4
+
+or from the notebook:
+    get_output(input_file, output_file, terms, dates_1, dates_2, shard=(0, 4))
+    merge(input_file, output_file, 4)
+'''
+from scripts import surt
+import argparse
+import hashlib
+import pickle
+import json
+import csv
+import os
+
+def shard_of(url, n_shards):
+    '''
+    Gets the shard (0 to n_shards - 1) of a url
+    '''
+    digest = hashlib.sha1(surt.surt(url).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % n_shards
+
+def shard_name(output_file, shard, n_shards):
+    '''
+    Gets the "root name" of the outputs of a shard
+    '''
+    return '{}_shard{}of{}'.format(output_file, shard, n_shards)
+
+def _read_rows(file_name):
+    with open(file_name, newline='') as f:
+        return list(csv.reader(f))
+
+def merge(input_file, output_file, n_shards, remove=False):
+    '''
+    Merges the outputs of every shard of a crawl into the outputs of a
+    single-node run: rows are put back in input order, by id. Raises
+    ValueError if an input url is missing from the shards or in more than
+    one of them.
+
+    Inputs:
+        - input_file (str): path to csv with urls, as given to get_output
+        - output_file (str): "root name" of the merged outputs
+        - n_shards (int): number of shards
+        - remove (bool): whether the shard outputs are removed after the merge
+
+    Outputs:
+        - {output_file}_pre.csv, {output_file}_post.csv,
+            {output_file}_data.csv and snapshots_{output_file}.txt, as written
+            by get_output
+    '''
+    from scripts import get_content
+    n_urls = len(get_content.read_csv(input_file))
+    rows = {name: [None] * n_urls for name in ['pre', 'post', 'data']}
+    snapshots = [None] * n_urls
+    files = []
+    for shard in range(n_shards):
+        name = shard_name(output_file, shard, n_shards)
+        shard_files = {key: 'outputs/{}_{}.csv'.format(name, key)
+                       for key in ['pre', 'post', 'data']}
+        shard_files['snapshots'] = 'outputs/snapshots_{}.txt'.format(name)
+        files.extend(shard_files.values())
+        data = _read_rows(shard_files['data'])
+        if data[0] != get_content.DATA_COLUMNS:
+            raise ValueError('Unexpected columns in {}'.format(shard_files['data']))
+        ids = [int(row[0]) for row in data[1:]]
+        matrices = [_read_rows(shard_files[key]) for key in ['pre', 'post']]
+        with open(shard_files['snapshots'], 'rb') as fp:
+            shard_snapshots = pickle.load(fp)
+        for i, id in enumerate(ids):
+            if rows['data'][id - 1] is not None:
+                raise ValueError('Url {} is in more than one shard'.format(id))
+            rows['data'][id - 1] = data[i + 1]
+            rows['pre'][id - 1] = matrices[0][i]
+            rows['post'][id - 1] = matrices[1][i]
+            snapshots[id - 1] = shard_snapshots[i]
+    missing = [i + 1 for i, row in enumerate(rows['data']) if row is None]
+    if missing:
+        raise ValueError('{} urls are missing from the shards, e.g. id {}'.format(
+                         len(missing), missing[0]))
+
+    get_content.save_csv(rows['pre'], output_file, '_pre')
+    get_content.save_csv(rows['post'], output_file, '_post')
+    get_content.save_csv([get_content.DATA_COLUMNS] + rows['data'],
+                         output_file, '_data')
+    with open('outputs/snapshots_{}.txt'.format(output_file), "wb") as fp:
+        pickle.dump(snapshots, fp) #pickling
+    if remove:
+        for file_name in files:
+            os.remove(file_name)
+
+def main():
+    '''
+    Crawls a shard or merges the shards of a crawl described in a json
+    configuration with the keys:
+        - input_file (str): path to csv with urls
+        - output_file (str): "root name" of produced outputs
+        - terms (lst): list of terms to be looked for
+        - dates_1 (lst), dates_2 (lst): "pre" and "post" date ranges
+        - store_text, bulk_cdx, dedupe (bool): passed on to get_output
+            (optional)
+    '''
+    parser = argparse.ArgumentParser(description='Sharded crawls')
+    subparsers = parser.add_subparsers(dest='command')
+    cra = subparsers.add_parser('crawl', help='crawl the urls of one shard')
+    cra.add_argument('config', help='json file with the crawl configuration')
+    cra.add_argument('--shard', type=int, required=True)
+    cra.add_argument('--shards', type=int, required=True)
+    cra.add_argument('--trace-file', default=None)
+    cra.add_argument('--report', action='store_true',
+                     help='print the time spent in each stage at the end')
+    mer = subparsers.add_parser('merge', help='merge the outputs of the shards')
+    mer.add_argument('config', help='json file with the crawl configuration')
+    mer.add_argument('--shards', type=int, required=True)
+    mer.add_argument('--remove', action='store_true',
+                     help='remove the shard outputs after the merge')
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
+    with open(args.config) as f:
+        config = json.load(f)
+
+    if args.command == 'crawl':
+        from scripts import get_content
+        options = {key: config[key] for key in ['store_text', 'bulk_cdx', 'dedupe']
+                   if key in config}
+        get_content.get_output(config['input_file'], config['output_file'],
+                               config['terms'], config['dates_1'],
+                               config['dates_2'], trace_file=args.trace_file,
+                               report=args.report,
+                               shard=(args.shard, args.shards), **options)
+    else:
+        merge(config['input_file'], config['output_file'], args.shards,
+              args.remove)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+SURT script
+
+Canonical url keys (SURT form) as used by the CDX server to match urls, so
+that http/https, www. and trailing slash variants of the same page are
+treated as one url, and deduplication of input url lists before any network
+work.
+
+    urls, groups = dedupe(urls)
+    # urls[i] stands for the inputs at positions groups[i]
+'''
+import re
+
+URL = re.compile(r'^(?:[a-z][a-z0-9+.-]*://|//)?'   # scheme
+                 r'(?:[^@/?#]*@)?'                  # user info
+                 r'([^/?#:]*)'                      # host
+                 r'(?::(\d*))?'                     # port
+                 r'([^?#]*)'                        # path
+                 r'(?:\?([^#]*))?')                 # query, no fragment
+WWW = re.compile(r'^www\d*\.')
+DEFAULT_PORTS = {'80', '443'}
+
+def surt(url):
+    '''
+    Gets the SURT key of a url, following the canonicalization of the CDX
+    server (see WaybackClient.search):
+        - no difference between http and https (the scheme is dropped)
+        - not case-sensitive
+        - www. and www*. subdomains are the same as no subdomain
+    and also: no user info, default port or fragment, sorted query
+    arguments and no trailing slash (except for the root path).
+
+    Example: 'https://www.HHS.gov/programs/?b=2&a=1#top' ->
+        'gov,hhs)/programs?a=1&b=2'
+    '''
+    host, port, path, query = URL.match(url.strip().lower()).groups()
+    host = WWW.sub('', host.strip('.'))
+    key = ','.join(reversed(host.split('.')))
+    if port and port not in DEFAULT_PORTS:
+        key += ':' + port
+    key += ')' + (path.rstrip('/') or '/')
+    if query:
+        key += '?' + '&'.join(sorted(query.split('&')))
+
+    return key
+
+def dedupe(urls):
+    '''
+    Removes urls with the same SURT key, keeping the first one.
+
+    Inputs:
+        - urls (lst): list of urls
+
+    Outputs:
+        - unique (lst): list of distinct urls, in order of first appearance
+        - groups (lst): for each distinct url, the positions in urls of all
+            the urls with the same key (the first one is its own position)
+    '''
+    positions = {}
+    unique = []
+    groups = []
+    for i, url in enumerate(urls):
+        key = surt(url)
+        if key in positions:
+            groups[positions[key]].append(i)
+        else:
+            positions[key] = len(unique)
+            unique.append(url)
+            groups.append([i])
+
+    return unique, groups
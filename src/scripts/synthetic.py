@@ -0,0 +1,249 @@
+'''
+Synthetic script
+
+Synthetic federal-style pages, fake archive corpora and result sets, shared by
+the benchmarks and the tests so that both run offline on the same data:
+
+    urls, corpus = synthetic_corpus(100)
+    with FakeArchive(corpus) as archive:
+        ...
+'''
+import pickle
+import random
+
+# terms and "pre" and "post" date ranges the synthetic pages are counted with
+TERMS = ['gender', 'transgender', 'sex', 'lgbt', ['gender', 'identity'],
+         ['sexual', 'orientation']]
+DATES_PRE = [2013, 1, 20, 2017, 1, 19]
+DATES_POST = [2017, 1, 20, 2019, 8, 8]
+WORDS = ['health', 'services', 'program', 'gender', 'transgender', 'identity',
+         'sexual', 'orientation', 'sex', 'lgbt', 'youth', 'data', 'grants',
+         'the', 'and', 'of', 'for', 'civil', 'rights']
+
+NAV_ITEMS = ['About', 'Programs', 'Grants', 'Laws & Regulations', 'Newsroom',
+             'Careers', 'Contact Us', 'Espanol']
+
+def sentence(rng, n_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(n_words)).capitalize()
+
+def synthetic_page(rng, n_paragraphs=8):
+    '''
+    Generates a federal-style html page, with the boilerplate that
+    get_visible_txt removes (header, banner, navigation, breadcrumb, sidebar,
+    social links, last modified date, footer, scripts and styles) around the
+    main content.
+    '''
+    nav = ''.join('<li><a href="/{}/">{}</a></li>'.format(i, item)
+                  for i, item in enumerate(NAV_ITEMS))
+    paragraphs = []
+    for i in range(n_paragraphs):
+        if i % 4 == 3: # lists and tables as on real program pages
+            paragraphs.append('<ul>{}</ul>'.format(''.join(
+                '<li>{}</li>'.format(sentence(rng, 6)) for _ in range(4))))
+        else:
+            paragraphs.append('<p>{}. {}, <a href="/more/">{}</a>.</p>'.format(
+                sentence(rng, 25), sentence(rng, 12), sentence(rng, 3)))
+    related = ''.join('<li><a href="/related/{}/">{}</a></li>'.format(
+                      i, sentence(rng, 4)) for i in range(5))
+
+    return ('<!DOCTYPE html><html lang="en"><head><meta charset="utf-8">'
+            '<title>{title} | HHS.gov</title>'
+            '<style>body {{margin: 0}} .sr-only {{display: none}}</style>'
+            '<script>window.dataLayer = window.dataLayer || [];</script>'
+            '</head><body>'
+            '<div id="skipnutch"><a href="#main">Skip to main content</a></div>'
+            '<div class="usa-banner" id="banner">An official website of the '
+            'United States government</div>'
+            '<header class="site-header"><div id="branding">U.S. Department of '
+            'Health &amp; Human Services</div><form id="search-form">'
+            '<input type="text" placeholder="Search"></form></header>'
+            '<nav id="navigation" role="navigation"><ul>{nav}</ul></nav>'
+            '<ol class="breadcrumb"><li><a href="/">Home</a></li>'
+            '<li>Programs</li></ol>'
+            '<div class="container"><main id="main" class="main-content">'
+            '<h1>{title}</h1>{paragraphs}'
+            '<span class="sr-only ng-binding ng-scope">Loading</span></main>'
+            '<aside class="sidebar" id="sidebar-first"><h2>Related</h2>'
+            '<ul>{related}</ul></aside></div>'
+            '<div class="social-links"><a>Facebook</a><a>Twitter</a></div>'
+            '<div id="lastmodified">Content last reviewed on January 3, 2018'
+            '</div><a class="back-to-top" title="Go to top" href="#">Top</a>'
+            '<footer id="footer"><ul>{nav}</ul><p>U.S. Department of Health '
+            '&amp; Human Services - 200 Independence Avenue, S.W.</p></footer>'
+            '<script>(function() {{ var s = "tracking"; }})();</script>'
+            '</body></html>').format(title=sentence(rng, 4), nav=nav,
+                                      paragraphs=''.join(paragraphs),
+                                      related=related)
+
+def synthetic_corpus(n_urls, seed=0):
+    '''
+    Generates a fixture corpus for the fake archive with captures before and
+    after the benchmark dates, including revisits and redirects.
+
+    Outputs:
+        - urls (lst): list of urls
+        - corpus (lst): list of captures
+    '''
+    rng = random.Random(seed)
+    urls = []
+    corpus = []
+    for i in range(n_urls):
+        url = 'https://www.hhs.gov/programs/page-{}/index.html'.format(i)
+        urls.append(url)
+        body = synthetic_page(rng)
+        corpus.append({'url': url, 'timestamp': '20160601120000', 'body': body})
+        if i % 5 == 0: # unchanged page
+            corpus.append({'url': url, 'timestamp': '20190101120000',
+                           'status': '-'})
+        else:
+            corpus.append({'url': url, 'timestamp': '20190101120000',
+                           'body': synthetic_page(rng)})
+        if i % 7 == 0: # later capture redirects to the previous page
+            corpus.append({'url': url, 'timestamp': '20190601120000',
+                           'status': 301, 'redirect': urls[max(i - 1, 0)]})
+
+    return urls, corpus
+
+def window_corpus(n_urls, year_from=2016, year_to=2026, seed=0):
+    '''
+    Generates a fixture corpus with a capture of every url in January and
+    July of every year. Pages change every third year, and are revisits of
+    the previous capture otherwise; every tenth url is missing (404) in one
+    of the years.
+    '''
+    rng = random.Random(seed)
+    urls = []
+    corpus = []
+    for i in range(n_urls):
+        url = 'https://www.hhs.gov/programs/page-{}/index.html'.format(i)
+        urls.append(url)
+        for year in range(year_from, year_to + 1):
+            if i % 10 == 0 and year == year_from + i % (year_to - year_from + 1):
+                corpus.append({'url': url, 'status': 404, 'body': 'Not Found',
+                               'timestamp': '{}0115120000'.format(year)})
+            elif year == year_from or (year - year_from) % 3 == 0:
+                corpus.append({'url': url, 'body': synthetic_page(rng),
+                               'timestamp': '{}0115120000'.format(year)})
+            else:
+                corpus.append({'url': url, 'status': '-',
+                               'timestamp': '{}0115120000'.format(year)})
+            corpus.append({'url': url, 'status': '-',
+                           'timestamp': '{}0701120000'.format(year)})
+
+    return urls, corpus
+
+def history_corpus(n_urls, n_captures=40, n_contents=4, seed=0):
+    '''
+    Generates a fixture corpus with the history of every url: n_captures
+    monthly captures drawn from n_contents distinct pages, so that pages go
+    back to earlier content, with revisits and an occasional 404.
+    '''
+    rng = random.Random(seed)
+    urls = []
+    corpus = []
+    for i in range(n_urls):
+        url = 'https://www.hhs.gov/programs/page-{}/index.html'.format(i)
+        urls.append(url)
+        bodies = [synthetic_page(rng) for _ in range(n_contents)]
+        for j in range(n_captures):
+            timestamp = '{}{:02d}15120000'.format(2016 + j // 12, j % 12 + 1)
+            draw = rng.random()
+            if j and draw < 0.3:
+                corpus.append({'url': url, 'timestamp': timestamp,
+                               'status': '-'})
+            elif j and draw < 0.35:
+                corpus.append({'url': url, 'timestamp': timestamp,
+                               'status': 404, 'body': 'Not Found'})
+            else:
+                corpus.append({'url': url, 'timestamp': timestamp,
+                               'body': rng.choice(bodies)})
+
+    return urls, corpus
+
+def section_versions(n_pages, n_versions, n_sections=60, changed=2, seed=0):
+    '''
+    Generates the visible text (list of sections) of n_versions consecutive
+    versions of n_pages pages, each version changing, adding or removing
+    about changed sections of the previous one.
+    '''
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(n_pages):
+        text = [sentence(rng, rng.randint(3, 40)) for _ in range(n_sections)]
+        versions = [list(text)]
+        for _ in range(n_versions - 1):
+            for _ in range(changed):
+                draw = rng.random()
+                i = rng.randrange(len(text))
+                if draw < 0.6:
+                    text[i] = sentence(rng, rng.randint(3, 40))
+                elif draw < 0.8 or len(text) < 2:
+                    text.insert(i, sentence(rng, rng.randint(3, 40)))
+                else:
+                    del text[i]
+            versions.append(list(text))
+        pages.append(versions)
+
+    return pages
+
+def department_frames(n_pages, n_departments, n_terms, seed=0):
+    '''
+    Builds synthetic pre and post dataframes, in the get_final_df format, with
+    sparse term counts.
+
+    Outputs:
+        - df_pre (df), df_post (df), term_cols (lst)
+    '''
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    term_cols = ['term-{}'.format(i) for i in range(n_terms)]
+    frames = []
+    for _ in range(2):
+        counts = rng.poisson(0.05, size=(n_pages, n_terms))
+        df = pd.DataFrame(counts, columns=term_cols)
+        df['id'] = np.arange(1, n_pages + 1)
+        df['ttal'] = rng.integers(200, 3000, n_pages)
+        df['department'] = ['dept-{}'.format(i % n_departments)
+                            for i in range(n_pages)]
+        frames.append(df)
+
+    return frames[0], frames[1], term_cols
+
+def result_files(n_pages, terms, n_departments=15, failed_every=10, seed=0):
+    '''
+    Writes a get_output result set without visible text (pickle file, count
+    matrices and data csv, named "bench") and a department file in the current
+    directory. Every failed_every-th url failed.
+    '''
+    from scripts.get_content import Snapshot, save_csv, save_data
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    snapshots = []
+    matrices = {'pre': [], 'post': []}
+    for i in range(n_pages):
+        snapshot = Snapshot(i + 1, 'https://www.hhs.gov/page-{}/'.format(i),
+                            'https://web.archive.org/web/20160601120000id_/'
+                            'https://www.hhs.gov/page-{}/'.format(i),
+                            terms, False)
+        snapshot.status = 'failed' if i % failed_every == 0 else 'succesful'
+        for name in ['pre', 'post']:
+            if snapshot.status == 'failed':
+                matrices[name].append([None] * len(terms))
+                continue
+            obj = getattr(snapshot, name)
+            obj['results'] = rng.poisson(0.5, len(terms)).tolist()
+            obj['word_count'] = int(rng.randint(200, 3000))
+            obj['date'] = '2016-06-01 12:00:00'
+            matrices[name].append(obj['results'])
+        snapshot._terms = None
+        snapshots.append(snapshot)
+    with open('outputs/snapshots_bench.txt', 'wb') as fp:
+        pickle.dump(snapshots, fp)
+    save_csv(matrices['pre'], 'bench', '_pre')
+    save_csv(matrices['post'], 'bench', '_post')
+    save_data(snapshots, 'bench')
+    with open('departments.csv', 'w') as f:
+        f.write('id,department\n')
+        f.write(''.join('{},dept-{}\n'.format(i + 1, i % n_departments)
+                        for i in range(n_pages)))
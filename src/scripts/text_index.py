@@ -0,0 +1,304 @@
+'''
+Text index script
+
+Positional inverted index over the visible text stored in Snapshot objects.
+Useful to check why the count of a term changed on a page without reloading
+the pickle file and searching the text by hand. get_index saves the index
+next to the pickle file and reuses it on later runs, until the pickle file
+changes:
+
+    index = get_index('outputs/snapshots_counts_final.txt')
+    index.kwic('gender identity', period='post')
+'''
+from scripts import tokenizer
+import pickle
+import csv
+import os
+
+PERIODS = ['pre', 'post']
+
+class TextIndex:
+    '''
+    Positional inverted index of the visible text of a set of snapshots. Each
+    (id, period) pair is a document. Tokens are normalized in the same way
+    as in term_counter, so counts returned by the index match the counts
+    matrix. Sections are separated by a gap so that phrases never match
+    across two sections, as in term_counter.
+    '''
+    def __init__(self):
+        self._postings = {} # token -> {doc: [positions]}
+        self._tokens = [] # doc -> list of tokens (None between sections)
+        self._docs = [] # doc -> (id, period, department)
+        self._keys = {} # (id, period) -> doc
+        self._by_department = {} # department -> set of docs
+        self._by_period = {} # period -> set of docs
+        self.source = None # (size, mtime) of the pickle file it was built from
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, id, period, visible_text, department=None):
+        '''
+        Adds the visible text of a snapshot to the index. Adding the same
+        (id, period) pair again replaces the previous document.
+
+        Inputs:
+            - id (int): snapshot id
+            - period (str): 'pre' or 'post'
+            - visible_text (lst): list of strings, as returned by
+                get_visible_txt
+            - department (str): department name used for filtering
+        '''
+        if (id, period) in self._keys:
+            self.remove(id, period)
+        doc = len(self._docs)
+        tokens = []
+        for section in visible_text:
+            if tokens:
+                tokens.append(None) # gap between sections
+            tokens.extend(tokenizer.tokenize(section))
+        for position, token in enumerate(tokens):
+            if token is not None:
+                self._postings.setdefault(token, {}).setdefault(doc, []).append(position)
+        self._tokens.append(tokens)
+        self._docs.append((id, period, department))
+        self._keys[(id, period)] = doc
+        self._by_department.setdefault(department, set()).add(doc)
+        self._by_period.setdefault(period, set()).add(doc)
+
+    def add_snapshot(self, snapshot, department=None):
+        '''
+        Adds the "pre" and "post" text of a Snapshot object to the index.
+        Snapshots without stored text are skipped.
+
+        Inputs:
+            - snapshot (Snapshot): object from get_content
+            - department (str): department name used for filtering
+        '''
+        for period in PERIODS:
+            text = getattr(snapshot, period)['text']
+            if text is not None:
+                self.add(snapshot.id, period, text, department)
+
+    def set_departments(self, departments):
+        '''
+        Assigns departments to documents already in the index, e.g. after
+        building it incrementally in get_output.
+
+        Inputs:
+            - departments (dict): id -> department name
+        '''
+        for doc, (id, period, department) in enumerate(self._docs):
+            if id in departments and departments[id] != department:
+                self._by_department[department].discard(doc)
+                self._by_department.setdefault(departments[id], set()).add(doc)
+                self._docs[doc] = (id, period, departments[id])
+
+    def remove(self, id, period):
+        '''
+        Removes a document from the index.
+        '''
+        doc = self._keys.pop((id, period))
+        for token in set(self._tokens[doc]):
+            if token is not None:
+                postings = self._postings[token]
+                del postings[doc]
+                if not postings:
+                    del self._postings[token]
+        _, _, department = self._docs[doc]
+        self._by_department[department].discard(doc)
+        self._by_period[period].discard(doc)
+        self._tokens[doc] = []
+        self._docs[doc] = (None, None, None)
+
+    def _select(self, department, period):
+        '''
+        Gets the set of documents allowed by the filters, or None if there
+        are no filters.
+        '''
+        selected = None
+        if department is not None:
+            if isinstance(department, str):
+                department = [department]
+            selected = set()
+            for name in department:
+                selected |= self._by_department.get(name, set())
+        if period is not None:
+            docs = self._by_period.get(period, set())
+            selected = docs if selected is None else selected & docs
+
+        return selected
+
+    def _matches(self, query, department, period):
+        '''
+        Finds the start position of every match of a query.
+
+        Outputs:
+            - matches (dict): doc -> sorted list of start positions
+            - length (int): number of tokens in the query
+        '''
+        if isinstance(query, list):
+            key = tokenizer.normalize_term(query)
+        else:
+            key = tuple(tokenizer.tokenize(query))
+        if not key:
+            return {}, 0
+        postings = [self._postings.get(token) for token in key]
+        if any(p is None for p in postings):
+            return {}, len(key)
+        # start from the rarest token to keep intersections small
+        docs = min(postings, key=len).keys()
+        selected = self._select(department, period)
+        if selected is not None:
+            docs = [doc for doc in docs if doc in selected]
+        matches = {}
+        for doc in docs:
+            if not all(doc in p for p in postings):
+                continue
+            starts = postings[0][doc]
+            for offset in range(1, len(key)):
+                following = set(postings[offset][doc])
+                starts = [s for s in starts if s + offset in following]
+                if not starts:
+                    break
+            if starts:
+                matches[doc] = starts
+
+        return matches, len(key)
+
+    def count(self, query, department=None, period=None):
+        '''
+        Counts the ocurrences of a word or phrase in each document.
+
+        Inputs:
+            - query (str or lst of str): a word, a phrase or a multi word term
+                in the same format as the terms used in get_output
+            - department (str or lst): restrict to these departments
+            - period (str): restrict to 'pre' or 'post'
+
+        Outputs:
+            - counts (dict): (id, period) -> count, only for documents where
+                the query was found
+        '''
+        matches, _ = self._matches(query, department, period)
+        counts = {}
+        for doc, starts in matches.items():
+            id, doc_period, _ = self._docs[doc]
+            counts[(id, doc_period)] = len(starts)
+
+        return counts
+
+    def kwic(self, query, window=5, department=None, period=None, limit=None):
+        '''
+        Gets keyword-in-context windows for a word or phrase.
+
+        Inputs:
+            - query (str or lst of str): a word, a phrase or a multi word term
+            - window (int): number of tokens to show on each side
+            - department (str or lst): restrict to these departments
+            - period (str): restrict to 'pre' or 'post'
+            - limit (int): maximum number of windows to return
+
+        Outputs:
+            - rows (lst): list of dicts with "id", "period", "department",
+                "left", "keyword" and "right" keys, sorted by id and period
+        '''
+        matches, length = self._matches(query, department, period)
+        rows = []
+        for doc in sorted(matches, key=lambda d: (self._docs[d][0], d)):
+            id, doc_period, doc_department = self._docs[doc]
+            tokens = self._tokens[doc]
+            for start in matches[doc]:
+                end = start + length
+                left = [t for t in tokens[max(start - window, 0):start] if t is not None]
+                right = [t for t in tokens[end:end + window] if t is not None]
+                rows.append({'id': id,
+                             'period': doc_period,
+                             'department': doc_department,
+                             'left': ' '.join(left),
+                             'keyword': ' '.join(tokens[start:end]),
+                             'right': ' '.join(right)})
+                if limit is not None and len(rows) >= limit:
+                    return rows
+
+        return rows
+
+    def save(self, file_name):
+        '''
+        Saves the index into a pickle file. The file is replaced at once, so
+        an interrupted save leaves the previous file as it was.
+        '''
+        with open(file_name + '.tmp', 'wb') as fp:
+            pickle.dump(self, fp)
+        os.replace(file_name + '.tmp', file_name)
+
+
+def load_index(file_name):
+    '''
+    Loads an index saved with TextIndex.save
+    '''
+    with open(file_name, 'rb') as fp:
+        return pickle.load(fp)
+
+def build_index(txt_name, department_file=None):
+    '''
+    Builds an index from the Snapshot objects stored in a pickle file by
+    get_output.
+
+    Inputs:
+        - txt_name (str): name of pickle file
+        - department_file (str): path to csv with "id" and "department"
+            columns
+
+    Outputs:
+        - index (TextIndex): index with the text of every snapshot
+    '''
+    departments = {}
+    if department_file:
+        with open(department_file) as csvfile:
+            for row in csv.DictReader(csvfile):
+                departments[int(row['id'])] = row['department']
+    with open(txt_name, 'rb') as fp:
+        snapshots = pickle.load(fp)
+    index = TextIndex()
+    index.source = _source(txt_name)
+    for snapshot in snapshots:
+        index.add_snapshot(snapshot, departments.get(snapshot.id))
+
+    return index
+
+def _source(txt_name):
+    stat = os.stat(txt_name)
+    return stat.st_size, stat.st_mtime_ns
+
+def get_index(txt_name, index_file=None, department_file=None):
+    '''
+    Loads the index of a pickle file with Snapshot objects saved by an
+    earlier run, or builds and saves it if there is none, if it was built
+    from another version of the pickle file or if it cannot be read (e.g. a
+    corrupt or truncated file).
+
+    Inputs:
+        - txt_name (str): name of pickle file
+        - index_file (str): name of the index file, {txt_name root}_index.pkl
+            by default
+        - department_file (str): path to csv with "id" and "department"
+            columns
+
+    Outputs:
+        - index (TextIndex): index with the text of every snapshot
+    '''
+    index_file = index_file or os.path.splitext(txt_name)[0] + '_index.pkl'
+    try:
+        index = load_index(index_file)
+    except Exception: # missing, corrupt or from an older version
+        index = None
+    if getattr(index, 'source', None) != _source(txt_name):
+        index = build_index(txt_name, department_file)
+        index.save(index_file)
+    elif department_file:
+        with open(department_file) as csvfile:
+            index.set_departments({int(row['id']): row['department']
+                                   for row in csv.DictReader(csvfile)})
+
+    return index
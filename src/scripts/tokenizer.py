@@ -0,0 +1,142 @@
+'''
+Tokenizer script
+
+Two tokenizers produce the normalized token stream used for counting terms:
+    - 'nltk': nltk.word_tokenize followed by lowercasing and removal of
+        punctuation (the original pipeline)
+    - 'regex': a compiled regex tokenizer that only reproduces the parts of
+        nltk.word_tokenize that survive the removal of punctuation, i.e. where
+        it splits words (contractions, clitics and separating punctuation)
+
+Use set_default to choose which one is used by term_counter, counting and
+the text index, and check_parity to compare both on a corpus.
+'''
+import re
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+# characters that nltk.word_tokenize always separates from the words around
+# them, plus commas and colons that are not followed by a digit
+SEPARATORS = re.compile(r'[«“‘„»”’`"*;@#$%&?!\[\](){}<>\u2012-\u2015]'
+                        r"|''|--|\.{2,}|[:,](?!\d)")
+# clitics split off when they end a word (possibly before final periods)
+CLITICS = re.compile(r"(?<=[^'\s])(n't|'s|'m|'d|'ll|'re|'ve)(?=\.*\s)")
+# contractions split in two words, as in nltk's MacIntyre contractions: wanna
+# only before whitespace (or quotes and final periods, which nltk splits off
+# first), the others at a word boundary, so nltk keeps "wanna-be" but splits
+# "gonna-be"
+CONTRACTIONS = re.compile(r"\b(can(?=not\b)|d(?='ye\b)|gim(?=me\b)|gon(?=na\b)|"
+                          r"got(?=ta\b)|lem(?=me\b)|more(?='n\b)|wan(?=na['.]*\s))"
+                          r"(not|'ye|me|na|ta|'n)")
+
+_default = 'nltk'
+
+def tokenize_nltk(section):
+    '''
+    Splits a section of visible text into the normalized tokens used for
+    counting terms: lowercase words with punctuation removed.
+
+    Inputs:
+        - section (str): a string from the visible text of a webpage
+
+    Outputs:
+        - tokens (lst): list of normalized tokens
+
+    Attributions: based on EDGI's code
+    '''
+    from nltk import word_tokenize # only loaded when this tokenizer is used
+    tokens = word_tokenize(section) # tokenize
+    tokens = [PUNCTUATION.sub('', x.lower()) for x in tokens] # lowercase, no punctuation
+    tokens = [x for x in tokens if x != ''] # get rid of ''
+
+    return tokens
+
+def tokenize_regex(section):
+    '''
+    Same normalized tokens as tokenize_nltk, without sentence splitting and
+    without building the intermediate nltk tokens.
+
+    Inputs:
+        - section (str): a string from the visible text of a webpage
+
+    Outputs:
+        - tokens (lst): list of normalized tokens
+    '''
+    text = SEPARATORS.sub(' ', section.lower()) + ' '
+    if "'" in text:
+        text = CLITICS.sub(r' \1', text)
+    text = CONTRACTIONS.sub(r' \1 \2 ', text)
+
+    return PUNCTUATION.sub('', text).split()
+
+TOKENIZERS = {'nltk': tokenize_nltk, 'regex': tokenize_regex}
+
+def set_default(name):
+    '''
+    Selects the tokenizer used by tokenize ('nltk' or 'regex')
+    '''
+    global _default
+    if name not in TOKENIZERS:
+        raise ValueError('Unknown tokenizer {}, use one of {}'.format(
+                         name, list(TOKENIZERS)))
+    _default = name
+
+def get_default():
+    '''
+    Gets the name of the tokenizer used by tokenize
+    '''
+    return _default
+
+def tokenize(section):
+    '''
+    Splits a section of visible text into normalized tokens with the default
+    tokenizer.
+    '''
+    return TOKENIZERS[_default](section)
+
+def normalize_term(term):
+    '''
+    Normalizes a term the same way term_counter does, so that it can be
+    compared against tokens.
+
+    Inputs:
+        - term (str or lst of str): a one word term or a list of words
+
+    Outputs:
+        - key (tuple): tuple of lowercase words without punctuation
+    '''
+    if not isinstance(term, list): #put single word strings into a list
+        term = [term]
+
+    return tuple(PUNCTUATION.sub('', x).lower() for x in term)
+
+def check_parity(texts, max_examples=10):
+    '''
+    Compares the regex tokenizer against the nltk pipeline on a corpus.
+
+    Inputs:
+        - texts (lst): list of visible texts (list of strings), None values
+            are skipped
+        - max_examples (int): maximum number of differing sections to return
+
+    Outputs:
+        - sections (int): number of compared sections
+        - mismatches (int): number of sections with a different token stream
+        - examples (lst): list of (section, nltk tokens, regex tokens)
+    '''
+    sections = 0
+    mismatches = 0
+    examples = []
+    for visible_text in texts:
+        if visible_text is None:
+            continue
+        for section in visible_text:
+            sections += 1
+            expected = tokenize_nltk(section)
+            found = tokenize_regex(section)
+            if expected != found:
+                mismatches += 1
+                if len(examples) < max_examples:
+                    examples.append((section, expected, found))
+
+    return sections, mismatches, examples
@@ -0,0 +1,403 @@
+'''
+Trajectory script
+
+Term counts of every distinct capture of a page over its whole wayback
+history, instead of one capture before and after. Versions are listed with
+list_versions (collapse=digest), and a capture is only fetched and counted if
+its content digest was not seen before for that url: revisits and captures
+that go back to earlier content reuse the counts. Counts kept from a previous
+run are reused as well, so a new run only fetches the captures made since.
+New contents are counted incrementally (see counting.SectionCounter): only
+the sections that changed since the previous content of the url are counted,
+and those changes are kept to tell which sections drove a term's change.
+
+Trajectories are stored in one compressed npz file with the counts of each
+distinct content once, and the timestamp, status code and content row of
+every version:
+
+    get_trajectories('inputs/urls.csv', 'hhs', terms)
+    data = load_trajectories('hhs')
+    df = trajectory_frame(data) # one row per counted version
+    changes = content_changes(data, data['content'][i]) # of version i
+    drivers = counting.term_drivers(changes, terms, 'climate change')
+'''
+from scripts import instrumentation
+from scripts import internetarchive
+from scripts import get_content
+from scripts import counting
+from scripts import utils
+from scripts import surt
+from scripts.utils import compact_dtype, term_label
+from datetime import datetime
+import numpy as np
+import os
+
+TRAJECTORIES_FILE = 'outputs/{}_trajectories.npz'
+
+class Trajectory:
+    '''
+    Wayback history of a url.
+
+    Attributes:
+        - timestamps (lst): 14 digit timestamp of each version, oldest first
+        - status_codes (lst): status code of each version
+        - content (lst): index of the content of each version in digests,
+            -1 if it was not counted (not viable or the fetch failed)
+        - digests (lst): digest of each distinct content
+        - counts (lst): term counts of each distinct content
+        - ttal (lst): total number of words of each distinct content
+        - changes (lst): sections that changed in each distinct content since
+            the previous one counted (see counting.SectionCounter), None for
+            the first content of the url or if it was not counted
+            incrementally
+    '''
+    def __init__(self, id, url):
+        self.id = id
+        self.url = url
+        self.timestamps = []
+        self.status_codes = []
+        self.content = []
+        self.digests = []
+        self.counts = []
+        self.ttal = []
+        self.changes = []
+        self.status = None
+        self.exception = None
+        self.stats = instrumentation.StageStats()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add_content(self, digest, row, ttal, changes=None):
+        '''
+        Adds the counts of a new content, returns its index
+        '''
+        self.digests.append(digest)
+        self.counts.append(row)
+        self.ttal.append(ttal)
+        self.changes.append(changes)
+
+        return len(self.digests) - 1
+
+
+def get_trajectory(id, url, terms, dates=None, known=None, counter=None):
+    '''
+    Gets the Trajectory of a url: lists every version of its history (or of
+    a date range) and counts terms in each new content.
+
+    Inputs:
+        - id (int): id of the url (position in the input file)
+        - url (str): url to analyze
+        - terms (lst): list of terms to be looked for
+        - dates (lst): date range formatted as
+            [year_from, month_from, day_from, year_to, month_to, day_to],
+            the whole history by default
+        - known (dict): digest -> (counts, ttal, changes) of contents counted
+            in a previous run
+        - counter (SectionCounter): if given, contents are counted
+            incrementally and the sections that changed are kept in
+            trajectory.changes (see counting.term_drivers)
+
+    Outputs:
+        - trajectory (Trajectory): the Trajectory object, with status
+            'failed' if no version could be counted
+    '''
+    trajectory = Trajectory(id, url)
+    stats = trajectory.stats
+    known = known or {}
+    requests_before = utils.get_request_counts()
+    from_date = to_date = None
+    if dates is not None:
+        from_date, to_date = datetime(*dates[:3]), datetime(*dates[3:6])
+    try:
+        with internetarchive.WaybackClient() as client:
+            with stats.stage('cdx'):
+                versions = list(client.list_versions(url, from_date=from_date,
+                                                     to_date=to_date))
+        stats.count('cdx_records', len(versions))
+        index = {} # digest -> content index, None if the fetch failed
+        for version in versions:
+            content = -1
+            if version.status_code in get_content.VIABLE_STATUS_CODES:
+                if version.digest in index: # revisit of earlier content
+                    stats.count('repeated_captures')
+                else:
+                    result = known.get(version.digest)
+                    if result is None:
+                        try:
+                            result = count_version(version.raw_url, url, terms,
+                                                   stats, counter)
+                        except Exception as e:
+                            trajectory.exception = e
+                    else: # counted in a previous run
+                        stats.count('known_captures')
+                    index[version.digest] = None if result is None else \
+                        trajectory.add_content(version.digest, *result)
+                if index[version.digest] is not None:
+                    content = index[version.digest]
+            trajectory.timestamps.append(version.timestamp)
+            trajectory.status_codes.append(version.status_code)
+            trajectory.content.append(content)
+    except Exception as e: # no wayback versions or unparseable format
+        trajectory.exception = e
+    trajectory.status = 'succesful' if trajectory.digests else 'failed'
+    stats.update({name: value - requests_before.get(name, 0)
+                  for name, value in utils.get_request_counts().items()})
+
+    return trajectory
+
+def count_version(raw_url, url, terms, stats, counter=None):
+    '''
+    Fetches a version of a url and counts terms in it, incrementally from the
+    previous version counted by counter if given.
+
+    Outputs:
+        - row (lst): count of each term
+        - ttal (int): total number of words
+        - changes (lst): sections that changed (see SectionCounter.count),
+            None without a counter or for the first version counted
+    '''
+    if counter is None:
+        _, row, ttal = get_content.count_memento(raw_url, terms, stats)
+        return row, ttal, None
+    visible_text = get_content.fetch_visible_txt(raw_url, stats)
+    counted = counter.stats['counted']
+    previous = url in counter
+    with stats.stage('count'):
+        row, ttal, changes = counter.count(url, visible_text)
+    stats.count('sections', len(visible_text))
+    stats.count('counted_sections', counter.stats['counted'] - counted)
+
+    # every section is "added" in the first version, nothing worth keeping
+    return row, ttal, changes if previous else None
+
+def get_trajectories(input_file, output_file, terms, dates=None,
+                     trace_file=None, report=False, dedupe=False, resume=True,
+                     incremental=True):
+    '''
+    Counts the ocurrence of terms in every distinct capture of the history
+    of a list of urls.
+
+    Inputs:
+        - input_file (str): path to csv with urls
+        - output_file (str): "root name" of produced outputs
+        - terms (lst): list of terms to be looked for
+        - dates (lst): date range of the history (see get_trajectory)
+        - trace_file (str): if given, path of a JSONL file with the timings
+            and counters of every url (see instrumentation.RunTrace)
+        - report (bool): whether to print a report of the time spent in each
+            stage at the end (see instrumentation.RunTrace)
+        - dedupe (bool): whether urls with the same SURT key are looked up
+            only once
+        - resume (bool): whether the counts of the trajectories file of a
+            previous run with the same terms are reused
+        - incremental (bool): whether contents are counted incrementally
+            from the previous content of the url (see counting.SectionCounter)
+
+    Outputs:
+        - {output_file}_trajectories.npz: trajectories of every url (see
+            save_trajectories)
+        - a report of the time spent in each stage, printed at the end
+            if report
+    '''
+    from tqdm.auto import tqdm
+    urls = [elmt[0] for elmt in get_content.read_csv(input_file)]
+    if dedupe: # variants of the same url are only looked up once
+        unique_urls, positions = surt.dedupe(urls)
+    else:
+        unique_urls, positions = urls, [[i] for i in range(len(urls))]
+    known = {}
+    if resume and os.path.exists(TRAJECTORIES_FILE.format(output_file)):
+        known = known_contents(load_trajectories(output_file), terms)
+    counter = counting.SectionCounter(terms) if incremental else None
+    trajectories = [None] * len(urls)
+    trace = instrumentation.run_trace(trace_file, report)
+    try:
+        for idx_u, current_url in enumerate(tqdm(unique_urls, desc='progress: ')):
+            first = positions[idx_u][0]
+            original = get_trajectory(first + 1, current_url, terms, dates,
+                                      known.get(surt.surt(current_url)),
+                                      counter)
+            if counter is not None: # keep memory flat over long url lists
+                counter.forget(current_url)
+            for idx_e in positions[idx_u]:
+                trajectory = original
+                if idx_e != first: # same history, its own id and url
+                    trajectory = copy_trajectory(original, idx_e + 1, urls[idx_e])
+                trajectories[idx_e] = trajectory
+                trace.record(trajectory, urls[idx_e])
+    finally:
+        trace.close()
+
+    save_trajectories(trajectories, terms, output_file)
+    trace.report()
+
+def copy_trajectory(trajectory, id, url):
+    '''
+    Copies the Trajectory of a url for another input url with the same SURT
+    key
+    '''
+    duplicate = Trajectory(id, url)
+    duplicate.__dict__.update({name: value for name, value in
+                               trajectory.__dict__.items()
+                               if name not in ('id', 'url', 'stats')})
+    duplicate.stats.count('duplicates')
+
+    return duplicate
+
+def save_trajectories(trajectories, terms, output_file):
+    '''
+    Saves a list of Trajectory objects into a compressed npz file with the
+    arrays:
+        - terms: term labels (see utils.term_label)
+        - ids, urls: id and url of each trajectory
+        - offsets: versions of trajectory i are offsets[i]:offsets[i + 1]
+        - timestamps, status_codes (0 for revisits), content: timestamp,
+            status code and row in counts of each version (-1 if it was not
+            counted)
+        - digests, counts, ttal: digest, term counts and total number of
+            words of each distinct content, in the smallest integer dtype
+        - change_offsets: changes of content c are
+            change_offsets[c]:change_offsets[c + 1]
+        - incremental: whether each content has its changes since the
+            previous content (see Trajectory.changes)
+        - change_kinds, change_deltas, change_words: kind, change of each term
+            count and change of the number of words of each change
+        - change_sections, change_old: sections of change k are
+            change_sections[k]:change_sections[k + 1], the first change_old[k]
+            of them old, their texts are in section_text (utf-8) at
+            section_offsets
+    '''
+    trajectories = [t for t in trajectories if t is not None]
+    offsets = np.cumsum([0] + [len(t) for t in trajectories])
+    content = []
+    rows = 0
+    for t in trajectories:
+        content.extend(c + rows if c >= 0 else -1 for c in t.content)
+        rows += len(t.digests)
+    counts = np.array([row for t in trajectories for row in t.counts],
+                      dtype=np.int64).reshape(rows, len(terms))
+    ttal = np.array([n for t in trajectories for n in t.ttal], dtype=np.int64)
+    status_codes = [0 if code == '-' else int(code)
+                    for t in trajectories for code in t.status_codes]
+    changes = [t_changes or [] for t in trajectories for t_changes in t.changes]
+    flat = [change for c_changes in changes for change in c_changes]
+    deltas = np.array([change['delta'] for change in flat],
+                      dtype=np.int64).reshape(len(flat), len(terms))
+    sections = [section.encode() for change in flat
+                for section in change['old'] + change['new']]
+    np.savez_compressed(
+        TRAJECTORIES_FILE.format(output_file),
+        terms=np.array([term_label(term) for term in terms]),
+        ids=np.array([t.id for t in trajectories], dtype=np.int64),
+        urls=np.array([t.url for t in trajectories]),
+        offsets=offsets.astype(np.int64),
+        timestamps=np.array([int(ts) for t in trajectories
+                             for ts in t.timestamps], dtype=np.int64),
+        status_codes=np.array(status_codes, dtype=np.int16),
+        content=np.array(content, dtype=np.int32),
+        digests=np.array([d for t in trajectories for d in t.digests],
+                         dtype='S32'),
+        counts=counts.astype(compact_dtype(counts)),
+        ttal=ttal.astype(compact_dtype(ttal)),
+        change_offsets=np.cumsum([0] + [len(c) for c in changes]).astype(np.int64),
+        incremental=np.array([c is not None for t in trajectories
+                              for c in t.changes], dtype=bool),
+        change_kinds=np.array([change['kind'] for change in flat], dtype='S7'),
+        change_deltas=deltas.astype(compact_dtype(deltas)),
+        change_words=np.array([change['words'] for change in flat],
+                              dtype=np.int64),
+        change_sections=np.cumsum([0] + [len(change['old']) + len(change['new'])
+                                         for change in flat]).astype(np.int64),
+        change_old=np.array([len(change['old']) for change in flat],
+                            dtype=np.int64),
+        section_offsets=np.cumsum([0] + [len(s) for s in sections]).astype(np.int64),
+        section_text=np.frombuffer(b''.join(sections), dtype=np.uint8))
+
+def load_trajectories(output_file):
+    '''
+    Loads the arrays of a trajectories file (see save_trajectories) into a
+    dict
+    '''
+    with np.load(TRAJECTORIES_FILE.format(output_file)) as data:
+        return {name: data[name] for name in data.files}
+
+def known_contents(data, terms):
+    '''
+    Gets the counts of every content in a trajectories file, to be reused by
+    get_trajectory. Raises ValueError if the file has other terms.
+
+    Outputs:
+        - known (dict): SURT key -> {digest: (counts, ttal, changes)}
+    '''
+    if list(data['terms']) != [term_label(term) for term in terms]:
+        raise ValueError('The trajectories file was counted with other terms')
+    known = {}
+    for i, url in enumerate(data['urls']):
+        contents = known.setdefault(surt.surt(url), {})
+        versions = data['content'][data['offsets'][i]:data['offsets'][i + 1]]
+        for c in versions[versions >= 0]:
+            contents[data['digests'][c].decode()] = (data['counts'][c].tolist(),
+                                                     int(data['ttal'][c]),
+                                                     content_changes(data, c))
+
+    return known
+
+def content_changes(data, c):
+    '''
+    Gets the changes of a content of a trajectories file, as returned by
+    SectionCounter.count, to be passed to counting.term_drivers.
+
+    Inputs:
+        - data (dict): arrays returned by load_trajectories
+        - c (int): row of the content in counts (see the content array)
+
+    Outputs:
+        - changes (lst): sections that changed since the previous content of
+            the url, None if they were not kept (see Trajectory.changes)
+    '''
+    if 'incremental' not in data or not data['incremental'][c]: # older files
+        return None
+    offsets = data['section_offsets']
+    changes = []
+    for k in range(data['change_offsets'][c], data['change_offsets'][c + 1]):
+        texts = [data['section_text'][offsets[i]:offsets[i + 1]].tobytes().decode()
+                 for i in range(data['change_sections'][k],
+                                data['change_sections'][k + 1])]
+        n_old = data['change_old'][k]
+        changes.append({'kind': data['change_kinds'][k].decode(),
+                        'old': texts[:n_old], 'new': texts[n_old:],
+                        'delta': data['change_deltas'][k].astype(np.int64),
+                        'words': int(data['change_words'][k])})
+
+    return changes
+
+def trajectory_frame(data, ids=None):
+    '''
+    Expands a trajectories file into a dataframe with one row per counted
+    version.
+
+    Inputs:
+        - data (dict): arrays returned by load_trajectories
+        - ids (lst): ids of the urls to keep, all by default
+
+    Outputs:
+        - df (df): columns id, url, date, status_code, ttal and one column per
+            term
+    '''
+    import pandas as pd
+    lengths = np.diff(data['offsets'])
+    version_ids = np.repeat(data['ids'], lengths)
+    keep = data['content'] >= 0
+    if ids is not None:
+        keep &= np.isin(version_ids, ids)
+    content = data['content'][keep]
+    df = pd.DataFrame(data['counts'][content], columns=list(data['terms']))
+    df.insert(0, 'id', version_ids[keep])
+    df.insert(1, 'url', np.repeat(data['urls'], lengths)[keep])
+    df.insert(2, 'date', pd.to_datetime(data['timestamps'][keep].astype(str),
+                                        format='%Y%m%d%H%M%S'))
+    df.insert(3, 'status_code', data['status_codes'][keep])
+    df.insert(4, 'ttal', data['ttal'][content])
+
+    return df
@@ -2,14 +2,15 @@ from collections import defaultdict
 from contextlib import contextmanager
 import hashlib
 import io
-import lxml.html
 import os
 import requests
+import threading
 import time
 
 
 def extract_title(content_bytes, encoding='utf-8'):
     "Return content of <title> tag as string. On failure return empty string."
+    import lxml.html
     content_str = content_bytes.decode(encoding=encoding, errors='ignore')
     # The parser expects a file-like, so we mock one.
     content_as_file = io.StringIO(content_str)
@@ -28,10 +29,47 @@ def hash_content(content_bytes):
     return hashlib.sha256(content_bytes).hexdigest()
 
 
+def term_label(term):
+    "Return the column name of a term, multi word terms are joined by spaces."
+    return term if isinstance(term, str) else ' '.join(map(str, term))
+
+
+def compact_dtype(values):
+    """
+    Return the smallest signed integer dtype that holds an array of counts
+    (signed so that post - pre differences do not wrap around).
+    """
+    import numpy as np
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    for dtype in [np.int8, np.int16, np.int32]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
 def _should_retry(response):
     return response.status_code == 503 or response.status_code == 504
 
 
+# Requests, retries and bytes received by `retryable_request` in this process,
+# read by the pipeline instrumentation. Requests are made from thread pools
+# (get_content.get_hrefs), so the counts are only updated and read under the
+# lock.
+request_counts = defaultdict(int)
+_request_counts_lock = threading.Lock()
+
+
+def _count_request(name, value=1):
+    with _request_counts_lock:
+        request_counts[name] += value
+
+
+def get_request_counts():
+    "Return a copy of the request counts of this process."
+    with _request_counts_lock:
+        return dict(request_counts)
+
+
 def retryable_request(method, url, retries=3, backoff=20,
                       should_retry=_should_retry, session=None, **kwargs):
     """
@@ -66,7 +104,11 @@ def retryable_request(method, url, retries=3, backoff=20,
     """
     internal_session = session or requests.Session()
     response = internal_session.request(method, url, **kwargs)
+    _count_request('requests')
+    if not kwargs.get('stream'):
+        _count_request('bytes', len(response.content))
     if should_retry(response) and retries > 0:
+        _count_request('retries')
         time.sleep(backoff / retries)
         response = retryable_request(method, url, retries - 1, backoff,
                                      session=internal_session, **kwargs)
@@ -0,0 +1,101 @@
+'''
+Test fixtures
+
+Run from the src folder:
+    python -m pytest tests
+'''
+import pytest
+import pickle
+import sys
+import os
+
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_PATH)
+
+from scripts.synthetic import TERMS, DATES_PRE, DATES_POST, synthetic_corpus
+from scripts import internetarchive
+from scripts import tokenizer
+
+@pytest.fixture(autouse=True)
+def regex_tokenizer():
+    '''
+    Counts with the regex tokenizer, which does not need the nltk data
+    '''
+    default_method = tokenizer.get_default()
+    tokenizer.set_default('regex')
+    yield
+    tokenizer.set_default(default_method)
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    '''
+    Runs a test from an empty folder with an outputs folder, as the scripts
+    expect
+    '''
+    os.makedirs(str(tmp_path / 'outputs'))
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
+
+@pytest.fixture
+def archive(work_dir, monkeypatch):
+    '''
+    Starts the local fake archive on a corpus, writes its urls to input.csv
+    and points the wayback client at it. Returns the FakeArchive object.
+    '''
+    from scripts.fake_archive import FakeArchive
+    archives = []
+    def start(urls, corpus, **options):
+        with open('input.csv', 'w') as f:
+            f.write(''.join(url + '\n' for url in urls))
+        archives.append(FakeArchive(corpus, **options).start())
+        monkeypatch.setenv(internetarchive.ARCHIVE_ROOT_ENV, archives[-1].url)
+        return archives[-1]
+    yield start
+    for fake_archive in archives:
+        fake_archive.stop()
+
+@pytest.fixture
+def read_outputs():
+    '''
+    Reads the outputs of get_output (or of a merge or export of the same
+    files): the csv files and the id, status, counts and url of every
+    Snapshot
+    '''
+    def read(output_file):
+        outputs = {}
+        for name in ['pre', 'post', 'data']:
+            with open('outputs/{}_{}.csv'.format(output_file, name)) as f:
+                outputs[name] = f.read()
+        with open('outputs/snapshots_{}.txt'.format(output_file), 'rb') as fp:
+            outputs['snapshots'] = [(s.id, s.status, s.pre['results'],
+                                     s.post['results'], s.post['url'])
+                                    for s in pickle.load(fp)]
+        return outputs
+    return read
+
+@pytest.fixture
+def reference_run(archive, read_outputs):
+    '''
+    Runs get_output on one node over a synthetic corpus in the fake archive,
+    as the reference that other ways of crawling the same input must match.
+    Every tenth input url is a variant (http, no www.) of an earlier one.
+
+    Inputs:
+        - n_urls (int): number of urls of the corpus
+        - options: passed on to get_output
+
+    Outputs:
+        - urls (lst): input urls
+        - fake_archive (FakeArchive): the running fake archive
+        - outputs (dict): "reference" outputs (see read_outputs)
+    '''
+    from scripts import get_content
+    def run(n_urls=20, **options):
+        urls, corpus = synthetic_corpus(n_urls)
+        urls += [url.replace('https://www.', 'http://') for url in urls[::10]]
+        fake_archive = archive(urls, corpus)
+        get_content.get_output('input.csv', 'reference', TERMS, DATES_PRE,
+                               DATES_POST, **options)
+        return urls, fake_archive, read_outputs('reference')
+    return run
@@ -0,0 +1,116 @@
+'''
+Tests of the analysis script
+'''
+from scripts.synthetic import TERMS, department_frames, result_files
+from scripts.cube import AggregateCube
+from scripts import analysis
+import numpy as np
+import pandas as pd
+import pytest
+
+P_VALUES = [0.01, 0.04, 0.03, np.nan, 0.2]
+
+def test_department_changes_match_masks():
+    df_pre, df_post, term_cols = department_frames(500, 7, 40)
+    cube = AggregateCube.from_frames(df_pre, df_post, term_cols)
+    terms, totals = analysis.department_changes(df_pre, df_post, term_cols,
+                                                'ttal', term_cols[:2], cube)
+    assert len(totals) == 7
+    for department in totals.department:
+        pre = df_pre[df_pre.department == department][term_cols].sum(axis=0)
+        post = df_post[df_post.department == department][term_cols].sum(axis=0)
+        changes = post - pre
+        found = terms[(terms.department == department) & (terms.change != 0)]
+        assert dict(changes[changes != 0]) == dict(zip(found.term, found.change))
+    # the cube is built from the frames when it is not given
+    terms_built, totals_built = analysis.department_changes(
+        df_pre, df_post, term_cols, 'ttal', term_cols[:2])
+    assert terms_built.equals(terms) and totals_built.equals(totals)
+
+@pytest.mark.parametrize('method, expected', [
+    ('bonferroni', [0.04, 0.16, 0.12, np.nan, 0.8]),
+    ('holm', [0.04, 0.09, 0.09, np.nan, 0.2]),
+    ('fdr_bh', [0.04, 0.16 / 3, 0.16 / 3, np.nan, 0.2]),
+    (None, P_VALUES),
+])
+def test_adjust_p_values(method, expected):
+    np.testing.assert_allclose(analysis.adjust_p_values(P_VALUES, method),
+                               expected)
+
+def test_adjust_p_values_edges():
+    np.testing.assert_allclose(
+        analysis.adjust_p_values([0.5, 0.3], 'bonferroni'), [1, 0.6])
+    assert np.isnan(analysis.adjust_p_values([np.nan], 'holm')).all()
+    with pytest.raises(ValueError):
+        analysis.adjust_p_values(P_VALUES, 'sidak')
+
+def test_paired_resampling_tests():
+    rng = np.random.RandomState(0)
+    diffs = np.column_stack([rng.normal(0, 1, 300), rng.normal(1, 1, 300),
+                             rng.randint(-2, 3, 300)])
+    results = analysis.paired_resampling_tests(diffs, 2000)
+    permutation_p, low, high, bootstrap_p = results
+    assert permutation_p[1] < 0.001 and bootstrap_p[1] < 0.001
+    assert low[1] < diffs[:, 1].mean() < high[1]
+    assert permutation_p[0] > 0.01
+    # chunks of one resample give the same results as the default budget
+    for small, default in zip(analysis.paired_resampling_tests(
+            diffs, 2000, chunk_bytes=1), results):
+        np.testing.assert_allclose(small, default)
+    # lists and integer matrices are cast before anything is computed
+    counts = rng.randint(-2, 3, (50, 2))
+    for listed, cast in zip(
+            analysis.paired_resampling_tests(counts.tolist(), 500),
+            analysis.paired_resampling_tests(counts.astype(float), 500)):
+        np.testing.assert_allclose(listed, cast)
+
+def test_significance_batch_matches_test_significance(capsys):
+    pytest.importorskip('scipy')
+    df_pre, df_post, _ = department_frames(60, 3, 2)
+    rng = np.random.RandomState(0)
+    df_pre['score'] = rng.normal(0, 1, 60)
+    df_post['score'] = df_pre['score'] + rng.normal(0.3, 1, 60)
+    columns = ['ttal', 'score']
+    for correction in [None, 'fdr_bh']:
+        results = analysis.test_significance_batch(
+            df_pre, df_post, columns, by='department', n_resamples=200,
+            correction=correction)
+        np.testing.assert_allclose(
+            results.p_adjusted,
+            analysis.adjust_p_values(results.p_value, correction))
+    # without correction, the same verdicts as test_significance
+    results = analysis.test_significance_batch(df_pre, df_post, columns,
+                                               n_resamples=200, correction=None)
+    capsys.readouterr()
+    for group, frames in [('all', (df_pre, df_post))] + \
+            [(name, (df_pre[df_pre.department == name],
+                     df_post[df_post.department == name]))
+             for name in sorted(df_pre.department.unique())]:
+        for column in columns:
+            row = results[(results.group == group) & (results.column == column)]
+            analysis.test_significance(*frames, column, 5, bool(row.normal.iloc[0]))
+            printed = capsys.readouterr().out
+            assert ('is statistically significant' in printed) == \
+                bool(row.significant.iloc[0]), (group, column)
+
+def test_load_final_df_matches_merges(work_dir):
+    one_word = [t for t in TERMS if not isinstance(t, list)]
+    multi_word = [t for t in TERMS if isinstance(t, list)]
+    result_files(200, one_word + multi_word)
+    df_pre, df_post, col_names = analysis.load_final_df(
+        'departments.csv', multi_word, one_word, 'bench')
+    data = analysis.fetch_additional_data('outputs/snapshots_bench.txt',
+                                          multi_word, one_word)
+    departments = pd.read_csv('departments.csv')
+    columns = col_names + ['id', 'ttal']
+    for df, name, additional in zip([df_pre, df_post], ['pre', 'post'], data[:2]):
+        expected = analysis.clean_matrix('outputs/bench_{}.csv'.format(name),
+                                         col_names)
+        expected = expected.merge(additional, how='left', left_on='id',
+                                  right_on='id')
+        expected = expected.merge(departments, how='left', left_on='id',
+                                  right_on='id')
+        assert len(df) == 180 # every tenth url failed
+        np.testing.assert_array_equal(df[columns].to_numpy(dtype=float),
+                                      expected[columns].to_numpy(dtype=float))
+        assert list(df.department) == list(expected.department)
@@ -0,0 +1,47 @@
+'''
+Tests of the benchmarks and synthetic scripts
+'''
+from scripts.synthetic import (TERMS, synthetic_corpus, history_corpus,
+                               window_corpus, section_versions)
+from scripts import benchmarks
+from scripts import get_content
+
+def test_find_regressions():
+    baseline = [{'pages': 100, 'stage': 'cdx', 'items_per_s': 1000,
+                 'peak_bytes': 1000},
+                {'pages': 100, 'stage': 'sentiment', 'items_per_s': 50,
+                 'peak_bytes': None}]
+    results = [{'pages': 100, 'stage': 'cdx', 'items_per_s': 850,
+                'peak_bytes': 1300},
+               {'pages': 100, 'stage': 'sentiment', 'items_per_s': 30,
+                'peak_bytes': 10},
+               {'pages': 1000, 'stage': 'cdx', 'items_per_s': 1,
+                'peak_bytes': 1}]
+    assert benchmarks.find_regressions(results, baseline) == [
+        'cdx at 100 pages: peak 1300 bytes, was 1000',
+        'sentiment at 100 pages: 30 items/s, was 50']
+    assert benchmarks.find_regressions(results, baseline, tolerance=0.5) == []
+
+def test_corpora_are_deterministic():
+    for generate in [synthetic_corpus, history_corpus, window_corpus]:
+        assert generate(5, seed=1) == generate(5, seed=1)
+        assert generate(5, seed=1) != generate(5, seed=2)
+    assert section_versions(3, 4, seed=1) == section_versions(3, 4, seed=1)
+
+def test_synthetic_pages_keep_main_content():
+    urls, corpus = synthetic_corpus(3)
+    text = get_content.extract_visible_txt(corpus[0]['body'])
+    assert text and not any('Skip to main content' in section or
+                            'Content last reviewed' in section
+                            for section in text)
+
+def test_reference_run(reference_run):
+    urls, fake_archive, outputs = reference_run(10)
+    assert len(urls) == 11
+    assert len(outputs['snapshots']) == len(urls)
+    assert outputs['pre'].count('\n') == len(urls)
+    assert fake_archive.stats['memento'] > 0
+    assert [id for id, _, _, _, _ in outputs['snapshots']] == \
+        list(range(1, len(urls) + 1))
+    assert all(len(row) == len(TERMS) for _, status, pre, post, _ in
+               outputs['snapshots'] if status == 'succesful' for row in [pre, post])
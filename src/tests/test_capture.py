@@ -0,0 +1,91 @@
+'''
+Tests of the capture script
+'''
+from scripts.capture import CaptureQueue
+import threading
+import pytest
+import csv
+
+class StubSave:
+    '''
+    Stands in for savepagenow: urls containing "fail" fail on their first
+    attempts, every other url is captured
+    '''
+    def __init__(self, failures=1, block=None):
+        self.calls = []
+        self.failures = failures
+        self.block = block
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        if self.block is not None:
+            self.block.wait()
+        with self._lock:
+            self.calls.append(url)
+            attempt = self.calls.count(url)
+        if 'fail' in url and attempt <= self.failures:
+            raise ConnectionError('save failed')
+        return 'https://web.archive.org/web/2026/' + url, attempt == 1
+
+class WorkerDied(BaseException):
+    pass
+
+def read_log(log_file):
+    with open(log_file) as f:
+        return [(row['url'], row['status'], row['attempts'])
+                for row in csv.DictReader(f)]
+
+def test_captures_and_retries(tmp_path):
+    save = StubSave(failures=1)
+    log_file = str(tmp_path / 'captures.csv')
+    with CaptureQueue(log_file, calls_per_second=0, backoff=0,
+                      retries=1, capture_function=save) as captures:
+        for url in ['a.gov', 'fail.gov', 'b.gov']:
+            assert captures.put(url)
+    assert read_log(log_file) == [('a.gov', 'captured', '1'),
+                                  ('fail.gov', 'cached', '2'),
+                                  ('b.gov', 'captured', '1')]
+    assert captures.counts == {'captured': 2, 'cached': 1, 'failed': 0,
+                               'skipped': 0}
+    assert not captures.put('c.gov') # closed
+    captures.close() # closing again does nothing
+
+def test_full_queue_skips():
+    block = threading.Event()
+    save = StubSave(block=block)
+    captures = CaptureQueue(calls_per_second=0, maxsize=2,
+                            capture_function=save)
+    results = [captures.put('{}.gov'.format(i)) for i in range(5)]
+    block.set()
+    captures.close()
+    # the worker may have taken the first url before the others were put
+    assert results[:3] == [True, True, True] or \
+        results[:3] == [True, True, False]
+    assert not results[-1]
+    assert captures.counts['captured'] + captures.counts['skipped'] == 5
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_close_does_not_block_on_a_dead_worker():
+    def die(url):
+        raise WorkerDied()
+    captures = CaptureQueue(calls_per_second=0, maxsize=3, capture_function=die)
+    for i in range(4):
+        captures.put('{}.gov'.format(i))
+    captures._thread.join(5)
+    assert not captures._thread.is_alive()
+    for i in range(3): # the queue fills up behind the dead worker
+        captures.put('more{}.gov'.format(i))
+    closer = threading.Thread(target=captures.close)
+    closer.start()
+    closer.join(5)
+    assert not closer.is_alive()
+    assert len(captures) == 0
+
+def test_get_output_closes_the_queue(reference_run):
+    save = StubSave()
+    captures = CaptureQueue('captures.csv', calls_per_second=0,
+                            capture_function=save)
+    urls, _, _ = reference_run(5, capture_queue=captures)
+    assert captures._closed and not captures._thread.is_alive()
+    assert sorted(url for url, _, _ in read_log('captures.csv')) == sorted(urls)
+    assert sorted(save.calls) == sorted(urls)
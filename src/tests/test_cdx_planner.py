@@ -0,0 +1,82 @@
+'''
+Tests of the cdx_planner script
+'''
+from scripts.synthetic import TERMS, DATES_PRE, DATES_POST, window_corpus
+from scripts import cdx_planner
+from scripts import get_content
+from datetime import datetime
+
+class RecordingClient:
+    '''
+    Records the CDX searches of a scan, without results
+    '''
+    def __init__(self):
+        self.searches = []
+
+    def search(self, url, **kwargs):
+        self.searches.append((url, kwargs['from_date'], kwargs['to_date']))
+        return iter([])
+
+    def close(self):
+        pass
+
+def test_group_prefix():
+    assert cdx_planner.group_prefix('gov,hhs)/programs/social/index.html') == \
+        ('hhs.gov/programs/', 'prefix')
+    assert cdx_planner.group_prefix('gov,hhs)/programs/social/index.html', 2) == \
+        ('hhs.gov/programs/social/', 'prefix')
+    # a scan of the whole host, looked up one url at a time instead
+    assert cdx_planner.group_prefix('gov,hhs)/') is None
+    assert cdx_planner.group_prefix('gov,hhs)/about.html') is None
+
+def test_root_urls_are_looked_up_one_at_a_time():
+    urls = ['https://www.hhs.gov/programs/{}.html'.format(i) for i in range(5)]
+    roots = ['https://www.hhs.gov/', 'https://www.hhs.gov/about.html']
+    groups, singles = cdx_planner.group_urls(urls + roots)
+    assert list(groups) == [('hhs.gov/programs/', 'prefix')]
+    assert singles == roots
+    plan = cdx_planner.scan(urls + roots, [DATES_PRE, DATES_POST],
+                            client=RecordingClient())
+    assert not any(url in plan for url in roots)
+
+def test_merge_ranges():
+    assert cdx_planner.merge_ranges([[2018, 1, 1, 2018, 1, 31],
+                                     [2016, 1, 1, 2016, 6, 30],
+                                     [2016, 3, 1, 2016, 12, 31]]) == \
+        [(datetime(2016, 1, 1), datetime(2016, 12, 31)),
+         (datetime(2018, 1, 1), datetime(2018, 1, 31))]
+
+def test_scans_are_limited_to_the_date_ranges():
+    urls = ['https://www.hhs.gov/programs/{}.html'.format(i) for i in range(5)]
+    windows = get_content.yearly_windows(2016, 2018)
+    client = RecordingClient()
+    plan = cdx_planner.scan(urls, windows, client=client)
+    assert client.searches == [('hhs.gov/programs/',) + get_content.window_range(dates)
+                               for dates in windows]
+    assert plan.stats['scans'] == 3
+    assert not any(url in plan for url in urls) # no records, fall back
+
+def test_bulk_cdx_matches_per_url_search(reference_run, read_outputs):
+    urls, fake_archive, outputs = reference_run(20)
+    fake_archive.stats.update(cdx=0)
+    get_content.get_output('input.csv', 'bulk', TERMS, DATES_PRE, DATES_POST,
+                           bulk_cdx=True)
+    assert fake_archive.stats['cdx'] < len(urls)
+    assert read_outputs('bulk') == outputs
+
+def test_bulk_cdx_matches_per_url_search_in_windows(archive):
+    urls, corpus = window_corpus(12, 2016, 2020)
+    fake_archive = archive(urls, corpus)
+    windows = get_content.yearly_windows(2016, 2020)
+    outputs = {}
+    for name, bulk_cdx in [('search', False), ('bulk', True)]:
+        fake_archive.stats.update(cdx=0)
+        get_content.get_output_windows('input.csv', name, TERMS, windows,
+                                       bulk_cdx=bulk_cdx)
+        outputs[name] = []
+        for suffix in [get_content.window_label(dates) for dates in windows] + \
+                      ['windows']:
+            with open('outputs/{}_{}.csv'.format(name, suffix)) as f:
+                outputs[name].append(f.read())
+    assert fake_archive.stats['cdx'] < len(urls)
+    assert outputs['bulk'] == outputs['search']
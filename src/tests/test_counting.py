@@ -0,0 +1,54 @@
+'''
+Tests of the counting script
+'''
+from scripts.synthetic import TERMS, section_versions
+from scripts import counting
+import numpy as np
+
+def test_count_terms():
+    text = ['Gender identity and sexual orientation.',
+            'Gender, sex and LGBT youth; gender identity']
+    assert counting.count_terms(text, TERMS) == ([3, 0, 1, 1, 2, 1], 12)
+
+def test_section_counter_matches_count_terms():
+    counter = counting.SectionCounter(TERMS)
+    for i, versions in enumerate(section_versions(20, 10, changed=3)):
+        for text in versions:
+            assert counter.count(i, text)[:2] == counting.count_terms(text, TERMS)
+        counter.forget(i)
+    # only the sections that changed are counted again
+    assert counter.stats['counted'] < counter.stats['sections'] / 2
+
+def test_section_changes_add_up():
+    counter = counting.SectionCounter(TERMS)
+    previous = None
+    for text in section_versions(1, 10, changed=3)[0]:
+        row, ttal, changes = counter.count('url', text)
+        if previous is not None:
+            assert list(np.array(previous[0]) +
+                        sum(c['delta'] for c in changes)) == row
+            assert previous[1] + sum(c['words'] for c in changes) == ttal
+        previous = row, ttal
+    assert 'url' in counter
+    counter.forget('url')
+    assert 'url' not in counter
+
+def test_term_drivers():
+    counter = counting.SectionCounter(TERMS)
+    counter.count('url', ['Health services.', 'Gender identity data.',
+                          'Civil rights.'])
+    _, _, changes = counter.count('url', ['Health services.', 'Civil rights.',
+                                          'Sex and gender, gender.'])
+    drivers = counting.term_drivers(changes, TERMS, 'gender')
+    assert drivers == [('added', [], ['Sex and gender, gender.'], 2),
+                       ('removed', ['Gender identity data.'], [], -1)]
+    assert counting.term_drivers(changes, TERMS, 'lgbt') == []
+
+def test_count_corpus_keeps_order():
+    texts = [versions[0] for versions in section_versions(30, 1)] + [None]
+    expected = [counting.count_terms(text, TERMS) for text in texts[:-1]]
+    for processes in [1, 2]:
+        counts, ttal = counting.count_corpus(texts, TERMS, processes=processes,
+                                             chunksize=7)
+        assert [(row.tolist(), n) for row, n in zip(counts, ttal)] == \
+            expected + [([0] * len(TERMS), -1)]
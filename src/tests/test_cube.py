@@ -0,0 +1,56 @@
+'''
+Tests of the cube script
+'''
+from scripts.synthetic import department_frames
+from scripts.cube import AggregateCube
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+def test_cube_updates_match_rebuilt_cube():
+    df_pre, df_post, term_cols = department_frames(300, 5, 20)
+    cube = AggregateCube.from_frames(df_pre, df_post, term_cols)
+    new_counts = df_pre[term_cols].to_numpy()
+    for id, row, ttal, department in zip(df_pre['id'], new_counts,
+                                         df_pre['ttal'], df_pre['department']):
+        cube.add(id, 'post', row, ttal, department)
+    df_new = df_post.copy()
+    df_new[term_cols] = new_counts
+    rebuilt = AggregateCube.from_frames(df_pre, df_new, term_cols)
+    for department in df_pre.department.unique():
+        np.testing.assert_allclose(cube.slice(department)[0],
+                                   rebuilt.slice(department)[0])
+
+def test_incremental_cube_matches_from_frames():
+    df_pre, df_post, term_cols = department_frames(200, 4, 10)
+    hosts = ['www.hhs.gov', 'aidsinfo.nih.gov', 'www.cdc.gov']
+    # some urls moved to another agency between the periods
+    df_pre['url'] = ['https://web.archive.org/web/2016id_/https://{}/{}'.format(
+                     hosts[i % 3], i) for i in range(len(df_pre))]
+    df_post['url'] = ['https://web.archive.org/web/2019id_/https://{}/{}'.format(
+                      hosts[i % 2], i) for i in range(len(df_post))]
+    frames = {'pre': df_pre, 'post': df_post}
+    snapshots = []
+    for i in range(len(df_pre)):
+        rows = {period: df.iloc[i] for period, df in frames.items()}
+        snapshots.append(SimpleNamespace(id=rows['pre']['id'], status='succesful',
+            **{period: {'url': row['url'], 'word_count': row['ttal'],
+                        'results': row[term_cols].tolist()}
+               for period, row in rows.items()}))
+    departments = dict(zip(df_pre['id'], df_pre['department']))
+    incremental = AggregateCube(term_cols, departments)
+    incremental.update(snapshots)
+    built = AggregateCube.from_frames(df_pre, df_post, term_cols)
+    assert sorted(incremental.groups) == sorted(built.groups)
+    for by in ['department', 'agency', None]:
+        labels, counts, ttal = incremental.aggregate(by)
+        built_labels, built_counts, built_ttal = built.aggregate(by)
+        assert labels == built_labels
+        np.testing.assert_allclose(counts, built_counts)
+        np.testing.assert_allclose(ttal, built_ttal)
+    # a url without a post row keeps the agency of its pre row
+    lone = df_pre.iloc[:1].assign(id=0, department='lone',
+                                  url='https://www.cdc.gov/lone')
+    cube = AggregateCube.from_frames(pd.concat([df_pre, lone]), df_post,
+                                     term_cols)
+    assert ('lone', 'cdc.gov') in cube.groups
@@ -0,0 +1,131 @@
+'''
+Tests of the get_content script
+'''
+from scripts.synthetic import TERMS, window_corpus
+from scripts import instrumentation
+from scripts import internetarchive
+from scripts import get_content
+import queue
+import pytest
+
+SEARCH_URL = 'https://search.usa.gov/search?query=lgbt&page={}'
+
+def search_page(links):
+    return ('<html><body><div id="nav"><a href="https://www.hhs.gov/nav">nav</a>'
+            '</div><div id="results">' +
+            ''.join('<a href="{}">result</a>'.format(link) for link in links) +
+            '</div></body></html>')
+
+@pytest.mark.parametrize('link, accepted', [
+    ('https://www.hhs.gov/programs/index.html', True),
+    ('https://www.hhs.gov/report.pdf', False),
+    ('https://www.hhs.gov/slides.pptx', False),
+    ('https://www.hhs.gov/spanish/index.html', False),
+    ('https://www.hhs.gov/espanol/index.html', False),
+    ('https://www.hhs.gov/news/2019.html', False),
+    ('https://www.health.ny.gov/index.html', False),
+    ('https://www.example.com/index.html', False),
+])
+def test_accepted_link(link, accepted):
+    assert get_content.accepted_link(link) == accepted
+
+def test_not_accepted_rules():
+    assert '.pptx' in get_content.NOT_ACCEPTED
+    assert 'spanish' in get_content.NOT_ACCEPTED
+
+def search_corpus(n_pages):
+    urls = [SEARCH_URL.format(i) for i in range(n_pages)]
+    corpus = []
+    for i, url in enumerate(urls):
+        links = ['https://www.hhs.gov/page-{}.html'.format(i),
+                 'https://WWW.HHS.GOV/Page-{}.html'.format(i + 1),
+                 'https://www.hhs.gov/page-{}.pdf'.format(i)]
+        corpus.append({'url': url, 'timestamp': '20190802120000',
+                       'body': search_page(links)})
+        corpus.append({'url': url, 'timestamp': '20190805120000',
+                       'body': search_page(links[:1])})
+    return urls, corpus
+
+def test_page_hrefs(archive):
+    urls, corpus = search_corpus(1)
+    archive(urls, corpus)
+    clients = queue.Queue()
+    with internetarchive.WaybackClient() as client:
+        clients.put(client)
+        # the latest version of the page, only the links in the results
+        assert get_content._page_hrefs(urls[0], clients) == \
+            ['https://www.hhs.gov/page-0.html']
+        assert clients.qsize() == 1 # the client is given back
+
+def test_get_hrefs_with_workers(archive):
+    urls, corpus = search_corpus(12)
+    # pages without captures fail, in input order
+    missing = [SEARCH_URL.format('missing-{}'.format(i)) for i in range(4)]
+    urls = [url for pair in zip(urls[:4], missing) for url in pair] + urls[4:]
+    archive(urls, corpus)
+    url_set, exceptions = get_content.get_hrefs(urls, max_workers=1)
+    assert url_set == {'https://www.hhs.gov/page-{}.html'.format(i)
+                       for i in range(12)}
+    assert exceptions == missing
+    assert get_content.get_hrefs(urls, max_workers=4) == (url_set, exceptions)
+
+def test_get_urls_cdx(archive):
+    from datetime import datetime
+    captures = {
+        'https://www.hud.gov/a.html': ['20150101', '20170301', '20170601',
+                                       '20171201', '20190101'],
+        'https://www.hud.gov/b.html': ['20170401'],
+        'https://www.hud.gov/c.html': ['20150101', '20190101'], # not in the window
+        'https://www.hud.gov/d.html': ['20170501', '20170701'],
+        'https://www.hud.gov/e.pdf': ['20170501'],
+    }
+    corpus = []
+    for url, days in captures.items():
+        for i, day in enumerate(days):
+            # a.html does not change after March, d.html is a copy of b.html
+            body = 'b' if url.endswith('d.html') else url + str(min(i, 1))
+            corpus.append({'url': url, 'timestamp': day + '120000', 'body': body,
+                           'mime': 'application/pdf' if url.endswith('.pdf')
+                                   else 'text/html'})
+    fake_archive = archive([], corpus)
+    rows = get_content.get_urls_cdx('hud.gov', '2017-01-01', '2017-12-31',
+                                    'urls.csv')
+    prefix = get_content.WAYBACK_URLS_PREFIX
+    assert rows == [
+        [prefix + 'https://www.hud.gov/a.html', datetime(2017, 3, 1),
+         datetime(2017, 3, 1)],
+        [prefix + 'https://www.hud.gov/b.html', datetime(2017, 4, 1),
+         datetime(2017, 4, 1)],
+        # its captures collapse into the line of b.html, which has the same
+        # digest, so date_to falls back to its first capture
+        [prefix + 'https://www.hud.gov/d.html', datetime(2017, 5, 1),
+         datetime(2017, 5, 1)]]
+    assert fake_archive.stats['cdx'] == 2
+    with open('urls.csv') as f:
+        assert len(f.read().splitlines()) == 3
+
+def test_windows_match_per_window_lookups(archive):
+    urls, corpus = window_corpus(10, 2016, 2020)
+    archive(urls, corpus)
+    windows = get_content.yearly_windows(2016, 2020)
+    get_content.get_output_windows('input.csv', 'windows', TERMS, windows)
+    stats = instrumentation.StageStats()
+    with internetarchive.WaybackClient() as client:
+        for dates in windows:
+            with open('outputs/windows_{}.csv'.format(
+                      get_content.window_label(dates))) as f:
+                matrix = [line.strip() for line in f]
+            for url, found in zip(urls, matrix):
+                try:
+                    version = get_content.latest_viable(
+                        get_content.find_versions(client, url, dates))
+                except ValueError: # no versions in the window
+                    version = None
+                row = ','.join([''] * len(TERMS))
+                if version is not None:
+                    try:
+                        row = ','.join(map(str, get_content.count_memento(
+                              version.raw_url, TERMS, stats)[1]))
+                    except internetarchive.MementoPlaybackError:
+                        pass
+                assert found == row, (url, dates)
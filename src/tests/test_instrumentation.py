@@ -0,0 +1,46 @@
+'''
+Tests of the instrumentation script
+'''
+from concurrent.futures import ThreadPoolExecutor
+from scripts.synthetic import TERMS, DATES_PRE, DATES_POST
+from scripts import get_content
+from scripts import instrumentation
+from scripts import utils
+import json
+
+def test_no_trace_unless_asked_for(reference_run, monkeypatch):
+    built = []
+    class CountedTrace(instrumentation.RunTrace):
+        def __init__(self, *args, **kwargs):
+            built.append(self)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(instrumentation, 'RunTrace', CountedTrace)
+    urls, _, _ = reference_run(5)
+    assert built == []
+    get_content.get_output('input.csv', 'report', TERMS, DATES_PRE, DATES_POST,
+                           report=True)
+    assert len(built) == 1 and built[0].n == len(urls)
+
+def test_trace_file(reference_run):
+    urls, _, outputs = reference_run(5, trace_file='trace.jsonl')
+    with open('trace.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert [record['url'] for record in records] == urls
+    assert [(record['id'], record['status']) for record in records] == \
+        [snapshot[:2] for snapshot in outputs['snapshots']]
+    assert all(record['counters']['requests'] > 0 for record in records)
+
+def test_null_trace():
+    trace = instrumentation.run_trace()
+    assert isinstance(trace, instrumentation.NullTrace)
+    assert isinstance(instrumentation.run_trace(report=True),
+                      instrumentation.RunTrace)
+
+def test_request_counts_from_threads():
+    before = utils.get_request_counts().get('requests', 0)
+    def count(_):
+        for _ in range(1000):
+            utils._count_request('requests')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(count, range(8)))
+    assert utils.get_request_counts()['requests'] - before == 8000
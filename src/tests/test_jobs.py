@@ -0,0 +1,63 @@
+'''
+Tests of the jobs script
+'''
+from scripts.synthetic import TERMS, DATES_PRE, DATES_POST
+from scripts import get_content
+from scripts import jobs
+import pytest
+
+URLS = ['https://www.hhs.gov/a/', 'https://www.hhs.gov/b/',
+        'http://hhs.gov/a/', 'https://www.hhs.gov/c/']
+
+@pytest.fixture
+def queue(work_dir):
+    with jobs.JobQueue('outputs/jobs.db', lease_seconds=10,
+                       max_attempts=2) as queue:
+        yield queue
+
+def test_add(queue):
+    assert queue.add(URLS, dedupe=True) == 3
+    assert queue.add(URLS, dedupe=True) == 0 # resumed, nothing added
+    assert [(id, positions) for id, _, positions, _, _, _ in queue.results()] \
+        == [(1, [[1, URLS[0]], [3, URLS[2]]]), (2, [[2, URLS[1]]]),
+            (4, [[4, URLS[3]]])]
+
+def test_expired_lease_is_requeued(queue):
+    queue.add(URLS)
+    assert queue.lease('crashed', 2, now=0) == [(1, URLS[0]), (2, URLS[1])]
+    assert queue.lease('other', 4, now=5) == [(3, URLS[2]), (4, URLS[3])]
+    assert queue.lease('other', 1, now=9) == []
+    assert queue.heartbeat('other', now=9) == 2
+    assert queue.requeue_expired(now=11) == 2 # only the crashed worker's
+    assert queue.progress(now=11)['pending'] == 2
+    snapshot = get_content.failed_snapshot(1, URLS[0], TERMS, False, '')
+    assert not queue.complete(1, 'crashed', snapshot, now=11) # lease lost
+    assert queue.lease('other', 4, now=11) == [(1, URLS[0]), (2, URLS[1])]
+    assert queue.complete(1, 'other', snapshot, now=12)
+    assert queue.progress(now=12)['done'] == 1
+
+def test_fails_after_max_attempts(queue):
+    queue.add(URLS[:1])
+    queue.lease('crashed', now=0)
+    queue.lease('crashed', now=11) # requeued, second attempt
+    assert queue.requeue_expired(now=22) == 1
+    assert queue.progress(now=22)['failed'] == 1
+    assert list(queue.results())[0][3:5] == ('failed', 'lease expired')
+    assert queue.requeue() == 1
+    queue.lease('worker', now=23)
+    assert queue.fail(1, 'worker', 'error', now=24)
+    assert queue.progress(now=24)['pending'] == 1
+
+def test_export_matches_get_output(reference_run, read_outputs):
+    urls, _, outputs = reference_run(20, dedupe=True)
+    with jobs.JobQueue('outputs/jobs.db', lease_seconds=1) as queue:
+        queue.add(urls, dedupe=True)
+        lost = queue.lease('crashed', 3)
+    n = jobs.work('outputs/jobs.db', TERMS, DATES_PRE, DATES_POST,
+                  lease_seconds=1, poll_seconds=0.2, worker='worker')
+    with jobs.JobQueue('outputs/jobs.db') as queue:
+        assert n == queue.progress()['done'] == len(queue)
+        attempts = dict(queue._db.execute('SELECT id, attempts FROM jobs'))
+    assert all(attempts[id] == 2 for id, _ in lost)
+    jobs.export('outputs/jobs.db', 'queue', TERMS)
+    assert read_outputs('queue') == outputs
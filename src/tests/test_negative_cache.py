@@ -0,0 +1,77 @@
+'''
+Tests of the negative_cache script
+'''
+from scripts.synthetic import TERMS, DATES_PRE, DATES_POST, synthetic_page
+from scripts.negative_cache import NegativeCache, DAY
+from scripts import internetarchive
+from scripts import get_content
+import random
+
+URL = 'https://www.hhs.gov/programs/index.html'
+
+def test_hits_and_misses(tmp_path):
+    cache = NegativeCache(str(tmp_path / 'cache.pkl'))
+    error = internetarchive.NoVersionsError('no versions')
+    assert cache.add(URL, DATES_PRE, DATES_POST, error, now=0) == 'no_history'
+    assert cache.add(URL, DATES_PRE, DATES_POST, ConnectionError(), now=0) is None
+    # the same SURT key, other date ranges
+    assert cache.get('http://hhs.gov/programs/index.html', DATES_PRE,
+                     DATES_POST, now=DAY)['exception'] is error
+    assert cache.get(URL, DATES_PRE, [2017, 1, 20, 2020, 1, 1], now=DAY) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_expiry(tmp_path):
+    cache = NegativeCache(str(tmp_path / 'cache.pkl'), ttls={'no_viable': DAY})
+    cache.add(URL, DATES_PRE, DATES_POST, '404', now=0) # status of the last version
+    assert cache.get(URL, DATES_PRE, DATES_POST, now=DAY) is not None
+    assert cache.get(URL, DATES_PRE, DATES_POST, now=DAY + 1) is None
+    assert cache.expire(now=DAY + 1) == 1
+    assert len(cache) == 0
+
+def test_persistence(tmp_path):
+    file_name = str(tmp_path / 'cache.pkl')
+    cache = NegativeCache(file_name)
+    cache.add(URL, DATES_PRE, DATES_POST, internetarchive.NoVersionsError('x'))
+    cache.add(URL + '?old', DATES_PRE, DATES_POST, '404', now=0) # expired
+    cache.save()
+    cache = NegativeCache(file_name)
+    assert len(cache) == 1
+    assert cache.get(URL, DATES_PRE, DATES_POST)['class'] == 'no_history'
+    assert cache.revalidate(failure_class='no_history') == 1
+    assert len(cache) == 0
+
+def test_failed_post_fetch_is_cached_with_the_same_rows(archive, read_outputs):
+    '''
+    A viable post version whose memento plays back a 404 fails the url: its
+    row is all Nones in both matrices, the same as when a later run skips it
+    from the cache
+    '''
+    rng = random.Random(0)
+    urls = [URL, 'https://www.hhs.gov/about/index.html']
+    corpus = [{'url': url, 'timestamp': '20160601120000',
+               'body': synthetic_page(rng)} for url in urls]
+    # two captures at the same time: the CDX search selects the 200 one and
+    # the fake archive plays back the 404 one
+    corpus += [{'url': URL, 'timestamp': '20180601120000', 'status': 404},
+               {'url': URL, 'timestamp': '20180601120000', 'body': 'moved'},
+               {'url': urls[1], 'timestamp': '20180601120000',
+                'body': synthetic_page(rng)}]
+    fake_archive = archive(urls, corpus)
+    get_content.get_output('input.csv', 'first', TERMS, DATES_PRE, DATES_POST,
+                           negative_cache=NegativeCache())
+    first = read_outputs('first')
+    assert [s[1] for s in first['snapshots']] == ['failed', 'succesful']
+    assert first['snapshots'][0][2:4] == (None, None)
+    assert first['pre'].splitlines()[0] == ',' * (len(TERMS) - 1)
+    assert first['post'].splitlines()[0] == ',' * (len(TERMS) - 1)
+
+    cache = NegativeCache()
+    assert cache.get(URL, DATES_PRE, DATES_POST)['class'] == 'not_found'
+    fake_archive.stats.update(cdx=0, memento=0)
+    get_content.get_output('input.csv', 'second', TERMS, DATES_PRE, DATES_POST,
+                           negative_cache=cache)
+    assert fake_archive.stats['cdx'] == 2 and fake_archive.stats['memento'] == 2
+    second = read_outputs('second')
+    assert second['pre'] == first['pre'] and second['post'] == first['post']
+    assert [s[:4] for s in second['snapshots']] == \
+        [s[:4] for s in first['snapshots']]
@@ -0,0 +1,159 @@
+'''
+Tests of the sentiment analysis script
+'''
+from scripts import sentiment_analysis
+import numpy as np
+import re
+import pytest
+
+class StubLexicon:
+    '''
+    Stand-in for pysentiment's HIV4 dictionary: the same tokenize (words,
+    stemmed, without stop words) and get_score, with a small lexicon and a
+    crude stemmer
+    '''
+    EPSILON = 1e-6
+
+    def __init__(self):
+        self._posset = {'good', 'help', 'protect', 'fair'}
+        self._negset = {'bad', 'harm', 'discriminat', 'fair'} # fair is both
+        self._stopset = {'the', 'and', 'of', 'januari'}
+
+    def _stem(self, word):
+        for suffix in ['ing', 'ion', 'es', 's', 'e', 'y']:
+            if word.endswith(suffix) and len(word) > len(suffix) + 2:
+                return word[:-len(suffix)] + ('i' if suffix == 'y' else '')
+        return word
+
+    def tokenize(self, text):
+        stems = [self._stem(word) for word in re.findall('[a-z]+', text.lower())]
+        return [stem for stem in stems if stem not in self._stopset]
+
+    def _get_score(self, term):
+        if term in self._posset:
+            return +1
+        elif term in self._negset:
+            return -1
+        else:
+            return 0
+
+    def get_score(self, terms):
+        score_li = np.asarray([self._get_score(t) for t in terms])
+        s_pos = np.sum(score_li[score_li > 0])
+        s_neg = -np.sum(score_li[score_li < 0])
+        return {'Positive': s_pos, 'Negative': s_neg,
+                'Polarity': (s_pos - s_neg) * 1.0 / ((s_pos + s_neg) + self.EPSILON),
+                'Subjectivity': (s_pos + s_neg) * 1.0 / (len(score_li) + self.EPSILON)}
+
+TEXTS = [
+    ['Programs that help and protect youth.', 'Discrimination harms, January 3'],
+    'Good, fair and bad services; the rights of all',
+    ['Nothing to score here'],
+    ['The and of'],
+    [],
+    'Helping, helps, protected: GOOD good good.',
+]
+
+@pytest.fixture
+def lexicon(monkeypatch):
+    lexicon = StubLexicon()
+    monkeypatch.setattr(sentiment_analysis, '_hiv4', lexicon)
+    monkeypatch.setattr(sentiment_analysis, '_worker_scorer', None)
+    return lexicon
+
+def expected_scores(lexicon, texts):
+    scores = []
+    for text in texts:
+        if text is None:
+            scores.append((np.nan, np.nan))
+            continue
+        if not isinstance(text, str):
+            text = ', '.join(text)
+        score = lexicon.get_score(lexicon.tokenize(text))
+        scores.append((score['Polarity'], score['Subjectivity']))
+    return np.array(scores).T
+
+def test_scorer_matches_get_score(lexicon):
+    scorer = sentiment_analysis.HIV4Scorer(lexicon)
+    polarity, subjectivity = scorer.score(TEXTS + [None])
+    expected = expected_scores(lexicon, TEXTS + [None])
+    np.testing.assert_allclose(polarity, expected[0])
+    np.testing.assert_allclose(subjectivity, expected[1])
+    # a term in both lexicons is positive, as in get_score
+    assert scorer.counts(['fair']) == (1, 0, 1)
+
+def test_scorer_words(lexicon):
+    scorer = sentiment_analysis.HIV4Scorer(lexicon)
+    words = [scorer.words(text) for text in TEXTS]
+    np.testing.assert_array_equal(scorer.count_batch(words=words),
+                                  scorer.count_batch(TEXTS))
+    assert scorer.words(['A b', 'C']) == ['a', 'b', 'c']
+
+def test_scores_from_counts():
+    polarity, subjectivity = sentiment_analysis.scores_from_counts(
+        np.array([[3, 1, 8], [0, 0, 0], [np.nan] * 3]))
+    np.testing.assert_allclose(polarity, [2 / (4 + 1e-6), 0, np.nan])
+    np.testing.assert_allclose(subjectivity, [4 / (8 + 1e-6), 0, np.nan])
+
+def test_version_follows_the_lexicon(lexicon):
+    version = sentiment_analysis.HIV4Scorer(lexicon).version
+    assert sentiment_analysis.HIV4Scorer(StubLexicon()).version == version
+    lexicon._negset.add('wors')
+    assert sentiment_analysis.HIV4Scorer(lexicon).version != version
+
+def test_score_batch_keeps_ids_and_order(lexicon):
+    texts = (TEXTS + [None]) * 40
+    ids = np.arange(len(texts)) * 10 + 3
+    expected = expected_scores(lexicon, texts)
+    for processes in [1, 3]:
+        scores = sentiment_analysis.score_batch(texts, ids, processes=processes,
+                                                chunksize=7)
+        np.testing.assert_array_equal(scores['id'], ids)
+        np.testing.assert_allclose(scores['polarity'], expected[0])
+        np.testing.assert_allclose(scores['subjectivity'], expected[1])
+
+def test_cache_reuses_scores(lexicon, work_dir, monkeypatch):
+    texts = TEXTS + [None, TEXTS[0], list(TEXTS[0])]
+    serial = sentiment_analysis.score_batch(texts, processes=1)
+    cache = sentiment_analysis.SentimentCache('outputs/cache.pkl')
+    scores = sentiment_analysis.score_batch(texts, processes=3, chunksize=2,
+                                            cache=cache)
+    for name in ['polarity', 'subjectivity']:
+        np.testing.assert_array_equal(scores[name], serial[name])
+    # duplicate texts are scored once, within the batch
+    assert (cache.hits, cache.misses, len(cache)) == (2, len(TEXTS), len(TEXTS))
+    cache.save()
+    rerun = sentiment_analysis.SentimentCache('outputs/cache.pkl')
+    scored = []
+    count_batch = sentiment_analysis.HIV4Scorer.count_batch
+    monkeypatch.setattr(sentiment_analysis.HIV4Scorer, 'count_batch',
+                        lambda self, texts=None, words=None: scored.extend(
+                            texts) or count_batch(self, texts, words))
+    scores = sentiment_analysis.score_batch(texts, processes=1, cache=rerun)
+    assert scored == []
+    assert (rerun.hits, rerun.misses) == (len(texts) - 1, 0)
+    for name in ['polarity', 'subjectivity']:
+        np.testing.assert_array_equal(scores[name], serial[name])
+
+def test_cache_key_follows_the_lexicon(lexicon):
+    scorer = sentiment_analysis.HIV4Scorer(lexicon)
+    key = sentiment_analysis.SentimentCache.key(['a', 'b'], scorer.version)
+    assert key == sentiment_analysis.SentimentCache.key('a, b', scorer.version)
+    assert key != sentiment_analysis.SentimentCache.key(['a', 'b'], 'other')
+
+def test_get_tone_matches_serial_scores(lexicon, work_dir):
+    import pandas as pd
+    texts = (TEXTS + [None]) * 30
+    df = pd.DataFrame({'id': np.arange(1, len(texts) + 1), 'text': texts,
+                       'department': ['dept-{}'.format(i % 4)
+                                      for i in range(len(texts))]})
+    serial = sentiment_analysis.get_tone(df)
+    has_text = [text is not None for text in texts]
+    expected = expected_scores(lexicon, texts)
+    assert serial['id'] == df.id[has_text].tolist()
+    assert serial['department'] == df.department[has_text].tolist()
+    np.testing.assert_allclose(serial['polarity'], expected[0][has_text])
+    cache = sentiment_analysis.SentimentCache('outputs/cache.pkl')
+    assert sentiment_analysis.get_tone(df, processes=3, cache=cache) == serial
+    assert sentiment_analysis.get_tone(df, processes=3, cache=cache) == serial
+    assert cache.misses == len(TEXTS)
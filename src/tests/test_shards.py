@@ -0,0 +1,38 @@
+'''
+Tests of the shards script
+'''
+from scripts.synthetic import TERMS, DATES_PRE, DATES_POST, synthetic_corpus
+from scripts import get_content
+from scripts import shards
+import os
+import pytest
+
+def test_variants_share_a_shard():
+    url = 'https://www.hhs.gov/programs/index.html'
+    for n_shards in [1, 3, 7]:
+        shard = shards.shard_of(url, n_shards)
+        assert 0 <= shard < n_shards
+        assert shards.shard_of('http://hhs.gov/programs/index.html',
+                               n_shards) == shard
+
+def test_merge_matches_single_node(reference_run, read_outputs):
+    urls, _, outputs = reference_run(20, dedupe=True)
+    crawled = 0
+    for shard in range(3):
+        get_content.get_output('input.csv', 'merged', TERMS, DATES_PRE,
+                               DATES_POST, dedupe=True, shard=(shard, 3))
+        with open('outputs/{}_data.csv'.format(
+                  shards.shard_name('merged', shard, 3))) as f:
+            crawled += len(f.readlines()) - 1
+    assert crawled == len(urls)
+    shards.merge('input.csv', 'merged', 3, remove=True)
+    assert read_outputs('merged') == outputs
+    assert len(os.listdir('outputs')) == 8 # shard outputs removed
+
+def test_merge_missing_shard(archive):
+    urls, corpus = synthetic_corpus(10)
+    archive(urls, corpus)
+    get_content.get_output('input.csv', 'merged', TERMS, DATES_PRE, DATES_POST,
+                           shard=(0, 2))
+    with pytest.raises(FileNotFoundError):
+        shards.merge('input.csv', 'merged', 2)
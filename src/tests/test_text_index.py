@@ -0,0 +1,103 @@
+'''
+Tests of the text index script
+'''
+from scripts.get_content import Snapshot
+from scripts.synthetic import TERMS
+from scripts import text_index
+from scripts import counting
+import pickle
+import pytest
+
+TEXTS = {
+    (1, 'pre'): ['Gender identity and sexual orientation.', 'Gender data'],
+    (1, 'post'): ['Sex and gender data.'],
+    (2, 'pre'): ['Civil rights, gender. Youth identity'],
+    (2, 'post'): ['Health services.'],
+}
+
+def write_snapshots(txt_name, texts=TEXTS):
+    snapshots = []
+    for id in sorted({id for id, _ in texts}):
+        url = 'https://www.hhs.gov/page-{}/'.format(id)
+        snapshot = Snapshot(id, url, url, TERMS, True)
+        for period in text_index.PERIODS:
+            snapshot.__dict__[period]['text'] = texts.get((id, period))
+        snapshot._terms = None
+        snapshots.append(snapshot)
+    with open(txt_name, 'wb') as fp:
+        pickle.dump(snapshots, fp)
+
+@pytest.fixture
+def txt_name(work_dir):
+    write_snapshots('outputs/snapshots_test.txt')
+    with open('departments.csv', 'w') as f:
+        f.write('id,department\n1,HHS\n2,CDC\n')
+    return 'outputs/snapshots_test.txt'
+
+def test_counts_match_term_counts(txt_name):
+    index = text_index.build_index(txt_name)
+    assert len(index) == 4
+    for term in TERMS:
+        expected = {key: counting.count_terms(text, [term])[0][0]
+                    for key, text in TEXTS.items()}
+        assert index.count(term) == {key: n for key, n in expected.items() if n}
+    # phrases do not span two sections
+    assert index.count('orientation gender') == {}
+    assert index.count('gender identity') == {(1, 'pre'): 1}
+
+def test_filters_and_kwic(txt_name):
+    index = text_index.build_index(txt_name, 'departments.csv')
+    assert index.count('gender', department='CDC') == {(2, 'pre'): 1}
+    assert index.count('gender', period='post') == {(1, 'post'): 1}
+    rows = index.kwic('gender', window=2)
+    assert [(row['id'], row['period'], row['department']) for row in rows] == \
+        [(1, 'pre', 'HHS'), (1, 'pre', 'HHS'), (1, 'post', 'HHS'),
+         (2, 'pre', 'CDC')]
+    assert rows[0] == {'id': 1, 'period': 'pre', 'department': 'HHS',
+                       'left': '', 'keyword': 'gender',
+                       'right': 'identity and'}
+    assert len(index.kwic('gender', limit=2)) == 2
+
+def test_add_replaces_and_remove(txt_name):
+    index = text_index.build_index(txt_name)
+    index.add(1, 'post', ['No terms here'])
+    assert index.count('gender', period='post') == {}
+    index.remove(1, 'pre')
+    assert index.count('gender') == {(2, 'pre'): 1}
+    assert len(index) == 3
+
+def test_index_is_reused(txt_name, monkeypatch):
+    index = text_index.get_index(txt_name, department_file='departments.csv')
+    assert index.count('gender', department='HHS')
+    built = []
+    monkeypatch.setattr(text_index, 'build_index',
+                        lambda *args: built.append(args))
+    rerun = text_index.get_index(txt_name, department_file='departments.csv')
+    assert built == []
+    assert rerun.count('gender') == index.count('gender')
+    assert rerun.kwic('sex') == index.kwic('sex')
+
+def test_stale_index_is_rebuilt(txt_name):
+    text_index.get_index(txt_name)
+    texts = dict(TEXTS)
+    texts[(2, 'post')] = ['More gender']
+    write_snapshots(txt_name, texts)
+    index = text_index.get_index(txt_name)
+    assert index.count('gender', period='post') == {(1, 'post'): 1,
+                                                    (2, 'post'): 1}
+
+@pytest.mark.parametrize('damage', [
+    lambda data: data[:len(data) // 2], # partial write
+    lambda data: b'not a pickle' + data, # corrupt
+    lambda data: b'', # empty
+])
+def test_damaged_index_is_rebuilt(txt_name, damage):
+    index_file = 'outputs/snapshots_test_index.pkl'
+    text_index.get_index(txt_name)
+    with open(index_file, 'rb') as fp:
+        data = fp.read()
+    with open(index_file, 'wb') as fp:
+        fp.write(damage(data))
+    index = text_index.get_index(txt_name)
+    assert index.count('gender identity') == {(1, 'pre'): 1}
+    assert text_index.load_index(index_file).count('sex') == index.count('sex')
@@ -0,0 +1,88 @@
+'''
+Tests of the tokenizer script
+'''
+from scripts.synthetic import sentence
+from scripts import tokenizer
+import random
+import pytest
+
+# single sentences, so that nltk's sentence splitting plays no part
+SENTENCES = [
+    ('I wanna.', ['i', 'wan', 'na']),
+    ('I wanna go', ['i', 'wan', 'na', 'go']),
+    ("I wanna' go", ['i', 'wan', 'na', 'go']),
+    ('They wanna-be stars', ['they', 'wannabe', 'stars']),
+    ('wanna/x', ['wannax']),
+    ('gonna-be', ['gon', 'na', 'be']),
+    ('gotta-go lemme-see gimme-that', ['got', 'ta', 'go', 'lem', 'me', 'see',
+                                       'gim', 'me', 'that']),
+    ('She cannot-go', ['she', 'can', 'not', 'go']),
+    ("Don't stop, he's here.", ['do', 'nt', 'stop', 'he', 's', 'here']),
+    ('Gimme a break!', ['gim', 'me', 'a', 'break']),
+    ('We cannot go', ['we', 'can', 'not', 'go']),
+    ('gonna gotta lemme', ['gon', 'na', 'got', 'ta', 'lem', 'me']),
+    ('e-mail the U.S. programs', ['email', 'the', 'us', 'programs']),
+    ('$5,000 in grants: 10:30', ['5000', 'in', 'grants', '1030']),
+    ('"Quoted" (text) [here]', ['quoted', 'text', 'here']),
+    ('Gender identity -- and sexual orientation...',
+     ['gender', 'identity', 'and', 'sexual', 'orientation']),
+]
+
+CONTRACTIONS = ['wanna', 'Wanna', 'gonna', 'gotta', 'lemme', 'gimme', 'cannot',
+                "d'ye", "more'n"]
+# what may follow a word, nltk splits some of it off and keeps the rest
+FOLLOWERS = ['', ' ', '-be', '/x', '_x', '0', '.', '...', ',', ', ok', '!',
+             '?', ':', ';', '"', "'", "''", "'.", ")", '(', "'s", "n't", '--',
+             '*', '@x', '&', '%', '[x]']
+
+def nltk_tokens(section):
+    '''
+    Normalized tokens of nltk's word tokenizer, without sentence splitting
+    (no punkt data needed)
+    '''
+    nltk_tokenize = pytest.importorskip('nltk.tokenize')
+    tokens = [tokenizer.PUNCTUATION.sub('', token.lower()) for token in
+              nltk_tokenize.NLTKWordTokenizer().tokenize(section)]
+    return [token for token in tokens if token]
+
+@pytest.mark.parametrize('section, tokens', SENTENCES)
+def test_regex_tokens(section, tokens):
+    assert tokenizer.tokenize_regex(section) == tokens
+
+@pytest.mark.parametrize('section, tokens', SENTENCES)
+def test_regex_matches_nltk_word_tokenizer(section, tokens):
+    assert nltk_tokens(section) == tokens
+
+@pytest.mark.parametrize('word', CONTRACTIONS)
+def test_contractions_match_nltk(word):
+    for follower in FOLLOWERS:
+        for template in ['I {}{}', 'I {}{} go', '{}{} now.']:
+            section = template.format(word, follower)
+            if '.' in section.rstrip('.'): # a sentence break for nltk
+                continue
+            assert tokenizer.tokenize_regex(section) == nltk_tokens(section), \
+                section
+
+def test_sentences_match_nltk():
+    rng = random.Random(0)
+    for _ in range(200):
+        section = sentence(rng, rng.randint(3, 40)) + rng.choice(['.', '!', ''])
+        assert tokenizer.tokenize_regex(section) == nltk_tokens(section)
+
+def test_parity_with_nltk():
+    pytest.importorskip('nltk')
+    try:
+        tokenizer.tokenize_nltk('Sentence one. Sentence two.')
+    except LookupError:
+        pytest.skip('the nltk punkt data is not installed')
+    rng = random.Random(0)
+    texts = [[sentence(rng, rng.randint(3, 40)) + '.' for _ in range(20)] +
+             [section for section, _ in SENTENCES] for _ in range(20)]
+    sections, mismatches, examples = tokenizer.check_parity(texts)
+    assert sections == 20 * (20 + len(SENTENCES))
+    assert mismatches == 0, examples
+
+def test_normalize_term():
+    assert tokenizer.normalize_term('Gender') == ('gender',)
+    assert tokenizer.normalize_term(['Gender', 'Identity.']) == \
+        ('gender', 'identity')
@@ -0,0 +1,63 @@
+'''
+Tests of the trajectory script
+'''
+from scripts.synthetic import TERMS, history_corpus
+from scripts import instrumentation
+from scripts import get_content
+from scripts import trajectory
+from scripts import counting
+import numpy as np
+import pytest
+
+@pytest.fixture
+def trajectories(archive):
+    '''
+    Runs get_trajectories on a synthetic history in the fake archive, returns
+    the FakeArchive
+    '''
+    urls, corpus = history_corpus(8, 16)
+    fake_archive = archive(urls, corpus)
+    trajectory.get_trajectories('input.csv', 'history', TERMS)
+    return fake_archive
+
+def test_counts_match_each_version(trajectories):
+    data = trajectory.load_trajectories('history')
+    df = trajectory.trajectory_frame(data)
+    assert len(df) == (data['content'] >= 0).sum() > len(data['digests'])
+    stats = instrumentation.StageStats()
+    for row in df.itertuples(index=False):
+        raw_url = '{}/web/{}id_/{}'.format(
+            trajectories.url, row.date.strftime('%Y%m%d%H%M%S'), row.url)
+        _, counts, ttal = get_content.count_memento(raw_url, TERMS, stats)
+        assert (list(row[5:]), row.ttal) == (counts, ttal)
+
+def test_resume_fetches_nothing(trajectories):
+    data = trajectory.load_trajectories('history')
+    trajectories.stats.update(memento=0)
+    trajectory.get_trajectories('input.csv', 'history', TERMS)
+    assert trajectories.stats['memento'] == 0
+    resumed = trajectory.load_trajectories('history')
+    assert set(resumed) == set(data)
+    for name in data:
+        np.testing.assert_array_equal(resumed[name], data[name])
+
+def test_changes_add_up(trajectories):
+    data = trajectory.load_trajectories('history')
+    for i in range(len(data['ids'])):
+        versions = data['content'][data['offsets'][i]:data['offsets'][i + 1]]
+        contents = sorted(set(versions[versions >= 0]))
+        assert trajectory.content_changes(data, contents[0]) is None
+        for previous, c in zip(contents, contents[1:]):
+            changes = trajectory.content_changes(data, c)
+            delta = sum(change['delta'] for change in changes)
+            np.testing.assert_array_equal(
+                data['counts'][previous].astype(np.int64) + delta,
+                data['counts'][c])
+            for term in TERMS:
+                drivers = counting.term_drivers(changes, TERMS, term)
+                assert all(driver[3] for driver in drivers)
+
+def test_changes_of_older_files(trajectories):
+    data = dict(trajectory.load_trajectories('history'))
+    del data['incremental'] # saved before the changes were kept
+    assert trajectory.content_changes(data, 1) is None
@@ -0,0 +1,15 @@
+'''
+Tests of the utils script
+'''
+from scripts import utils
+import numpy as np
+
+def test_term_label():
+    assert utils.term_label('gender') == 'gender'
+    assert utils.term_label(['gender', 'identity']) == 'gender identity'
+
+def test_compact_dtype():
+    assert utils.compact_dtype(np.array([0, 127])) == np.int8
+    assert utils.compact_dtype(np.array([-129, 0])) == np.int16
+    assert utils.compact_dtype(np.array([0, 2 ** 31])) == np.int64
+    assert utils.compact_dtype(np.array([], dtype=int)) == np.int8